@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+bench_async_handlers.py
+- async ハンドラー（AsyncRequestHandler）で独立 I/O を並行に待つ効果をインテント別に測る
+- 同じフェイク上流（bench/fakes.py）で ASYNC_IO_CONCURRENT を on/off して
+  lambda_handler 1回の所要時間（p50/p95）と短縮量を出す
+- GptQueryIntent は同期ハンドラーのまま（対照用）
+
+使い方:
+    python bench/bench_async_handlers.py [--repeat 20] [--s3-ms 40] [--notion-ms 150] [--openai-ms 500]
+"""
+import os
+import argparse
+import statistics
+import time
+
+os.environ.setdefault("ANSWER_CACHE", "0")  # 毎回 LLM まで通す
+
+import fakes  # noqa: E402
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+def _run_session(lf, user_id: str):
+    """検索 → 本文 → 質問 の3ターンを流し、インテントごとの所要時間（ms）を返す。"""
+    ctx = fakes.FakeContext()
+    attrs = {}
+    out = {}
+    for intent, slots in (
+        ("NotionSearchIntent", {"query": "議事録"}),
+        ("NotionReadIntent", {"index": "1"}),
+        ("GptQueryIntent", {"query": "生成AIについて教えて"}),
+    ):
+        ev = fakes.envelope(intent, slots, attrs=attrs, user_id=user_id, session_id="s-" + user_id)
+        t0 = time.perf_counter()
+        resp = lf.lambda_handler(ev, ctx)
+        out[intent] = (time.perf_counter() - t0) * 1000
+        attrs = resp.get("sessionAttributes") or {}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--s3-ms", type=float, default=40)
+    ap.add_argument("--notion-ms", type=float, default=150)
+    ap.add_argument("--openai-ms", type=float, default=500)
+    args = ap.parse_args()
+
+    fakes.LATENCY.update(s3=args.s3_ms / 1000, notion=args.notion_ms / 1000, openai=args.openai_ms / 1000)
+    fakes.install()
+    import async_adapter
+    import lambda_function as lf
+
+    _run_session(lf, "warmup")  # import・クライアント生成・本文キャッシュを温める
+    results = {}
+    for concurrent in (False, True):
+        async_adapter.ASYNC_IO_CONCURRENT = concurrent
+        samples = {}
+        for i in range(args.repeat):
+            for intent, ms in _run_session(lf, f"u{int(concurrent)}-{i}").items():
+                samples.setdefault(intent, []).append(ms)
+        results[concurrent] = samples
+
+    print(f"latency: s3={args.s3_ms:.0f}ms notion={args.notion_ms:.0f}ms openai={args.openai_ms:.0f}ms repeat={args.repeat}")
+    print(f"{'intent':<22}{'seq p50':>10}{'async p50':>11}{'seq p95':>10}{'async p95':>11}{'saved p50':>11}")
+    for intent in results[False]:
+        seq, conc = results[False][intent], results[True][intent]
+        s50, c50 = statistics.median(seq), statistics.median(conc)
+        print(f"{intent:<22}{s50:>10.1f}{c50:>11.1f}{_pct(seq, 95):>10.1f}{_pct(conc, 95):>11.1f}"
+              f"{s50 - c50:>8.1f}ms ({(s50 - c50) / s50 * 100:4.1f}%)")
+
+if __name__ == "__main__":
+    main()
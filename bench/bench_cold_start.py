@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+bench_cold_start.py
+- コールドスタートの計測: 新しいプロセスで lambda_function を import してから最初の応答まで
+- LaunchRequest と GptQueryIntent を、それぞれ毎回別プロセスで --runs 回ずつ測る
+- OpenAI はこのプロセスで立てるローカル HTTP サーバー（即応答）に向ける。
+  S3 は実際の boto3 クライアントを作るが、S3_BUCKET を空にしてネットワークには出さない
+  （import・クライアント生成のコストだけが乗る）
+- --profile を付けると子プロセスを PICO_IMPORT_PROFILE=1 で動かし、初期化時と最初の応答までの
+  import 時間も出す（計測フック自体のコストが乗るので、所要時間の比較は付けずに測る）
+
+使い方:
+    python bench/bench_cold_start.py [--runs 5] [--profile] [--lambda-dir path/to/lambda]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = {
+    "LaunchRequest": (None, None, "LaunchRequest"),
+    "GptQueryIntent": ("GptQueryIntent", {"query": "生成AIについて教えて"}, "IntentRequest"),
+}
+_PROFILE_RE = re.compile(r"\[import-profile\] phase=(\S+) import_ms=([\d.]+)")
+
+# ==== 子プロセス側 ====
+def _child(scenario: str, lambda_dir: str) -> None:
+    import fakes  # 標準ライブラリだけで読める
+    sys.path.insert(0, lambda_dir)
+    import logging
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(message)s")
+    intent, slots, request_type = SCENARIOS[scenario]
+    event = fakes.envelope(intent, slots, request_type=request_type)
+
+    t0 = time.perf_counter()
+    import lambda_function
+    t1 = time.perf_counter()
+    resp = lambda_function.lambda_handler(event, fakes.FakeContext())
+    t2 = time.perf_counter()
+    ssml = (((resp or {}).get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+    print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_ms": (t2 - t1) * 1000,
+                      "total_ms": (t2 - t0) * 1000, "ok": bool(ssml)}))
+
+# ==== 親プロセス側 ====
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    """chat.completions だけ返すローカルサーバー（ストリーミングにも対応）。"""
+    protocol_version = "HTTP/1.1"
+    text = "生成AIは文章や画像を作るAIだよ。"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        n = int(self.headers.get("content-length") or 0)
+        req = json.loads(self.rfile.read(n) or b"{}")
+        if req.get("stream"):
+            chunks = [
+                {"choices": [{"index": 0, "delta": {"content": self.text}, "finish_reason": None}]},
+                {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+            ]
+            body = "".join("data: " + json.dumps(dict(c, id="b", object="chat.completion.chunk", created=0, model="m"),
+                                                 ensure_ascii=False) + "\n\n" for c in chunks)
+            body = (body + "data: [DONE]\n\n").encode("utf-8")
+            ctype = "text/event-stream"
+        else:
+            body = json.dumps({"id": "b", "object": "chat.completion", "created": 0, "model": "m",
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": self.text}}]},
+                              ensure_ascii=False).encode("utf-8")
+            ctype = "application/json"
+        self.send_response(200)
+        self.send_header("content-type", ctype)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def _run_child(scenario: str, lambda_dir: str, port: int, profile: bool = False):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "S3_BUCKET": "",
+        "NOTION_TOKEN": "",
+        "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1", "AWS_EC2_METADATA_DISABLED": "true",
+        "PROGRESSIVE_RESPONSE": "0",
+        "PICO_IMPORT_PROFILE": "1" if profile else "0",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scenario, "--lambda-dir", lambda_dir],
+                          cwd=HERE, env=env, capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    for phase, ms in _PROFILE_RE.findall(proc.stderr):
+        out[f"profile_{phase}_ms"] = float(ms)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--lambda-dir", default=os.path.join(HERE, "..", "lambda"))
+    ap.add_argument("--profile", action="store_true")
+    ap.add_argument("--child", choices=sorted(SCENARIOS))
+    args = ap.parse_args()
+    lambda_dir = os.path.abspath(args.lambda_dir)
+    if args.child:
+        _child(args.child, lambda_dir)
+        return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _run_child("LaunchRequest", lambda_dir, server.server_port)  # .pyc 作成などの初回分を捨てる
+
+    print(f"lambda_dir={lambda_dir} runs={args.runs}")
+    print(f"{'scenario':<16}{'import p50':>12}{'first resp p50':>16}{'total p50':>11}{'total max':>11}"
+          f"{'init imports':>14}{'lazy imports':>14}")
+    for scenario in SCENARIOS:
+        runs = [_run_child(scenario, lambda_dir, server.server_port, args.profile) for _ in range(args.runs)]
+        if not all(r["ok"] for r in runs):
+            print(f"{scenario}: response without speech")
+
+        def med(key):
+            vals = [r[key] for r in runs if key in r]
+            return statistics.median(vals) if vals else float("nan")
+        print(f"{scenario:<16}{med('import_ms'):>12.1f}{med('first_ms'):>16.1f}{med('total_ms'):>11.1f}"
+              f"{max(r['total_ms'] for r in runs):>11.1f}{med('profile_init_ms'):>14.1f}"
+              f"{med('profile_first-request_ms'):>14.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+bench_intents.py
+- インテント別のレイテンシ・ベンチマーク（デプロイ前のリグレッション確認用）
+- INTENTS_WITH_QUERY の全インテントと Notion 系インテント（＋起動・続けて・絞り込み）の
+  envelope を作り、lambda_function.lambda_handler を直接呼ぶ
+- OpenAI / Notion / S3 は bench/fakes.py のプロセス内フェイク（レイテンシ・失敗率を指定できる）
+- インテントごとに p50/p95/p99 と、1ターンあたりの上流呼び出し数（OpenAI / Notion / S3）を出す
+- --save で結果を JSON に保存し、--baseline でその JSON と比べて p95 の悪化が
+  --max-regression-pct を超えたら終了コード 1 で終わる
+
+使い方:
+    python bench/bench_intents.py [--iterations 30] [--latency openai=0.5,notion=0.15,s3=0.04]
+        [--jitter 0.3] [--fail openai=0.05,notion=0.1,s3=0.0] [--seed 1]
+        [--save out.json] [--baseline base.json] [--max-regression-pct 20]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("ANSWER_CACHE", "0")  # 同じ質問を繰り返すので、既定では回答キャッシュを切る
+os.environ.setdefault("NOTION_DEFAULT_PARENT_ID", "bench-parent")
+os.environ.setdefault("NOTION_DEFAULT_DATABASE_ID", "bench-database")
+
+import fakes  # noqa: E402
+
+QUERIES = ["生成AIについて教えて", "今日の献立を考えて", "やる気が出ない", "東京の観光地", "プログラミングの始め方"]
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+def _parse_kv(text: str):
+    out = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = float(v)
+    return out
+
+def _script(intents_with_query, i: int):
+    """1セッション分のターン（intent 名, slots, request_type）。"""
+    q = QUERIES[i % len(QUERIES)]
+    turns = [("LaunchRequest", None, "LaunchRequest")]
+    turns += [(name, {"query": q}, "IntentRequest") for name in sorted(intents_with_query)]
+    turns += [
+        ("ContinuationIntent", {}, "IntentRequest"),
+        ("RefineIntent", {"filter": "初心者向け"}, "IntentRequest"),
+        ("NotionSearchIntent", {"query": "議事録"}, "IntentRequest"),
+        ("NotionReadIntent", {"index": "1"}, "IntentRequest"),
+        ("NotionCreatePageIntent", {"title": f"メモ{i}", "content": q}, "IntentRequest"),
+        ("NotionAddToDatabaseIntent", {"title": f"タスク{i}", "content": q}, "IntentRequest"),
+    ]
+    return turns
+
+def run(iterations: int):
+    import lambda_function as lf
+    from convo_core import ERROR_SPEECH
+
+    samples, calls, errors = {}, {}, {}
+    ctx = fakes.FakeContext()
+    for i in range(iterations + 1):
+        attrs = None
+        user = f"bench-{i}"
+        for name, slots, request_type in _script(lf.INTENTS_WITH_QUERY, i):
+            ev = fakes.envelope(None if request_type == "LaunchRequest" else name, slots, attrs=attrs,
+                                request_type=request_type, user_id=user, session_id="s-" + user)
+            fakes.reset_calls()
+            t0 = time.perf_counter()
+            resp = lf.lambda_handler(ev, ctx)
+            ms = (time.perf_counter() - t0) * 1000
+            attrs = resp.get("sessionAttributes") or {}
+            if i == 0:
+                continue  # 1周目は import・クライアント生成込みなので捨てる
+            samples.setdefault(name, []).append(ms)
+            calls.setdefault(name, []).append(dict(fakes.CALLS))
+            ssml = ((resp.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+            errors[name] = errors.get(name, 0) + int(not ssml or ERROR_SPEECH[:10] in ssml or "失敗" in ssml)
+
+    report = {}
+    for name, xs in samples.items():
+        per_turn = {k: statistics.mean(c[k] for c in calls[name]) for k in fakes.CALLS}
+        report[name] = {
+            "n": len(xs), "p50": statistics.median(xs), "p95": _pct(xs, 95), "p99": _pct(xs, 99), "max": max(xs),
+            "calls": per_turn, "error_rate": errors.get(name, 0) / len(xs),
+        }
+    return report
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=30)
+    ap.add_argument("--latency", default="openai=0.5,notion=0.15,s3=0.04", help="上流ごとの秒数")
+    ap.add_argument("--jitter", type=float, default=0.3, help="レイテンシのばらつき（±割合）")
+    ap.add_argument("--fail", default="", help="上流ごとの失敗率 例: openai=0.05,notion=0.1")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--save")
+    ap.add_argument("--baseline")
+    ap.add_argument("--max-regression-pct", type=float, default=20.0)
+    args = ap.parse_args()
+
+    fakes.LATENCY.update(_parse_kv(args.latency))
+    fakes.FAILURES.update(_parse_kv(args.fail))
+    fakes.JITTER = args.jitter
+    fakes.seed(args.seed)
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)  # EMF 行は出さない（計測のコストは本番どおり残す）
+
+    report = run(args.iterations)
+    print(f"latency={fakes.LATENCY} jitter={fakes.JITTER} failures={fakes.FAILURES} iterations={args.iterations}")
+    print(f"{'intent':<28}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'openai':>8}{'notion':>8}{'s3':>6}{'err%':>7}")
+    for name, r in report.items():
+        c = r["calls"]
+        print(f"{name:<28}{r['p50']:>8.1f}{r['p95']:>8.1f}{r['p99']:>8.1f}{r['max']:>8.1f}"
+              f"{c['openai']:>8.2f}{c['notion']:>8.2f}{c['s3']:>6.2f}{r['error_rate'] * 100:>6.1f}%")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        worse = []
+        for name, r in report.items():
+            b = base.get(name)
+            if not b or not b["p95"]:
+                continue
+            pct = (r["p95"] - b["p95"]) / b["p95"] * 100
+            if pct > args.max_regression_pct:
+                worse.append(f"{name}: p95 {b['p95']:.1f} -> {r['p95']:.1f}ms (+{pct:.0f}%)")
+        if worse:
+            print("REGRESSION\n  " + "\n  ".join(worse))
+            sys.exit(1)
+        print(f"no p95 regression over {args.max_regression_pct:.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+bench_llm_hedge.py
+- OpenAI のヘッジ（llm_hedge）のベンチマーク: 遅いテールのある上流で、ヘッジなし／同じモデルでヘッジ／
+  速いフォールバックモデルでヘッジ を比べる
+- 上流は bench/fakes.py のフェイク OpenAI（--tail の確率で --tail の倍率ぶん遅くなる）
+- convo_core.answer_with_resume（ストリーミング）を1リクエスト分の予算の中で呼ぶ。モードごとに最初の
+  --warmup 回は測らない（ヘッジの待ち時間はこの間に溜まった直近のレイテンシから決まる）
+- 出すもの: p50/p95/p99/max、答えが空だった割合、ヘッジした割合、ヘッジが勝った割合、
+  1回あたりの追加トークン、1回あたりの OpenAI 呼び出し数
+
+使い方:
+    python bench/bench_llm_hedge.py [--calls 120] [--warmup 30] [--latency 0.5] [--tail 0.1,6]
+        [--fallback-model gpt-fast] [--fallback-latency 0.3] [--percentile 90] [--modes off,same,fallback]
+"""
+import os
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("ANSWER_CACHE", "0")
+
+import fakes  # noqa: E402
+from bench_intents import _pct  # noqa: E402
+
+def run_mode(mode: str, args):
+    import convo_core
+    import llm_hedge
+    import llm_latency
+    import model_router
+    from deadline import request_deadline
+    from config import HARD_DEADLINE_SEC, OPENAI_MODEL
+
+    convo_core.OPENAI_HEDGE = mode != "off"
+    llm_hedge.OPENAI_HEDGE_MODEL = args.fallback_model if mode == "fallback" else ""
+    llm_hedge.OPENAI_HEDGE_PERCENTILE = args.percentile
+    llm_latency.reset()
+    model_router.MODEL_ROUTING_ADAPTIVE = False  # ヘッジだけを比べる（経路の適応は bench_model_routes）
+
+    ms, empty = [], 0
+    before = None
+    for i in range(args.warmup + args.calls):
+        if i == args.warmup:
+            before = dict(llm_hedge.HEDGE_STATS)
+            fakes.reset_calls()
+        session = {"history": []}
+        t0 = time.perf_counter()
+        with request_deadline(HARD_DEADLINE_SEC):
+            text = convo_core.answer_with_resume(session, f"生成AIについて教えて {i}")
+        if i >= args.warmup:
+            ms.append((time.perf_counter() - t0) * 1000)
+            empty += int(not text)
+    calls = fakes.CALLS["openai"]
+    st = {k: llm_hedge.HEDGE_STATS[k] - before[k] for k in before}
+    n = len(ms)
+    delay = llm_hedge.hedge_delay(OPENAI_MODEL)
+    print(f"{mode:<9}{statistics.median(ms):>8.1f}{_pct(ms, 95):>8.1f}{_pct(ms, 99):>8.1f}{max(ms):>8.1f}"
+          f"{empty / n * 100:>7.1f}%{st['fired'] / n * 100:>8.1f}%{st['hedge_wins'] / max(1, st['fired']) * 100:>8.1f}%"
+          f"{(st['extra_prompt_tokens'] + st['extra_completion_tokens']) / n:>9.1f}{calls / n:>7.2f}"
+          f"{delay if mode != 'off' else 0:>8.2f}s")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=120)
+    ap.add_argument("--warmup", type=int, default=30)
+    ap.add_argument("--latency", type=float, default=0.5, help="OPENAI_MODEL の秒数")
+    ap.add_argument("--jitter", type=float, default=0.3)
+    ap.add_argument("--tail", default="0.1,6", help="遅い呼び出しの確率,倍率")
+    ap.add_argument("--fallback-model", default="gpt-fast")
+    ap.add_argument("--fallback-latency", type=float, default=0.3)
+    ap.add_argument("--percentile", type=float, default=90.0)
+    ap.add_argument("--modes", default="off,same,fallback")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    prob, factor = (float(x) for x in args.tail.split(","))
+    fakes.LATENCY["openai"] = args.latency
+    fakes.OPENAI_MODEL_LATENCY[args.fallback_model] = args.fallback_latency
+    fakes.TAIL["openai"] = (prob, factor)
+    fakes.JITTER = args.jitter
+    fakes.seed(args.seed)
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+
+    print(f"latency={args.latency}s jitter={args.jitter} tail={prob:.0%} x{factor} "
+          f"fallback={args.fallback_model}@{args.fallback_latency}s p{args.percentile:.0f} calls={args.calls}")
+    print(f"{'mode':<9}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'empty%':>8}{'hedged':>9}{'h.wins':>9}"
+          f"{'+tokens':>9}{'calls':>7}{'delay':>9}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        fakes.seed(args.seed)
+        run_mode(mode, args)
+
+if __name__ == "__main__":
+    main()
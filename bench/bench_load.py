@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+bench_load.py
+- 同時接続の負荷試験: 対話モデル（skill-package/interactionModels/custom/*.json）のサンプル発話から
+  複数ターンのセッションを合成し、--concurrency 本のスレッドで同時に lambda_handler へ流す
+  - 発話テンプレートを1つ選び、{slot} のあるスロットだけ値を埋める（「はい」「続けて」は空スロット）
+  - 値は AMAZON.SearchQuery なら言語ごとの話題リスト、独自型（NOTION_POSITION 等）はモデルの values、
+    AMAZON.NUMBER は 1〜3
+- 会話パターン（検索 → 本文 → 続けて、質問 → 詳しく → 続けて、保存 など）はロケールに
+  そのインテントがあるものだけ使う（en-US は質問系のみ）
+- 上流は bench/fakes.py のフェイク。sessionAttributes はターン間で引き継ぐ
+- 出すもの: 全体のスループット（ターン/秒・セッション/秒）、パターン別の p50/p95/p99、
+  ターン番号ごとの sessionAttributes の JSON サイズ（中央値・最大。セッションが太っていくかを見る）
+
+使い方:
+    python bench/bench_load.py [--sessions 200] [--concurrency 16] [--locales ja-JP,en-US]
+        [--latency openai=0.5,notion=0.15,s3=0.04] [--jitter 0.3] [--fail openai=0.02] [--seed 1]
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("ANSWER_CACHE", "0")  # 同じ話題が何度も出るので、既定では回答キャッシュを切る
+os.environ.setdefault("NOTION_DEFAULT_PARENT_ID", "bench-parent")
+os.environ.setdefault("NOTION_DEFAULT_DATABASE_ID", "bench-database")
+
+import fakes  # noqa: E402
+from bench_intents import _pct, _parse_kv  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(HERE, "..", "skill-package", "interactionModels", "custom")
+
+TOPICS = {
+    "ja-JP": ["生成AI", "量子コンピューター", "睡眠の質", "カレーの作り方", "東京の観光地", "React",
+              "読書の習慣", "猫の飼い方", "宇宙の始まり", "英語の勉強法", "議事録", "週次レポート"],
+    "en-US": ["generative AI", "quantum computing", "sleep quality", "curry recipes", "Tokyo sightseeing",
+              "React", "reading habits", "cat care", "the origin of the universe", "learning English"],
+}
+FILTERS = {"ja-JP": ["初心者向け", "三行で", "子ども向け", "最新の情報", "具体例つき"]}
+
+# パターン名 -> ターン列（"Launch" は LaunchRequest、それ以外はインテント名）
+PATTERNS = {
+    "search_read_continue": ["Launch", "NotionSearchIntent", "NotionReadIntent", "ContinuationIntent",
+                             "ContinuationIntent"],
+    "qa_detail_continue": ["Launch", "*query", "DetailRequestIntent", "ContinuationIntent", "RefineIntent"],
+    "qa_chain": ["Launch", "*query", "*query", "*query", "*query", "*query", "*query"],
+    "save_notes": ["Launch", "*query", "NotionCreatePageIntent", "NotionAddToDatabaseIntent"],
+}
+WEIGHTS = {"search_read_continue": 4, "qa_detail_continue": 3, "qa_chain": 2, "save_notes": 1}
+# "*query" に入れる質問系インテント（ロケールにあるものから選ぶ）
+QUERY_INTENTS = ["GptQueryIntent", "CreativeIntent", "EntertainmentIntent", "EmotionalIntent", "AnalysisIntent",
+                 "HelpIntent", "PhilosophicalIntent", "PracticalIntent"]
+_SLOT_RE = re.compile(r"\{(\w+)\}")
+
+class LocaleModel:
+    """1ロケール分の対話モデル: インテント -> (サンプル発話, スロット名 -> 型)。"""
+
+    def __init__(self, locale: str):
+        with open(os.path.join(MODEL_DIR, f"{locale}.json"), "r", encoding="utf-8") as f:
+            lm = json.load(f)["interactionModel"]["languageModel"]
+        self.locale = locale
+        self.intents = {
+            it["name"]: (it.get("samples") or [], {s["name"]: s["type"] for s in it.get("slots") or []})
+            for it in lm["intents"]
+        }
+        self.types = {t["name"]: [v["name"]["value"] for v in t.get("values") or []] for t in lm.get("types") or []}
+
+    def query_intents(self):
+        return [n for n in QUERY_INTENTS if n in self.intents]
+
+    def supports(self, pattern: str) -> bool:
+        return all(t in ("Launch", "*query") or t in self.intents for t in PATTERNS[pattern])
+
+    def slot_value(self, rng: random.Random, slot: str, slot_type: str) -> str:
+        if slot_type == "AMAZON.NUMBER":
+            return str(rng.randint(1, 3))
+        if slot_type in self.types:
+            return rng.choice(self.types[slot_type])
+        if slot == "filter":
+            return rng.choice(FILTERS.get(self.locale) or TOPICS[self.locale])
+        return rng.choice(TOPICS[self.locale])
+
+    def utterance(self, rng: random.Random, intent: str):
+        """サンプル発話を1つ選び、そこに出てくるスロットだけ埋めた slots を返す。"""
+        samples, slot_types = self.intents[intent]
+        sample = rng.choice(samples) if samples else ""
+        slots = {}
+        for name in _SLOT_RE.findall(sample):
+            slots[name] = self.slot_value(rng, name, slot_types.get(name, "AMAZON.SearchQuery"))
+        if intent in ("NotionCreatePageIntent", "NotionAddToDatabaseIntent"):
+            # 保存系は題名と内容の両方が要るので、テンプレートに関係なく埋める
+            slots.setdefault("title", self.slot_value(rng, "title", "AMAZON.SearchQuery"))
+            slots.setdefault("content", self.slot_value(rng, "content", "AMAZON.SearchQuery") + "についてのメモ")
+        return sample, slots
+
+def synthesize(models, n: int, seed: int):
+    """(パターン名, ロケール, [(intent or None, slots, request_type), ...]) を n 個作る。"""
+    rng = random.Random(seed)
+    choices = [(m, p) for m in models for p in PATTERNS if m.supports(p)]
+    weights = [WEIGHTS[p] for _, p in choices]
+    sessions = []
+    for _ in range(n):
+        model, pattern = rng.choices(choices, weights)[0]
+        turns = []
+        for step in PATTERNS[pattern]:
+            if step == "Launch":
+                turns.append((None, None, "LaunchRequest"))
+                continue
+            intent = rng.choice(model.query_intents()) if step == "*query" else step
+            _, slots = model.utterance(rng, intent)
+            turns.append((intent, slots, "IntentRequest"))
+        sessions.append((pattern, model.locale, turns))
+    return sessions
+
+def _run_session(lf, idx: int, session):
+    from convo_core import ERROR_SPEECH
+    pattern, locale, turns = session
+    user = f"load-{idx}"
+    ctx = fakes.FakeContext()
+    attrs = None
+    out = []  # (turn 番号, ms, sessionAttributes のバイト数, エラーか)
+    for i, (intent, slots, request_type) in enumerate(turns):
+        ev = fakes.envelope(intent, slots, attrs=attrs, request_type=request_type,
+                            user_id=user, session_id="s-" + user, locale=locale)
+        t0 = time.perf_counter()
+        try:
+            resp = lf.lambda_handler(ev, ctx)
+        except Exception:
+            out.append((i, (time.perf_counter() - t0) * 1000, 0, True))
+            break
+        ms = (time.perf_counter() - t0) * 1000
+        attrs = resp.get("sessionAttributes") or {}
+        size = len(json.dumps(attrs, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        ssml = ((resp.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+        out.append((i, ms, size, not ssml or ERROR_SPEECH[:10] in ssml))
+    return pattern, locale, out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--locales", default="ja-JP,en-US")
+    ap.add_argument("--latency", default="openai=0.5,notion=0.15,s3=0.04", help="上流ごとの秒数")
+    ap.add_argument("--jitter", type=float, default=0.3, help="レイテンシのばらつき（±割合）")
+    ap.add_argument("--fail", default="", help="上流ごとの失敗率 例: openai=0.02,notion=0.05")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    fakes.LATENCY.update(_parse_kv(args.latency))
+    fakes.FAILURES.update(_parse_kv(args.fail))
+    fakes.JITTER = args.jitter
+    fakes.seed(args.seed)
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+    import lambda_function as lf
+
+    models = [LocaleModel(loc.strip()) for loc in args.locales.split(",") if loc.strip()]
+    sessions = synthesize(models, args.sessions, args.seed)
+    _run_session(lf, -1, sessions[0])  # import・クライアント生成を温める
+
+    lock = threading.Lock()
+    results = []
+
+    def worker(idx):
+        r = _run_session(lf, idx, sessions[idx])
+        with lock:
+            results.append(r)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(len(sessions))))
+    wall = time.perf_counter() - t0
+
+    turns = sum(len(r[2]) for r in results)
+    all_ms = [ms for r in results for _, ms, _, _ in r[2]]
+    errors = sum(err for r in results for _, _, _, err in r[2])
+    print(f"latency={fakes.LATENCY} jitter={fakes.JITTER} failures={fakes.FAILURES} "
+          f"sessions={len(results)} concurrency={args.concurrency}")
+    print(f"throughput: {turns / wall:.1f} turns/s, {len(results) / wall:.2f} sessions/s "
+          f"(wall {wall:.1f}s, {turns} turns, err {errors / max(1, turns) * 100:.1f}%)")
+    print(f"overall: p50={statistics.median(all_ms):.1f} p95={_pct(all_ms, 95):.1f} p99={_pct(all_ms, 99):.1f} "
+          f"max={max(all_ms):.1f} ms")
+
+    by_pattern = {}
+    for pattern, locale, out in results:
+        by_pattern.setdefault((pattern, locale), []).append(out)
+    print(f"\n{'pattern':<22}{'locale':<7}{'n':>5}{'p50':>8}{'p95':>8}{'p99':>8}{'err%':>7}  session bytes by turn (p50/max)")
+    for (pattern, locale), runs in sorted(by_pattern.items()):
+        ms = [m for out in runs for _, m, _, _ in out]
+        err = sum(e for out in runs for _, _, _, e in out)
+        sizes = {}
+        for out in runs:
+            for i, _, size, _ in out:
+                sizes.setdefault(i, []).append(size)
+        growth = " ".join(f"{int(statistics.median(sizes[i]))}/{max(sizes[i])}" for i in sorted(sizes))
+        print(f"{pattern:<22}{locale:<7}{len(runs):>5}{statistics.median(ms):>8.1f}{_pct(ms, 95):>8.1f}"
+              f"{_pct(ms, 99):>8.1f}{err / len(ms) * 100:>6.1f}%  {growth}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+bench_model_routes.py
+- インテント別のモデル経路（model_router）のベンチマーク: 質問系インテント（INTENTS_WITH_QUERY）を
+  lambda_handler に流し、次の3つを比べる
+  - single  : 全インテント OPENAI_MODEL（経路表なし・適応なし。これまでの動き）
+  - table   : 既定の経路表（短い応答は OPENAI_FAST_MODEL）・適応なし
+  - adaptive: 既定の経路表 + 直近の p95 / 残り予算で速いモデルに落とす
+- 上流は bench/fakes.py のフェイク OpenAI。OPENAI_MODEL は --latency 秒で、--tail の確率で倍率ぶん遅くなる
+  （予算を超える遅さなら答えが間に合わない）。OPENAI_FAST_MODEL は --fast-latency 秒
+- --degrade 開始,終了,秒: ターンのこの割合の間だけ OPENAI_MODEL が遅くなる（劣化と回復）
+- 出すもの: インテントごとの p50/p95 と「答えを取れなかった」割合、劣化の前・中・後ごとの p50/p95 と割合、
+  モード全体の p95 と、経路の決定（モデル:理由）の内訳
+
+使い方:
+    python bench/bench_model_routes.py [--turns 240] [--concurrency 8] [--latency 0.6] [--fast-latency 0.2]
+        [--tail 0.05,8] [--degrade 0.33,0.67,3.5] [--modes single,table,adaptive] [--seed 1]
+"""
+import os
+import time
+import random
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("ANSWER_CACHE", "0")
+os.environ.setdefault("PREGEN_MODE", "off")  # 「続き」の先回り生成は経路の比較に混ぜない
+os.environ.setdefault("OPENAI_FAST_MODEL", "gpt-4o-mini")  # 既定は OPENAI_MODEL と同じ（落とし先が無い）なので別のモデルを置く
+
+import fakes  # noqa: E402
+from bench_intents import _pct  # noqa: E402
+
+def _turn(lf, i: int, intent: str, latency: float = 0.0):
+    from convo_core import ERROR_SPEECH
+    if latency:
+        fakes.LATENCY["openai"] = latency
+    ev = fakes.envelope(intent, {"query": f"生成AIについて教えて {i}"}, user_id=f"route-{i}", session_id=f"s-route-{i}")
+    t0 = time.perf_counter()
+    resp = lf.lambda_handler(ev, fakes.FakeContext())
+    ms = (time.perf_counter() - t0) * 1000
+    ssml = ((resp.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+    return intent, ms, (not ssml or ERROR_SPEECH[:10] in ssml)
+
+def run_mode(lf, mode: str, intents, args):
+    import model_router
+    import llm_latency
+    model_router.set_table({} if mode == "single" else model_router.DEFAULT_TABLE)
+    model_router.MODEL_ROUTING_ADAPTIVE = mode == "adaptive"
+    model_router.ROUTE_STATS.clear()
+    llm_latency.reset()
+    fakes.seed(args.seed)
+    rng = random.Random(args.seed)
+    start, end, slow = (float(x) for x in args.degrade.split(","))
+    plan = [(i, rng.choice(intents), slow if start * args.turns <= i < end * args.turns else args.latency)
+            for i in range(args.turns)]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda a: _turn(lf, *a), plan))
+    fakes.LATENCY["openai"] = args.latency
+
+    by_intent = {}
+    for intent, ms, err in results:
+        by_intent.setdefault(intent, []).append((ms, err))
+    all_ms = [ms for _, ms, _ in results]
+    err = sum(e for _, _, e in results)
+    print(f"\n[{mode}] p50={statistics.median(all_ms):.1f} p95={_pct(all_ms, 95):.1f} ms "
+          f"failed={err / len(results) * 100:.1f}%  routes={dict(sorted(model_router.ROUTE_STATS.items()))}")
+    for name, lo, hi in (("before", 0, start), ("degraded", start, end), ("after", end, 1.0)):
+        part = [r for (i, _, _), r in zip(plan, results) if lo * args.turns <= i < hi * args.turns]
+        if part:
+            xs = [ms for _, ms, _ in part]
+            print(f"  ({name}){'':<{20 - len(name)}}{len(xs):>5}{statistics.median(xs):>9.1f}{_pct(xs, 95):>9.1f}"
+                  f"{sum(e for _, _, e in part) / len(part) * 100:>7.1f}%")
+    for intent in sorted(by_intent):
+        xs = [m for m, _ in by_intent[intent]]
+        fails = sum(e for _, e in by_intent[intent])
+        print(f"  {intent:<22}{len(xs):>5}{statistics.median(xs):>9.1f}{_pct(xs, 95):>9.1f}"
+              f"{fails / len(xs) * 100:>7.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=240)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--latency", type=float, default=0.6, help="OPENAI_MODEL の秒数")
+    ap.add_argument("--fast-latency", type=float, default=0.2, help="OPENAI_FAST_MODEL の秒数")
+    ap.add_argument("--jitter", type=float, default=0.3)
+    ap.add_argument("--tail", default="0.05,8", help="遅い呼び出しの確率,倍率（OPENAI_MODEL のみ）")
+    ap.add_argument("--degrade", default="0.33,0.67,3.5", help="OPENAI_MODEL が遅くなる区間（割合）,秒")
+    ap.add_argument("--modes", default="single,table,adaptive")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    from config import OPENAI_FAST_MODEL
+    prob, factor = (float(x) for x in args.tail.split(","))
+    fakes.LATENCY["openai"] = args.latency
+    fakes.OPENAI_MODEL_LATENCY[OPENAI_FAST_MODEL] = args.fast_latency
+    fakes.TAIL["openai"] = (prob, factor)
+    fakes.TAIL_EXEMPT.add(OPENAI_FAST_MODEL)
+    fakes.JITTER = args.jitter
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+    import lambda_function as lf
+
+    intents = sorted(lf.INTENTS_WITH_QUERY)
+    print(f"latency={args.latency}s fast={OPENAI_FAST_MODEL}@{args.fast_latency}s tail={prob:.0%} x{factor} "
+          f"degrade={args.degrade} "
+          f"turns={args.turns} concurrency={args.concurrency}")
+    print(f"  {'intent':<22}{'n':>5}{'p50':>9}{'p95':>9}{'fail%':>8}")
+    _turn(lf, -1, intents[0])  # import・クライアント生成を温める
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        run_mode(lf, mode, intents, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+bench_notion_rate.py
+- Notion のレート制限（notion_rate）のベンチマーク: 1つのインテグレーションを共有する負荷で、
+  ユーザーが待つ呼び出しがどれだけ 429 に巻き込まれるかを、制限なし／コンテナ内のトークンバケットで比べる
+- フェイク Notion は --server-rps を超えると 429 + Retry-After を返す（bench/fakes.py の NOTION_RATE_LIMIT）
+- 負荷は2種類を同時に流す
+  - 対話: --users 本のスレッドが「Notionで◯◯を探して」→「1件目の本文を読んで」を lambda_handler に送り続ける
+    （検索のたびに上位3件の本文の先読み = prefetch の優先度の呼び出しが出る）
+  - 裏の書き込み: --writers 本のスレッドが background の優先度で notion_append_blocks を送り続ける（outbox 相当）
+- 出すもの: 対話ターンの p50/p95、混雑で答えられなかったターンの割合、受けた 429 の数、
+  書き込みの成功数、順番待ちの回数と合計時間
+
+使い方:
+    python bench/bench_notion_rate.py [--seconds 15] [--users 4] [--writers 2] [--server-rps 3]
+        [--modes off,local] [--rps 3] [--burst 3] [--latency notion=0.15,s3=0.02] [--seed 1]
+"""
+import os
+import time
+import argparse
+import threading
+import statistics
+
+os.environ.setdefault("ANSWER_CACHE", "0")
+
+import fakes  # noqa: E402
+from bench_intents import _pct, _parse_kv  # noqa: E402
+
+_FAILED_MARKS = ("混み合って", "見つからなかった", "取れなかった")
+
+def _user_loop(lf, idx: int, stop_at: float, out: list, lock: threading.Lock):
+    ctx = fakes.FakeContext()
+    user = f"rate-{idx}"
+    n = 0
+    while time.monotonic() < stop_at:
+        attrs = None
+        for intent, slots in (("NotionSearchIntent", {"query": f"議事録{n % 5}"}), ("NotionReadIntent", {"index": "1"})):
+            ev = fakes.envelope(intent, slots, attrs=attrs, user_id=user, session_id=f"s-{user}-{n}")
+            t0 = time.perf_counter()
+            resp = lf.lambda_handler(ev, ctx)
+            ms = (time.perf_counter() - t0) * 1000
+            attrs = resp.get("sessionAttributes") or {}
+            ssml = ((resp.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+            with lock:
+                out.append((intent, ms, any(m in ssml for m in _FAILED_MARKS)))
+        n += 1
+        time.sleep(0.2)  # 次の発話までの間
+
+def _writer_loop(idx: int, stop_at: float, out: list, lock: threading.Lock):
+    import notion_utils
+    from notion_rate import notion_priority, PRIORITY_BACKGROUND
+    n = 0
+    while time.monotonic() < stop_at:
+        with notion_priority(PRIORITY_BACKGROUND):
+            r = notion_utils.notion_append_blocks(f"rate-writer-{idx}", f"裏の書き込み {n}")
+        with lock:
+            out.append(bool(r["success"]))
+        n += 1
+
+def run_mode(lf, mode: str, args):
+    import notion_rate
+    notion_rate.set_bucket(notion_rate.TokenBucket(args.rps, args.burst) if mode == "local" else None)
+    for k in ("acquired", "waited", "wait_ms", "timeouts", "throttled"):
+        notion_rate.RATE_STATS[k] = 0
+    notion_rate._LAST_THROTTLED = 0.0
+    time.sleep(1.1)  # フェイク側のバケットを満たしておく
+    fakes.reset_calls()
+
+    turns, writes = [], []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=_user_loop, args=(lf, i, stop_at, turns, lock)) for i in range(args.users)]
+    threads += [threading.Thread(target=_writer_loop, args=(i, stop_at, writes, lock)) for i in range(args.writers)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    stats = dict(notion_rate.RATE_STATS)
+    ms = [m for _, m, _ in turns]
+    failed = sum(f for _, _, f in turns)
+    print(f"{mode:<7}{len(turns):>7}{statistics.median(ms):>9.1f}{_pct(ms, 95):>9.1f}"
+          f"{failed / max(1, len(turns)) * 100:>8.1f}%{fakes.THROTTLED['notion']:>7}{fakes.CALLS['notion']:>8}"
+          f"{sum(writes):>6}/{len(writes):<5}{stats['waited']:>7}{stats['wait_ms'] / 1000:>8.1f}s{stats['timeouts']:>6}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=15.0)
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--writers", type=int, default=2)
+    ap.add_argument("--server-rps", type=float, default=3.0, help="フェイク Notion が受け付ける上限")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--modes", default="off,local")
+    ap.add_argument("--rps", type=float, default=3.0, help="local のトークンバケットのレート")
+    ap.add_argument("--burst", type=float, default=3.0)
+    ap.add_argument("--latency", default="notion=0.15,s3=0.02")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    fakes.LATENCY.update(_parse_kv(args.latency))
+    fakes.NOTION_RATE_LIMIT = args.server_rps
+    fakes.NOTION_RETRY_AFTER_SEC = args.retry_after
+    fakes.seed(args.seed)
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+    import lambda_function as lf
+
+    print(f"server_rps={args.server_rps} retry_after={args.retry_after}s users={args.users} "
+          f"writers={args.writers} seconds={args.seconds} latency={fakes.LATENCY}")
+    print(f"{'mode':<7}{'turns':>7}{'p50 ms':>9}{'p95 ms':>9}{'busy%':>9}{'429':>7}{'calls':>8}"
+          f"{'writes ok':>12}{'waits':>7}{'wait':>9}{'gaveup':>7}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        run_mode(lf, mode, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+bench_notion_write.py
+- Notion への書き込み（notion_create_page / notion_append_blocks）の所要時間と信頼性を本文の長さ別に測る
+- 上流は bench/fakes.py のフェイク Notion（1リクエストの子ブロックが 100 を超えると 400、--fail で 503 を混ぜる）
+- 本文は NOTION_TEXT_MAX（2000）文字ごとに1ブロックになるので、--blocks ブロックぶんの長さの本文を作る
+- 出すもの: 所要時間 p50/p95、1回あたりの HTTP 呼び出し数、成功率、書けたブロックの割合、
+  書かれた順序が本文どおりか（フェイクに記録された段落と突き合わせる）
+
+使い方:
+    python bench/bench_notion_write.py [--blocks 10,150,450] [--repeat 10] [--latency 0.15] [--fail 0.1] [--seed 1]
+"""
+import os
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("NOTION_DEFAULT_PARENT_ID", "bench-parent")
+
+import fakes  # noqa: E402
+from bench_intents import _pct  # noqa: E402
+
+def _content(n_blocks: int, i: int) -> str:
+    from notion_utils import NOTION_TEXT_MAX
+    text, k = "", 0
+    while len(text) < n_blocks * NOTION_TEXT_MAX:
+        text += f"{i}-{k} 口述メモの{k}行目。今日の打ち合わせで決まったことを書き残す。\n"
+        k += 1
+    return text[:n_blocks * NOTION_TEXT_MAX]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", default="10,150,450", help="本文のブロック数（カンマ区切り）")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--latency", type=float, default=0.15, help="Notion 1リクエストの秒数")
+    ap.add_argument("--fail", type=float, default=0.1, help="Notion の失敗率（503）")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    fakes.LATENCY["notion"] = args.latency
+    fakes.FAILURES["notion"] = args.fail
+    fakes.seed(args.seed)
+    fakes.install()
+    import notion_utils
+
+    print(f"notion latency={args.latency}s fail={args.fail} repeat={args.repeat}")
+    print(f"{'op':<8}{'blocks':>6}{'p50 ms':>9}{'p95 ms':>9}{'calls':>7}{'ok%':>6}{'written%':>10}{'in order':>10}")
+    for n_blocks in [int(x) for x in args.blocks.split(",")]:
+        for op in ("create", "append"):
+            ms, calls, ok, written, ordered = [], [], 0, [], 0
+            for i in range(args.repeat):
+                content = _content(n_blocks, i)
+                fakes.reset_calls()
+                t0 = time.perf_counter()
+                if op == "create":
+                    r = notion_utils.notion_create_page(f"bench {i}", content)
+                    page_id = r.get("page_id")
+                else:
+                    page_id = f"bench-append-{n_blocks}-{i}"
+                    r = notion_utils.notion_append_blocks(page_id, content)
+                ms.append((time.perf_counter() - t0) * 1000)
+                calls.append(fakes.CALLS["notion"])
+                ok += int(r["success"])
+                written.append(r.get("blocks_written", 0) / max(1, r.get("blocks_total", 1)))
+                got = fakes.NOTION_WRITTEN.get(page_id or "", [])
+                ordered += int(content.startswith("".join(got)))  # 書けた分が本文の先頭から順に並んでいるか
+            print(f"{op:<8}{n_blocks:>6}{statistics.median(ms):>9.1f}{_pct(ms, 95):>9.1f}"
+                  f"{statistics.mean(calls):>7.1f}{ok / args.repeat * 100:>5.0f}%{statistics.mean(written) * 100:>9.1f}%"
+                  f"{ordered:>7}/{args.repeat}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+bench_rag_bm25.py
+- rag_index の BM25 スコアリングのマイクロベンチマーク
+- 40〜1000件のメモに対して 1クエリあたりの所要時間（p50/p95）と、
+  S3 に置くインデックスの JSON サイズを出す
+
+使い方:
+    python bench/bench_rag_bm25.py [--repeat 200]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+from rag_index import new_index, index_add, bm25_scores  # noqa: E402
+
+BUDGET_MS = 5.0
+
+_WORDS = [
+    "生成AI", "プロンプト", "React", "フック", "状態管理", "会議", "議事録", "予定",
+    "買い物", "リスト", "データベース", "検索", "要約", "音声", "アレクサ", "スキル",
+    "ノート", "アイデア", "旅行", "東京", "大阪", "レシピ", "カレー", "健康", "睡眠",
+    "運動", "読書", "映画", "音楽", "プログラミング", "Python", "クラウド", "料金",
+]
+_GLUE = ["の", "について", "を", "と", "で", "は", "に", "が", "から", "まで", "。", "、"]
+
+def _fake_text(rng: random.Random, n_chars: int) -> str:
+    out = []
+    while sum(len(x) for x in out) < n_chars:
+        out.append(rng.choice(_WORDS))
+        out.append(rng.choice(_GLUE))
+    return "".join(out)[:n_chars]
+
+def _build(n_items: int, rng: random.Random):
+    index = new_index()
+    for i in range(n_items):
+        title = _fake_text(rng, 20)
+        snippet = _fake_text(rng, 300)
+        index_add(index, i, f"{title} {snippet}")
+    return index
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    rng = random.Random(1204)
+    queries = ["生成AIについて教えて", "Reactの状態管理", "東京旅行の予定", "カレーのレシピを教えて", "睡眠と健康"]
+    print(f"{'items':>6} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'index_kb':>9}")
+    worst = 0.0
+    for n in (40, 100, 300, 1000):
+        index = _build(n, rng)
+        size_kb = len(json.dumps(index, ensure_ascii=False).encode("utf-8")) / 1024.0
+        samples = []
+        for r in range(args.repeat):
+            q = queries[r % len(queries)]
+            t0 = time.perf_counter()
+            bm25_scores(index, q)
+            samples.append((time.perf_counter() - t0) * 1000.0)
+        samples.sort()
+        p50 = statistics.median(samples)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        worst = max(worst, p95)
+        print(f"{n:>6} {p50:>8.3f} {p95:>8.3f} {samples[-1]:>8.3f} {size_kb:>9.1f}")
+    print(f"budget {BUDGET_MS:.1f} ms: {'OK' if worst < BUDGET_MS else 'OVER'} (worst p95={worst:.3f} ms)")
+    return 0 if worst < BUDGET_MS else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+bench_rag_segments.py
+- RAG メモの保存形式のベンチマーク: 以前の「1ファイルを GET → 追加 → 丸ごと PUT」（legacy）と、
+  追記型の差分 + 圧縮したスナップショット（segments。rag_store_s3 / rag_segments）を比べる
+- 上流は bench/fakes.py のフェイク S3（--s3-latency 秒）
+- 同じユーザーの --devices 台が同時に、それぞれ --appends 回ずつメモを1件追加する
+  （1回 = 1リクエスト: 読んで（rag_preload 相当）から追加する）。最初に --seed-items 件入れておく
+- 出すもの: 追加のリクエストの p50/p95、追加1回あたりの PUT のバイト数と S3 呼び出し数、
+  失われた追加の件数（全部終わってから読んで、足したはずのメモが無い数）、
+  最後の読み込みの時間と S3 呼び出し数、S3 上のオブジェクト数と合計バイト数
+
+使い方:
+    python bench/bench_rag_segments.py [--devices 2] [--appends 30] [--seed-items 40] [--s3-latency 0.04]
+        [--modes legacy,segments]
+"""
+import json
+import time
+import argparse
+import statistics
+import threading
+from types import SimpleNamespace
+
+import fakes
+from bench_intents import _pct
+
+_PUT_BYTES = {"n": 0}
+_LOCK = threading.Lock()
+
+def _handler_input(uid: str):
+    return SimpleNamespace(request_envelope=SimpleNamespace(
+        context=SimpleNamespace(system=SimpleNamespace(user=SimpleNamespace(user_id=uid)))))
+
+def _count_put_bytes():
+    put = fakes.FAKE_S3.put_object
+    def counted(Bucket, Key, Body, **kwargs):
+        with _LOCK:
+            _PUT_BYTES["n"] += len(Body)
+        return put(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+    fakes.FAKE_S3.put_object = counted
+
+def _item(tag: str, i: int):
+    return {"title": f"{tag} のメモ {i}", "url": f"https://www.notion.so/{tag}-{i}",
+            "snippet": f"{tag} の {i} 件目。会議では次の進め方と担当を決めて、期限までに見直すことにした。" * 3}
+
+# ---- 以前の形式（比較用に、以前の rag_add_items をそのまま再現） ----
+def _legacy_add(uid: str, items, max_items: int = 40):
+    from rag_store_s3 import s3_get_json, s3_put_json, _rag_legacy_key
+    from rag_index import index_add, index_remove
+    doc = s3_get_json(_rag_legacy_key(uid), None) or {"v": 2, "items": [], "index": {"post": {}, "dl": {}}, "next_id": 0}
+    cur = list(doc["items"])
+    seen = {(it.get("url"), it.get("title")) for it in cur}
+    next_id = int(doc.get("next_id", len(cur)))
+    for it in items:
+        if (it["url"], it["title"]) not in seen:
+            item = dict(it, id=next_id, ts=int(time.time()))
+            cur.append(item)
+            seen.add((it["url"], it["title"]))
+            index_add(doc["index"], next_id, f"{item['title']} {item['snippet']}")
+            next_id += 1
+    if len(cur) > max_items:
+        index_remove(doc["index"], [it["id"] for it in cur[:-max_items]])
+        cur = cur[-max_items:]
+    s3_put_json(_rag_legacy_key(uid), {"v": 2, "items": cur, "index": doc["index"], "next_id": next_id})
+
+def _legacy_titles(uid: str):
+    from rag_store_s3 import s3_get_json, _rag_legacy_key
+    return {it["title"] for it in (s3_get_json(_rag_legacy_key(uid), None) or {}).get("items", [])}
+
+def run_mode(mode: str, args):
+    import rag_store_s3 as store
+    uid = f"bench-{mode}"
+    hi = _handler_input(uid)
+    seed = [_item("seed", i) for i in range(args.seed_items)]
+    if mode == "legacy":
+        _legacy_add(uid, seed, max_items=args.legacy_cap)
+    else:
+        store.rag_add_items(hi, seed)
+        store.compact_rag(uid)
+
+    fakes.reset_calls()
+    _PUT_BYTES["n"] = 0
+    ms = []
+    added = []
+    def device(d: int):
+        for i in range(args.appends):
+            item = _item(f"dev{d}", i)
+            t0 = time.perf_counter()
+            with store.s3_unit_of_work("bench"):
+                if mode == "legacy":
+                    store.s3_get_json(store._rag_legacy_key(uid), None)  # rag_preload 相当
+                    _legacy_add(uid, [item], max_items=args.legacy_cap)
+                else:
+                    store.rag_preload(hi)
+                    store.rag_add_items(hi, [item])
+            with _LOCK:
+                ms.append((time.perf_counter() - t0) * 1000)
+                added.append(item["title"])
+    threads = [threading.Thread(target=device, args=(d,)) for d in range(args.devices)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    n = len(ms)
+    calls, put_bytes = fakes.CALLS["s3"], _PUT_BYTES["n"]
+
+    time.sleep(0.5)  # 裏の圧縮を待つ
+    fakes.reset_calls()
+    t0 = time.perf_counter()
+    with store.s3_unit_of_work("bench"):
+        if mode == "legacy":
+            titles = _legacy_titles(uid)
+        else:
+            titles = {it["title"] for it in store._rag_load(hi)["items"]}
+    read_ms = (time.perf_counter() - t0) * 1000
+    read_calls = fakes.CALLS["s3"]
+    # legacy は件数の上限で古いものが落ちるので、最後の上限ぶんだけを「残っているはず」とする
+    expect = added[-args.legacy_cap:] if mode == "legacy" else added
+    lost = sum(1 for t in expect if t not in titles)
+    objs = {k: v for k, v in fakes.FAKE_S3.store.items() if f"pico_rag/{uid}" in k}
+    print(f"{mode:<10}{statistics.median(ms):>8.1f}{_pct(ms, 95):>8.1f}{put_bytes / n:>10.0f}{calls / n:>7.1f}"
+          f"{lost:>6}/{len(expect):<4}{read_ms:>8.1f}{read_calls:>7}{len(objs):>6}{sum(map(len, objs.values())):>9}"
+          f"{len(titles):>7}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=2)
+    ap.add_argument("--appends", type=int, default=30)
+    ap.add_argument("--seed-items", type=int, default=40)
+    ap.add_argument("--legacy-cap", type=int, default=40, help="legacy の件数の上限（以前の max_items）")
+    ap.add_argument("--s3-latency", type=float, default=0.04)
+    ap.add_argument("--modes", default="legacy,segments")
+    args = ap.parse_args()
+
+    fakes.LATENCY["s3"] = args.s3_latency
+    fakes.install()
+    _count_put_bytes()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+    from config import RAG_RETAIN_BYTES, RAG_COMPACT_DELTAS
+    print(f"devices={args.devices} appends={args.appends} seed={args.seed_items} s3={args.s3_latency}s "
+          f"retain={RAG_RETAIN_BYTES}B compact_every={RAG_COMPACT_DELTAS}")
+    print(f"{'mode':<10}{'p50':>8}{'p95':>8}{'put_B':>10}{'s3/op':>7}{'lost':>11}{'read_ms':>8}{'calls':>7}"
+          f"{'objs':>6}{'bytes':>9}{'items':>7}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        run_mode(mode, args)
+    import rag_store_s3
+    print(f"rag stats: {json.dumps(rag_store_s3.RAG_STATS)}")
+
+if __name__ == "__main__":
+    main()
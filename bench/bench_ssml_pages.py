@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+bench_ssml_pages.py
+- 長い回答のページ分け（convo_core.render_ssml_page / speak_paged）のベンチマーク: 長い Notion 本文を
+  「Notionで◯◯を探して」→「1件目の本文を読んで」→「続けて」… と最後まで読み、次の組み合わせを比べる
+  - 節の文字数（NOTION_SECTION_CHARS: 「続けて」1回で Notion から読む量）
+  - 1ターンで話す長さ（SSML_PAGE_SEC。0 ならページ分けなし = 節を丸ごと1ターンで話す）
+- 本文は bench/fakes.py のフェイク Notion（--blocks 段落 x --sentences 文）
+- 出すもの: 読み終わるまでのターン数、「続けて」のターンの p50/p95、Notion / OpenAI の呼び出し数、
+  1ターンで話す最長の秒数（SSML_CHARS_PER_SEC で換算）、最大のセッション属性（JSON バイト）、
+  1ターンの「続けて」「続きを読んで」の案内の最大数（1 より多いと二重の案内）、不正な SSML の数、読めた文 / 本文の文。
+  legacy は同じ読み上げ文（Notion から読んだ節）を以前の to_safe_ssml（6900 文字で切って </speak> を足す）に
+  通したときの、不正な SSML の数と読めた文の割合
+
+使い方:
+    python bench/bench_ssml_pages.py [--blocks 120] [--sentences 4] [--modes 600/0,600/60,600/90,2000/90,8000/0]
+        [--latency notion=0.15,s3=0.02] [--max-turns 200]
+"""
+import os
+import re
+import json
+import html
+import time
+import argparse
+import statistics
+import xml.etree.ElementTree as ET
+
+os.environ.setdefault("ANSWER_CACHE", "0")
+os.environ.setdefault("NOTION_PREFETCH", "0")  # 最初の節も読むたびに Notion から取る（モードで条件を揃える）
+
+import fakes  # noqa: E402
+from bench_intents import _pct, _parse_kv  # noqa: E402
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+def _legacy_to_safe_ssml(text: str) -> str:
+    """以前の to_safe_ssml（比較用）。"""
+    parts = [html.escape(p.strip()) for p in text.split("\n") if p.strip()]
+    norm = [p if p.endswith(("。", "！", "？", "!", "?", "…")) else p + "。" for p in parts]
+    ssml = "<speak>" + "<break time=\"200ms\"/>".join(f"<p>{p}</p>" for p in norm) + "</speak>"
+    if len(ssml) > 7000:
+        ssml = ssml[:6900] + "</speak>"
+    return ssml
+
+def _valid(ssml: str) -> bool:
+    try:
+        ET.fromstring(ssml)
+        return True
+    except ET.ParseError:
+        return False
+
+def _spoken_text(ssml: str) -> str:
+    return html.unescape(_TAG_RE.sub("", ssml))
+
+def _body_sentences(text: str) -> int:
+    """本文の文だけを数える（案内の文は数えない）。"""
+    return text.count("の本文") + text.count("会議では")
+
+def run_mode(lf, section_chars: int, page_sec: float, args):
+    import convo_core
+    import notion_utils
+    from cache_tiers import TieredCache, ByteLRU
+    from config import SSML_CHARS_PER_SEC
+    # 本文キャッシュは /tmp に残るので、このベンチ用にメモリだけのものに差し替える（モードごとに空から）
+    notion_utils._PAGE_CACHE = TieredCache("notion_pages", [ByteLRU(1 << 20)])
+    lf.NOTION_SECTION_CHARS = section_chars
+    convo_core.SSML_PAGE_SEC = page_sec
+    seen = []
+    render = convo_core.render_ssml_page
+    def spy(text, **kwargs):
+        seen.append(text)
+        return render(text, **kwargs)
+    convo_core.render_ssml_page = spy
+    ctx = fakes.FakeContext()
+    user = f"pages-{section_chars}-{page_sec:g}"
+
+    resp = lf.lambda_handler(fakes.envelope("NotionSearchIntent", {"query": "議事録"}, user_id=user,
+                                            session_id=f"s-{user}"), ctx)
+    attrs = resp.get("sessionAttributes") or {}
+    fakes.reset_calls()
+    cont_ms, spoken_sec, attr_bytes, hints = [], [], [], []
+    invalid = legacy_invalid = spoken = legacy_spoken = turns = 0
+    intent, slots = "NotionReadIntent", {"index": "1"}
+    while turns < args.max_turns:
+        from_pages = bool(attrs.get("ssml_rest"))
+        seen.clear()
+        t0 = time.perf_counter()
+        resp = lf.lambda_handler(fakes.envelope(intent, slots, attrs=attrs, user_id=user, session_id=f"s-{user}"), ctx)
+        ms = (time.perf_counter() - t0) * 1000
+        turns += 1
+        attrs = resp.get("sessionAttributes") or {}
+        ssml = ((resp.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+        text = _spoken_text(ssml)
+        invalid += int(not _valid(ssml))
+        spoken += _body_sentences(text)
+        if not from_pages and seen:
+            legacy = _legacy_to_safe_ssml(max(seen, key=len))
+            legacy_invalid += int(not _valid(legacy))
+            legacy_spoken += _body_sentences(_spoken_text(legacy))
+        spoken_sec.append(len(text) / SSML_CHARS_PER_SEC)
+        hints.append(text.count("『続けて』と言って") + text.count("『続きを読んで』と言って"))
+        attr_bytes.append(len(json.dumps(attrs)))
+        if intent == "ContinuationIntent":
+            cont_ms.append(ms)
+        if not (attrs.get("ssml_rest") or attrs.get("notion_resume")):
+            break
+        intent, slots = "ContinuationIntent", {}
+    convo_core.render_ssml_page = render
+    total_sentences = args.blocks * args.sentences
+    print(f"{section_chars:>8}{page_sec:>7g}{turns:>7}{statistics.median(cont_ms or [0]):>9.1f}"
+          f"{_pct(cont_ms, 95) if cont_ms else 0:>9.1f}{fakes.CALLS['notion']:>8}{fakes.CALLS['openai']:>8}"
+          f"{max(spoken_sec):>9.1f}{max(attr_bytes):>9}{max(hints):>7}{invalid:>9}{spoken / total_sentences * 100:>8.1f}%"
+          f"{legacy_invalid:>11}{legacy_spoken / total_sentences * 100:>11.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=120, help="ページのトップレベルの段落数")
+    ap.add_argument("--sentences", type=int, default=4, help="段落1つあたりの文の数")
+    ap.add_argument("--modes", default="600/0,600/60,600/90,2000/90,8000/0",
+                    help="節の文字数/1ターンの秒数（0 でページ分けなし）をカンマ区切りで")
+    ap.add_argument("--latency", default="notion=0.15,s3=0.02")
+    ap.add_argument("--max-turns", type=int, default=200)
+    args = ap.parse_args()
+
+    fakes.LATENCY.update({k: float(v) for k, v in _parse_kv(args.latency).items()})
+    fakes.NOTION_PAGE_BLOCKS = args.blocks
+    fakes.NOTION_PARAGRAPH_SENTENCES = args.sentences
+    fakes.install()
+    import tracing
+    tracing.set_emitter(lambda line: None)
+    import lambda_function as lf
+
+    print(f"page={args.blocks} blocks x {args.sentences} sentences latency={args.latency}")
+    print(f"{'section':>8}{'page_s':>7}{'turns':>7}{'cont.p50':>9}{'cont.p95':>9}{'notion':>8}{'openai':>8}"
+          f"{'max_sec':>9}{'attr_B':>9}{'hints':>7}{'invalid':>9}{'read':>9}{'legacy.inv':>11}{'legacy.read':>12}")
+    for spec in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        section, page = spec.split("/")
+        run_mode(lf, int(section), float(page), args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+fakes.py
+- ベンチマーク用のプロセス内フェイク（OpenAI / Notion / S3 / Progressive Response）
+- 関数の差し替えはせず、各モジュールのクライアント登録口に差し込む
+  - OpenAI : utils._CLIENTS に httpx.MockTransport の OpenAI クライアントを登録
+  - Notion : 共有 NotionClient の requests.Session にアダプターを mount
+  - S3     : rag_store_s3._S3_CLIENTS の全タイムアウト段に FakeS3 を登録
+- 上流ごとのレイテンシ（秒）は LATENCY、ばらつきは JITTER（±割合）で変えられる
+  - OpenAI はモデルごとに OPENAI_MODEL_LATENCY で変えられる（無いモデルは LATENCY["openai"]）
+  - TAIL[上流] = (確率, 倍率) で、その確率で倍率ぶん遅い呼び出し（遅いテール）を混ぜる（TAIL_EXEMPT のモデルは除く）
+- FAILURES に上流ごとの失敗率を入れると、その割合で失敗を返す
+  （OpenAI: HTTP 500 / Notion: HTTP 503 / S3: 接続エラー）。乱数は seed() で固定できる
+- NOTION_RATE_LIMIT（リクエスト/秒）を入れると、フェイク Notion がその平均を超えた分に 429 + Retry-After を返す
+  （Notion と同じく平均で数え、1秒分までのまとめ送りは許す）
+- httpx / requests / openai は install() や各フェイクの中で読み込む（コールドスタート計測を汚さない）
+
+使い方:
+    import fakes
+    fakes.install()
+    out = lambda_function.lambda_handler(fakes.envelope("GptQueryIntent", {"query": "生成AI"}), fakes.FakeContext())
+"""
+import io
+import os
+import re
+import sys
+import random
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+FAKE_OPENAI_KEY = "bench-key"
+FAKE_OPENAI_BASE_URL = "https://fake-openai.invalid/v1"
+
+# 上流ごとの1呼び出しあたりのレイテンシ（秒）と、そのばらつき（±割合）
+LATENCY: Dict[str, float] = {"openai": 0.5, "notion": 0.15, "s3": 0.04}
+JITTER: float = 0.0
+OPENAI_MODEL_LATENCY: Dict[str, float] = {}
+TAIL: Dict[str, Tuple[float, float]] = {}
+TAIL_EXEMPT: Set[str] = set()  # TAIL を当てないモデル（OpenAI）
+# 上流ごとの失敗率（0〜1）
+FAILURES: Dict[str, float] = {"openai": 0.0, "notion": 0.0, "s3": 0.0}
+# Notion 側のレート制限（リクエスト/秒。0 なら制限なし）と、超えたときの Retry-After（秒）
+NOTION_RATE_LIMIT: float = 0.0
+NOTION_RETRY_AFTER_SEC: float = 1.0
+
+ANSWER_TEXT = "生成AIは文章や画像を作るAIだよ。質問に答えたり、要約したりできるんだ。"
+
+# 上流ごとの呼び出し回数（ターンあたりの上流呼び出し数を出す用）
+CALLS: Dict[str, int] = {"openai": 0, "notion": 0, "s3": 0}
+FAILED: Dict[str, int] = {"openai": 0, "notion": 0, "s3": 0}
+THROTTLED: Dict[str, int] = {"notion": 0}  # 429 を返した数
+_NOTION_BUCKET = {"tokens": 0.0, "at": 0.0}  # フェイク Notion 側のトークンバケット
+_CALLS_LOCK = threading.Lock()
+_RNG = random.Random(0)
+
+def _count(name: str) -> None:
+    with _CALLS_LOCK:
+        CALLS[name] += 1
+
+def reset_calls() -> None:
+    with _CALLS_LOCK:
+        for k in CALLS:
+            CALLS[k] = 0
+            FAILED[k] = 0
+        THROTTLED["notion"] = 0
+
+def seed(n: int) -> None:
+    with _CALLS_LOCK:
+        _RNG.seed(n)
+
+def _sleep(name: str, base: Optional[float] = None, tail: bool = True) -> None:
+    base = (LATENCY.get(name) or 0.0) if base is None else base
+    if not base:
+        return
+    if JITTER:
+        with _CALLS_LOCK:
+            base *= 1.0 + _RNG.uniform(-JITTER, JITTER)
+    if tail and name in TAIL:
+        prob, factor = TAIL[name]
+        with _CALLS_LOCK:
+            if _RNG.random() < prob:
+                base *= factor
+    time.sleep(max(0.0, base))
+
+def _should_fail(name: str) -> bool:
+    rate = FAILURES.get(name) or 0.0
+    if not rate:
+        return False
+    with _CALLS_LOCK:
+        failed = _RNG.random() < rate
+        if failed:
+            FAILED[name] += 1
+    return failed
+
+def _notion_rate_exceeded() -> bool:
+    if not NOTION_RATE_LIMIT:
+        return False
+    now = time.monotonic()
+    with _CALLS_LOCK:
+        b = _NOTION_BUCKET
+        b["tokens"] = min(max(1.0, NOTION_RATE_LIMIT), b["tokens"] + (now - b["at"]) * NOTION_RATE_LIMIT)
+        b["at"] = now
+        if b["tokens"] < 1.0:
+            THROTTLED["notion"] += 1
+            return True
+        b["tokens"] -= 1.0
+    return False
+
+# ==== S3 ====
+class NoSuchKey(Exception):
+    pass
+
+class FakeS3:
+    """get_object / put_object / list_objects_v2 / delete_object だけの S3 クライアント（メモリ上）。"""
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self):
+        self.store: Dict[str, bytes] = {}
+        self.modified: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        _count("s3")
+        _sleep("s3")
+        if _should_fail("s3"):
+            raise ConnectionError("injected S3 failure")
+        with self._lock:
+            if Key not in self.store:
+                raise NoSuchKey(Key)
+            return {"Body": io.BytesIO(self.store[Key])}
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs):
+        _count("s3")
+        _sleep("s3")
+        if _should_fail("s3"):
+            raise ConnectionError("injected S3 failure")
+        with self._lock:
+            self.store[Key] = Body if isinstance(Body, bytes) else str(Body).encode("utf-8")
+            self.modified[Key] = time.time()
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs):
+        _count("s3")
+        _sleep("s3")
+        if _should_fail("s3"):
+            raise ConnectionError("injected S3 failure")
+        start = kwargs.get("ContinuationToken") or ""
+        size = int(kwargs.get("MaxKeys") or 1000)
+        with self._lock:
+            keys = sorted(k for k in self.store if k.startswith(Prefix) and k > start)
+            page = keys[:size]
+            contents = [{"Key": k, "Size": len(self.store.get(k, b"")),
+                         "LastModified": datetime.fromtimestamp(self.modified.get(k, 0.0), tz=timezone.utc)}
+                        for k in page]
+        out = {"Contents": contents, "KeyCount": len(page), "IsTruncated": len(keys) > size}
+        if out["IsTruncated"]:
+            out["NextContinuationToken"] = page[-1]
+        return out
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        _count("s3")
+        _sleep("s3")
+        if _should_fail("s3"):
+            raise ConnectionError("injected S3 failure")
+        with self._lock:
+            self.store.pop(Key, None)
+            self.modified.pop(Key, None)
+        return {}
+
+# ==== Notion ====
+_BLOCKS_RE = re.compile(r"/blocks/([^/]+)/children")
+
+def _notion_page(i: int) -> Dict[str, Any]:
+    return {
+        "object": "page", "id": f"page{i:04d}", "url": f"https://www.notion.so/page{i:04d}",
+        "last_edited_time": "2026-01-01T00:00:00.000Z",
+        "properties": {"Name": {"type": "title", "title": [{"plain_text": f"メモ{i}"}]}},
+    }
+
+# 1ページのトップレベルのブロック数と、何ブロックごとに子を持つトグルを挟むか（0 なら挟まない）
+NOTION_PAGE_BLOCKS = 5
+NOTION_TOGGLE_EVERY = 0
+NOTION_TOGGLE_CHILDREN = 3
+# 段落1つあたりの文の数（大きくすると長い本文のページになる）
+NOTION_PARAGRAPH_SENTENCES = 1
+_FILLER = "会議では次の進め方と担当を決めて、期限までに見直すことにした。"
+
+def _notion_paragraph(text: str) -> Dict[str, Any]:
+    return {"object": "block", "type": "paragraph", "has_children": False,
+            "paragraph": {"rich_text": [{"plain_text": text}]}}
+
+def _notion_blocks(block_id: str) -> List[Dict[str, Any]]:
+    """block_id の子ブロック全部。"<ページ>~t<番号>" はトグルの子。"""
+    if "~t" in block_id:
+        return [_notion_paragraph(f"{block_id} の子 {i}。") for i in range(NOTION_TOGGLE_CHILDREN)]
+    out = []
+    for i in range(NOTION_PAGE_BLOCKS):
+        if NOTION_TOGGLE_EVERY and i % NOTION_TOGGLE_EVERY == NOTION_TOGGLE_EVERY - 1:
+            out.append({"object": "block", "id": f"{block_id}~t{i}", "type": "toggle", "has_children": True,
+                        "toggle": {"rich_text": [{"plain_text": f"{block_id} のトグル {i}"}]}})
+        else:
+            out.append(_notion_paragraph(f"{block_id} の本文 {i}。" + _FILLER * (NOTION_PARAGRAPH_SENTENCES - 1)))
+    return out
+
+def _notion_children_page(block_id: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+    """page_size / start_cursor（ここでは先頭からの位置）どおりに1ページ分を返す。"""
+    blocks = _notion_blocks(block_id)
+    size = int((query.get("page_size") or ["100"])[0])
+    start = int((query.get("start_cursor") or ["0"])[0])
+    end = start + size
+    return {"results": blocks[start:end], "has_more": end < len(blocks),
+            "next_cursor": str(end) if end < len(blocks) else None}
+
+# 書き込まれた段落の本文（ページ ID -> 書かれた順の本文）
+NOTION_WRITTEN: Dict[str, List[str]] = {}
+
+def _children(request) -> List[Dict[str, Any]]:
+    if not request.body:
+        return []
+    try:
+        return json.loads(request.body).get("children") or []
+    except Exception:
+        return []
+
+def _record_written(page_id: str, children: List[Dict[str, Any]]) -> None:
+    texts = ["".join(r.get("text", {}).get("content", "") for r in (b.get("paragraph") or {}).get("rich_text") or [])
+             for b in children]
+    with _CALLS_LOCK:
+        NOTION_WRITTEN.setdefault(page_id, []).extend(texts)
+
+class FakeNotionAdapter:
+    """Notion API の search / blocks / pages を返す requests アダプター（send/close だけ持てばよい）。"""
+    def send(self, request, **kwargs):
+        import requests
+        _count("notion")
+        throttled = _notion_rate_exceeded()
+        _sleep("notion")
+        path, _, qs = request.path_url.partition("?")
+        children = len(_children(request))
+        if throttled:
+            body = {"object": "error", "status": 429, "code": "rate_limited",
+                    "message": "You have been rate limited. Please try again in a few minutes."}
+        elif _should_fail("notion"):
+            body = {"object": "error", "status": 503, "message": "injected Notion failure"}
+        elif children > 100:
+            body = {"object": "error", "status": 400, "code": "validation_error",
+                    "message": f"body.children.length should be ≤ 100, instead was {children}."}
+        elif request.method == "POST" and path.endswith("/search"):
+            body = {"results": [_notion_page(i) for i in range(3)]}
+        elif request.method == "GET" and _BLOCKS_RE.search(path):
+            body = _notion_children_page(_BLOCKS_RE.search(path).group(1), parse_qs(qs))
+        elif request.method == "PATCH" and _BLOCKS_RE.search(path):
+            _record_written(_BLOCKS_RE.search(path).group(1), _children(request))
+            body = {"results": []}
+        elif request.method == "POST" and path.endswith("/pages"):
+            body = {"id": "newpage" + uuid.uuid4().hex[:8], "url": "https://www.notion.so/newpage"}
+            _record_written(body["id"], _children(request))
+        else:
+            body = {"object": "error", "status": 404, "message": "not found"}
+        resp = requests.Response()
+        resp.status_code = body.get("status", 200)
+        resp._content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        resp.headers["content-type"] = "application/json"
+        if throttled:
+            resp.headers["Retry-After"] = str(NOTION_RETRY_AFTER_SEC)
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self):
+        pass
+
+# ==== OpenAI ====
+def _openai_handler(request):
+    import httpx
+    _count("openai")
+    req = json.loads(request.content or b"{}")
+    _sleep("openai", OPENAI_MODEL_LATENCY.get(req.get("model", "")), req.get("model", "") not in TAIL_EXEMPT)
+    if _should_fail("openai"):
+        return httpx.Response(500, json={"error": {"message": "injected OpenAI failure", "type": "server_error"}})
+    usage = {"prompt_tokens": 100, "completion_tokens": len(ANSWER_TEXT), "total_tokens": 100 + len(ANSWER_TEXT)}
+    if req.get("stream"):
+        def _events():
+            chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": req.get("model", ""),
+                     "choices": [{"index": 0, "delta": {"content": ANSWER_TEXT}, "finish_reason": None}]}
+            yield ("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n").encode("utf-8")
+            chunk["choices"] = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            yield ("data: " + json.dumps(chunk) + "\n\n").encode("utf-8")
+            if (req.get("stream_options") or {}).get("include_usage"):
+                chunk["choices"], chunk["usage"] = [], usage
+                yield ("data: " + json.dumps(chunk) + "\n\n").encode("utf-8")
+            yield b"data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_events())
+    body = {"id": "bench", "object": "chat.completion", "created": 0, "model": req.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": ANSWER_TEXT}}],
+            "usage": usage}
+    return httpx.Response(200, json=body)
+
+# ==== まとめて差し込む ====
+FAKE_S3: Optional[FakeS3] = None
+
+def install() -> None:
+    """フェイクを各モジュールの登録口に差し込む（何度呼んでもよい）。"""
+    global FAKE_S3
+    os.environ["OPENAI_API_KEY"] = FAKE_OPENAI_KEY
+    os.environ["OPENAI_BASE_URL"] = FAKE_OPENAI_BASE_URL
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    import httpx
+    from openai import OpenAI
+    import utils
+    import notion_utils
+    import rag_store_s3
+    import progressive
+
+    utils._CLIENTS[(FAKE_OPENAI_KEY, FAKE_OPENAI_BASE_URL)] = OpenAI(
+        api_key=FAKE_OPENAI_KEY, base_url=FAKE_OPENAI_BASE_URL, max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(_openai_handler)),
+    )
+    client = notion_utils.get_notion_client()
+    client.session.mount(client.base_url, FakeNotionAdapter())
+
+    if FAKE_S3 is None:
+        FAKE_S3 = FakeS3()
+    for step in rag_store_s3._S3_TIMEOUT_STEPS:
+        rag_store_s3._S3_CLIENTS[step] = FAKE_S3
+
+    progressive.set_directive_sender(progressive.RecordingDirectiveSender())
+
+class FakeContext:
+    """Lambda の context（残り時間だけ）。"""
+    def __init__(self, remaining_ms: int = 8000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_ms
+
+def envelope(intent: Optional[str] = None, slots: Optional[Dict[str, str]] = None, *,
+             attrs: Optional[Dict[str, Any]] = None, request_type: str = "IntentRequest",
+             user_id: str = "bench-user", session_id: str = "bench-session",
+             locale: str = "ja-JP") -> Dict[str, Any]:
+    """Alexa のリクエスト envelope を作る。"""
+    request: Dict[str, Any] = {
+        "type": request_type, "requestId": "amzn1.echo-api.request." + uuid.uuid4().hex,
+        "timestamp": "2026-01-01T00:00:00Z", "locale": locale,
+    }
+    if intent:
+        request["intent"] = {
+            "name": intent, "confirmationStatus": "NONE",
+            "slots": {k: {"name": k, "value": v, "confirmationStatus": "NONE"} for k, v in (slots or {}).items()},
+        }
+    system = {
+        "application": {"applicationId": "amzn1.ask.skill.bench"},
+        "user": {"userId": user_id},
+        "apiEndpoint": "https://api.fe.amazonalexa.com",
+        "apiAccessToken": "bench-token",
+    }
+    return {
+        "version": "1.0",
+        "session": {"new": attrs is None, "sessionId": session_id,
+                    "application": {"applicationId": "amzn1.ask.skill.bench"},
+                    "user": {"userId": user_id}, "attributes": attrs or {}},
+        "context": {"System": system},
+        "request": request,
+    }
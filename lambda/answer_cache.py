@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+answer_cache.py
+- one_shot_answer の前に置く回答キャッシュ（「生成AIについて教えて」等のよくある質問向け）
+- キー: NFKC 正規化したクエリ + インテント名 + 注入スニペットのハッシュ
+- TTL 付き。プロセス内 LRU と S3 共有段（コンテナ間で共有）の2段
+- 会話履歴に依存するターン（history あり）はキャッシュを使わない
+"""
+import re
+import hashlib
+import logging
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from config import ANSWER_CACHE, ANSWER_CACHE_TTL_SEC, ANSWER_CACHE_MEM_BYTES, ANSWER_CACHE_S3_BYTES
+from cache_tiers import TieredCache, ByteLRU, S3Store
+
+LOGGER = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r"[\s　、。，．・！？!?「」『』（）()]+")
+
+STATS = {"hits": 0, "misses": 0, "bypass": 0, "stores": 0, "saved_ms": 0}
+
+_CACHE: Optional[TieredCache] = None
+
+def _cache() -> TieredCache:
+    global _CACHE
+    if _CACHE is None:
+        s3 = S3Store("answers", ANSWER_CACHE_S3_BYTES, ttl_sec=ANSWER_CACHE_TTL_SEC)
+        _CACHE = TieredCache("answers", [ByteLRU(ANSWER_CACHE_MEM_BYTES), s3], ttl_sec=ANSWER_CACHE_TTL_SEC)
+    return _CACHE
+
+def normalize_query(query: str) -> str:
+    return _PUNCT_RE.sub("", unicodedata.normalize("NFKC", query or "").lower())
+
+def answer_key(intent_name: str, query: str, snippets: Optional[List[str]]) -> str:
+    snip_hash = hashlib.sha1("\n".join(snippets or []).encode("utf-8")).hexdigest()[:16]
+    return f"{intent_name}|{normalize_query(query)}|{snip_hash}"
+
+def _cacheable(session: Dict[str, Any], query: str) -> bool:
+    if not ANSWER_CACHE or not normalize_query(query):
+        return False
+    # 履歴があると同じ質問でも答えが変わるので使わない
+    return not session.get("history") and not session.get("stream_resume")
+
+def lookup_answer(session: Dict[str, Any], intent_name: str, query: str,
+                  snippets: Optional[List[str]]) -> str:
+    """キャッシュ済みの回答（無ければ空文字）。"""
+    if not _cacheable(session, query):
+        STATS["bypass"] += 1
+        return ""
+    hit = _cache().get(answer_key(intent_name, query, snippets))
+    if not hit or not hit.get("text"):
+        STATS["misses"] += 1
+        return ""
+    STATS["hits"] += 1
+    STATS["saved_ms"] += int(hit.get("gen_ms") or 0)
+    LOGGER.info(f"[answer-cache] hit intent={intent_name} {_summary()}")
+    return hit["text"]
+
+def store_answer(session: Dict[str, Any], intent_name: str, query: str,
+                 snippets: Optional[List[str]], answer: str, gen_sec: float) -> None:
+    """完結した回答だけ保存する（途中で切れた回答は session に stream_resume が残るので、それで見分けて保存しない）。"""
+    if not answer or not _cacheable(session, query):
+        return
+    _cache().put(answer_key(intent_name, query, snippets), {"text": answer, "gen_ms": int(gen_sec * 1000)})
+    STATS["stores"] += 1
+
+def _summary() -> str:
+    looked = STATS["hits"] + STATS["misses"]
+    rate = (STATS["hits"] / looked) if looked else 0.0
+    return f"hit_rate={rate:.2f} saved_ms={STATS['saved_ms']} stats={STATS}"
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+async_adapter.py
+- ask-sdk の同期ハンドラーの中で asyncio を使うためのアダプター
+- AsyncRequestHandler を継承して handle_async を書けば、1回の呼び出しにつき
+  1つのイベントループで実行される（SkillBuilder にはそのまま add_request_handler できる）
+- 上流 I/O の async 版は各モジュールの *_async（asyncio.to_thread で実行。
+  ContextVar のデッドライン予算と S3 Unit of Work はスレッドへ引き継がれる）
+"""
+import abc
+import asyncio
+from typing import Any, Awaitable, List
+
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+
+from config import ASYNC_IO_CONCURRENT
+
+class AsyncRequestHandler(AbstractRequestHandler, metaclass=abc.ABCMeta):
+    def handle(self, handler_input):
+        return asyncio.run(self.handle_async(handler_input))
+
+    @abc.abstractmethod
+    async def handle_async(self, handler_input):
+        """handle の本体（1回の呼び出しにつき1つのイベントループで実行される）。"""
+
+async def gather_io(*aws: Awaitable[Any]) -> List[Any]:
+    """独立した I/O を並行に待つ。ASYNC_IO_CONCURRENT=0 なら順番に待つ（比較・切り分け用）。"""
+    if ASYNC_IO_CONCURRENT:
+        return list(await asyncio.gather(*aws))
+    return [await aw for aw in aws]
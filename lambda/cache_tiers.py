@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+cache_tiers.py
+- 段階キャッシュ: プロセス内 LRU → /tmp ファイル → S3
+- 値は JSON にできるもの。プロセス内と /tmp はバイト数で上限を持ち、古いものから捨てる
+- 下の段で当たったら上の段へ書き戻す（次はより速い段で当たる）
+- ttl_sec を渡すと期限切れのエントリは無いものとして扱う
+- S3 の段も上限を持つ: ときどき裏で LIST し、期限切れ → 古いものの順に消す（バケットのライフサイクルルールと併用できる）
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import S3_PREFIX
+from rag_store_s3 import s3_get_json, s3_put_json, s3_list_sized, s3_delete_key
+
+LOGGER = logging.getLogger(__name__)
+
+def _digest(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+class ByteLRU:
+    """プロセス内 LRU（ウォーム起動間で残る）。合計バイト数で上限。"""
+    name = "mem"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            self._data.move_to_end(key)
+            return hit[0]
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        n = len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+        if n > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (entry, n)
+            self.size += n
+            while self.size > self.max_bytes and self._data:
+                _, (_, m) = self._data.popitem(last=False)
+                self.size -= m
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+class TmpFileStore:
+    """/tmp 以下の JSON ファイル（コンテナが生きている間だけ残る）。合計バイト数で上限。"""
+    name = "tmp"
+
+    def __init__(self, namespace: str, max_bytes: int, root: str = "/tmp/pico_cache"):
+        self.dir = os.path.join(root, namespace)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, _digest(key) + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)  # LRU 用に最終利用時刻を更新
+            return entry
+        except Exception:
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = self._path(key) + ".part"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self._evict()
+        except Exception as e:
+            LOGGER.warning(f"[cache] tmp put failed ex={type(e).__name__}")
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            total = 0
+            for name in os.listdir(self.dir):
+                if not name.endswith(".json"):
+                    continue
+                st = os.stat(os.path.join(self.dir, name))
+                files.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, name in sorted(files):
+                try:
+                    os.remove(os.path.join(self.dir, name))
+                except OSError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+_S3_PRUNE_EVERY_SEC = 600  # S3 の段を掃除する間隔（コンテナごと）
+_S3_PRUNE_MAX_DELETES = 100  # 1回の掃除で消す上限（溜まっていれば何回かに分ける）
+
+class S3Store:
+    """
+    S3 の共有段（コンテナをまたいで使える）。書き込みはリクエスト終了時にまとめて流す
+    （リクエストが終わった後に put した分、たとえば間に合わなかった先読みは、その場で書く）。
+    put のあと、間隔をあけて裏で掃除する: 最終更新から ttl_sec を過ぎたもの、次に合計が max_bytes を
+    超えた分を最終更新の古い順に消す（S3 で当たっても最終更新は変わらないので、LRU ではなく古い順）。
+    """
+    name = "s3"
+
+    def __init__(self, namespace: str, max_bytes: int = 0, *, ttl_sec: float = 0):
+        self.prefix = f"{S3_PREFIX}/pico_cache/{namespace}"
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{_digest(key)}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = s3_get_json(self._key(key), None)
+        return entry if isinstance(entry, dict) else None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        try:
+            s3_put_json(self._key(key), entry)
+        except Exception as e:
+            LOGGER.warning(f"[cache] s3 put failed ex={type(e).__name__}")
+            return
+        self._maybe_prune()
+
+    def _maybe_prune(self) -> None:
+        if not (self.max_bytes or self.ttl_sec):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + _S3_PRUNE_EVERY_SEC
+        threading.Thread(target=contextvars.Context().run, args=(self._prune,),
+                         name="pico-cache-prune", daemon=True).start()
+
+    def _prune(self) -> None:
+        objects = s3_list_sized(f"{self.prefix}/")
+        now = time.time()
+        victims, live, total = [], [], 0
+        for key, modified, size in sorted(objects, key=lambda o: o[1]):
+            if self.ttl_sec and now - modified > self.ttl_sec:
+                victims.append(key)
+            else:
+                live.append((key, size))
+                total += size
+        expired = len(victims)
+        for key, size in live:
+            if not self.max_bytes or total <= self.max_bytes:
+                break
+            victims.append(key)
+            total -= size
+        if victims:
+            removed = sum(s3_delete_key(key) for key in victims[:_S3_PRUNE_MAX_DELETES])
+            LOGGER.info(f"[cache] s3 prune prefix={self.prefix} objects={len(objects)} "
+                        f"expired={expired} removed={removed} backlog={len(victims) - removed}")
+
+class TieredCache:
+    def __init__(self, name: str, tiers: List[Any], *, ttl_sec: float = 0):
+        self.name = name
+        self.tiers = tiers
+        self.ttl_sec = ttl_sec
+        self.stats: Dict[str, int] = {"misses": 0, "puts": 0}
+        for t in tiers:
+            self.stats[f"hits_{t.name}"] = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """値を返す（どの段にも無い・期限切れなら None）。"""
+        now = time.time()
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if not entry or "v" not in entry:
+                continue
+            if entry.get("exp") and entry["exp"] < now:
+                continue
+            self.stats[f"hits_{tier.name}"] += 1
+            for upper in self.tiers[:i]:
+                upper.put(key, entry)
+            return entry["v"]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        entry = {"v": value}
+        if self.ttl_sec:
+            entry["exp"] = time.time() + self.ttl_sec
+        self.stats["puts"] += 1
+        for tier in self.tiers:
+            tier.put(key, entry)
@@ -48,12 +48,77 @@ S3_PREFIX       = os.environ.get("S3_PREFIX", "Media").strip()
 # ====== チューニング値 ======
 HTTP_TIMEOUT_SEC       = float(os.environ.get("HTTP_TIMEOUT_SEC", "2.0"))
 HARD_DEADLINE_SEC      = float(os.environ.get("HARD_DEADLINE_SEC", "4.8"))
-MAX_HISTORY_TURNS      = int(os.environ.get("MAX_HISTORY_TURNS", "6"))
+RESPONSE_RESERVE_SEC   = float(os.environ.get("RESPONSE_RESERVE_SEC", "0.3"))   # 応答組み立て・S3書き出し用に残す秒数
+MIN_CALL_TIMEOUT_SEC   = float(os.environ.get("MIN_CALL_TIMEOUT_SEC", "0.3"))   # 1回の上流呼び出しの下限タイムアウト
+MIN_LLM_BUDGET_SEC     = float(os.environ.get("MIN_LLM_BUDGET_SEC", "1.0"))     # これ未満ならLLMを呼ばず「続けて」へ
+MAX_HISTORY_TURNS      = int(os.environ.get("MAX_HISTORY_TURNS", "6"))  # セッションに残す往復数（送る量は PROMPT_TOKEN_BUDGET で決まる）
+PROMPT_TOKEN_BUDGET    = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1500"))  # LLM に送る入力トークンの上限
+PROMPT_ITEM_MAX_TOKENS = int(os.environ.get("PROMPT_ITEM_MAX_TOKENS", "200"))  # 履歴1メッセージ・ノート1件あたりの上限
+PROMPT_MIN_ITEM_TOKENS = int(os.environ.get("PROMPT_MIN_ITEM_TOKENS", "24"))  # 残りがこれ未満なら履歴・ノートを切り詰めてまで入れない
+PROMPT_TOKENIZER       = os.environ.get("PROMPT_TOKENIZER", "auto").strip().lower()  # auto（tiktoken があれば使う）/ heuristic
+LLM_STREAMING          = os.environ.get("LLM_STREAMING", "1").strip() == "1"  # 期限まで受けて文末で切る
+LLM_LATENCY_WINDOW     = int(os.environ.get("LLM_LATENCY_WINDOW", "200"))  # モデルごとに覚えておく直近のレイテンシの件数
+OPENAI_HEDGE           = os.environ.get("OPENAI_HEDGE", "0").strip() == "1"  # 最初の出力が遅ければ2本目を送って早い方を採る
+OPENAI_HEDGE_MODEL     = os.environ.get("OPENAI_HEDGE_MODEL", "").strip()  # 2本目のモデル（空なら OPENAI_MODEL）
+OPENAI_HEDGE_PERCENTILE = float(os.environ.get("OPENAI_HEDGE_PERCENTILE", "90"))  # 最初の出力までの時間のこの分位を過ぎたら送る
+OPENAI_HEDGE_MIN_SAMPLES = int(os.environ.get("OPENAI_HEDGE_MIN_SAMPLES", "20"))  # これだけ溜まるまでは下の固定値で待つ
+OPENAI_HEDGE_DELAY_SEC = float(os.environ.get("OPENAI_HEDGE_DELAY_SEC", "1.5"))
+OPENAI_FAST_MODEL      = os.environ.get("OPENAI_FAST_MODEL", "").strip() or OPENAI_MODEL  # 短い応答のインテントと、遅いときの落とし先（空なら OPENAI_MODEL）
+MODEL_ROUTES           = os.environ.get("MODEL_ROUTES", "").strip()  # インテント -> {model, max_tokens, timeout} の上書き（JSON）
+MODEL_ROUTING_ADAPTIVE = os.environ.get("MODEL_ROUTING_ADAPTIVE", "0").strip() == "1"  # 直近の p95 が間に合わないモデルは OPENAI_FAST_MODEL に落とす
+MODEL_ROUTING_MIN_SAMPLES = int(os.environ.get("MODEL_ROUTING_MIN_SAMPLES", "10"))  # これだけ溜まるまでは落とさない
+MODEL_ROUTING_TARGET_SEC = float(os.environ.get("MODEL_ROUTING_TARGET_SEC", "3.0"))  # 直近の p95 がこれを超えたら速いモデルに落とす（経路に timeout があればそちら）
+MODEL_ROUTING_WINDOW = int(os.environ.get("MODEL_ROUTING_WINDOW", "20"))  # 適応で見る直近の件数（短いほど劣化と回復に早く気づく）
+MODEL_ROUTING_PROBE_EVERY = int(os.environ.get("MODEL_ROUTING_PROBE_EVERY", "5"))  # 落としている間も、この回数に1回は元のモデルに送って測り直す（0 で送らない）
+ANSWER_CACHE           = os.environ.get("ANSWER_CACHE", "1").strip() == "1"  # 履歴なしの質問は回答を使い回す
+ANSWER_CACHE_TTL_SEC   = float(os.environ.get("ANSWER_CACHE_TTL_SEC", str(6 * 3600)))
+ANSWER_CACHE_MEM_BYTES = int(os.environ.get("ANSWER_CACHE_MEM_BYTES", str(1024 * 1024)))
+ANSWER_CACHE_S3_BYTES  = int(os.environ.get("ANSWER_CACHE_S3_BYTES", str(16 * 1024 * 1024)))  # 回答キャッシュ（S3 共有段。0 なら期限切れだけ消す）
+ASYNC_IO_CONCURRENT    = os.environ.get("ASYNC_IO_CONCURRENT", "1").strip() == "1"  # async ハンドラー内の独立 I/O を並行に待つ
+TRACING                = os.environ.get("TRACING", "1").strip() == "1"  # 呼び出しごとに EMF で所要時間を出す
+TRACE_NAMESPACE        = os.environ.get("TRACE_NAMESPACE", "PicoSkill").strip()  # CloudWatch メトリクスの名前空間
+PREGEN_MODE            = os.environ.get("PREGEN_MODE", "off").strip().lower()  # 「続けて」の先回り生成: off / inline / background
+PROGRESSIVE_RESPONSE   = os.environ.get("PROGRESSIVE_RESPONSE", "1").strip() == "1"  # LLM待ちの間に一言話す
+PROGRESSIVE_TIMEOUT_SEC = float(os.environ.get("PROGRESSIVE_TIMEOUT_SEC", "1.0"))
+SSML_PAGE_SEC          = float(os.environ.get("SSML_PAGE_SEC", "90"))  # 1ターンで話す長さの目安（秒）。超える分は「続けて」で次のページに（0 で分けない）。Notion の1節（NOTION_SECTION_CHARS）が1ページに収まる長さにする
+SSML_CHARS_PER_SEC     = float(os.environ.get("SSML_CHARS_PER_SEC", "8"))  # 読み上げの速さの目安（文字/秒）
+SSML_REST_MAX_CHARS    = int(os.environ.get("SSML_REST_MAX_CHARS", "2000"))  # セッションに残す話しきれなかった分の上限（セッション属性は毎回の応答に載る）
 NOTION_SEARCH_LIMIT    = int(os.environ.get("NOTION_SEARCH_LIMIT", "3"))
 NOTION_BLOCKS_PAGE_SZ  = int(os.environ.get("NOTION_BLOCKS_PAGE_SZ", "20"))
 NOTION_SNIPPET_CHARS   = int(os.environ.get("NOTION_SNIPPET_CHARS", "300"))
+NOTION_SECTION_CHARS   = int(os.environ.get("NOTION_SECTION_CHARS", "600"))  # 「続きを読んで」1回で読む文字数（1ページに収まらなければページの長さで頭打ち）
+NOTION_WRITE_RETRIES   = int(os.environ.get("NOTION_WRITE_RETRIES", "2"))  # 429/503 等で弾かれた書き込みバッチの再送回数
+NOTION_WRITE_BACKOFF_SEC = float(os.environ.get("NOTION_WRITE_BACKOFF_SEC", "0.3"))  # 再送の待ち（Retry-After があればそちら）
+NOTION_WRITE_BEHIND    = os.environ.get("NOTION_WRITE_BEHIND", "0").strip() == "1"  # 保存は S3 の outbox に積んで先に答える
+NOTION_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("NOTION_OUTBOX_MAX_ATTEMPTS", "5"))  # これだけ失敗したら諦めて次のターンで伝える
+NOTION_OUTBOX_LEASE_SEC = float(os.environ.get("NOTION_OUTBOX_LEASE_SEC", "30"))  # 実行中の操作を他の呼び出しに拾わせない秒数
+NOTION_RATE_RPS        = float(os.environ.get("NOTION_RATE_RPS", "3"))  # コンテナが Notion に送る上限（リクエスト/秒。0 で絞らない）
+NOTION_RATE_BURST      = float(os.environ.get("NOTION_RATE_BURST", "3"))  # 続けて送ってよい数
+NOTION_RATE_MAX_WAIT_SEC = float(os.environ.get("NOTION_RATE_MAX_WAIT_SEC", "1.5"))  # ユーザーが待つ呼び出しが順番を待つ上限
+NOTION_RATE_SHARED     = os.environ.get("NOTION_RATE_SHARED", "0").strip() == "1"  # S3 のリースでコンテナ間でもレートを分け合う
+NOTION_RATE_LEASE_SEC  = float(os.environ.get("NOTION_RATE_LEASE_SEC", "15"))  # リースの有効秒数（この間更新が無いコンテナは数えない）
+NOTION_BLOCK_MAX_DEPTH = int(os.environ.get("NOTION_BLOCK_MAX_DEPTH", "2"))  # トグル・リスト等の子ブロックを何段まで読むか
+NOTION_PREFETCH        = os.environ.get("NOTION_PREFETCH", "1").strip() == "1"  # 検索直後に本文を先読み
+# 検索の応答で先読みを待つ秒数。先読みの結果は本文キャッシュに入り「本文を読んで」で使われるので、既定では待たない。
+# 0 より大きくすると、間に合った本文を直近の検索結果にも入れる（キャッシュの無い環境向け。その分だけ検索の応答が遅れる）
+NOTION_PREFETCH_WAIT_SEC = float(os.environ.get("NOTION_PREFETCH_WAIT_SEC", "0"))
+PAGE_CACHE_MEM_BYTES   = int(os.environ.get("PAGE_CACHE_MEM_BYTES", str(2 * 1024 * 1024)))   # 本文キャッシュ（プロセス内）
+PAGE_CACHE_TMP_BYTES   = int(os.environ.get("PAGE_CACHE_TMP_BYTES", str(32 * 1024 * 1024)))  # 本文キャッシュ（/tmp）
+PAGE_CACHE_S3          = os.environ.get("PAGE_CACHE_S3", "1").strip() == "1"                 # 本文キャッシュ（S3 共有段）
+PAGE_CACHE_S3_BYTES    = int(os.environ.get("PAGE_CACHE_S3_BYTES", str(64 * 1024 * 1024)))  # 本文キャッシュ（S3 共有段の上限。0 なら消さない）
+RAG_RETAIN_BYTES       = int(os.environ.get("RAG_RETAIN_BYTES", str(64 * 1024)))  # ユーザーごとの RAG メモの上限（JSON のバイト数。古いものから落とす）
+RAG_RETAIN_ITEMS       = int(os.environ.get("RAG_RETAIN_ITEMS", "0"))  # 件数でも切るなら上限（0 なら件数では切らない）
+RAG_COMPACT_DELTAS     = int(os.environ.get("RAG_COMPACT_DELTAS", "8"))  # 差分がこれだけ溜まったら裏でスナップショットにまとめる
+RAG_CACHE_MEM_BYTES    = int(os.environ.get("RAG_CACHE_MEM_BYTES", str(1024 * 1024)))  # 変わらない差分・スナップショットのプロセス内キャッシュ
+
+_WARNED = False
 
 def warn_if_missing():
+    """重要キーが無ければ警告する（最初の1回だけ）。"""
+    global _WARNED
+    if _WARNED:
+        return
+    _WARNED = True
     if not OPENAI_API_KEY:
         LOGGER.warning("[config] OPENAI_API_KEY is missing")
     if not NOTION_TOKEN:
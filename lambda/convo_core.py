@@ -3,19 +3,25 @@ import re
 import time
 import html
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-from utils import get_openai_client_from_utils, call_openai_chat_once
+from utils import get_openai_client_from_utils, call_openai_chat_once, call_openai_chat_stream
 from config import (
-    OPENAI_MODEL, HTTP_TIMEOUT_SEC, HARD_DEADLINE_SEC, MAX_HISTORY_TURNS, warn_if_missing
+    HTTP_TIMEOUT_SEC, HARD_DEADLINE_SEC, MIN_LLM_BUDGET_SEC, MAX_HISTORY_TURNS,
+    LLM_STREAMING, OPENAI_HEDGE, SSML_PAGE_SEC, SSML_CHARS_PER_SEC, SSML_REST_MAX_CHARS
 )
+from deadline import budget_nearly_exhausted
+from prompt_budget import build_messages
+from llm_hedge import call_openai_chat_hedged
+from model_router import choose_route
 
 LOGGER = logging.getLogger(__name__)
-warn_if_missing()  # 起動時に一度だけ警告
 
 LAUNCH_SPEECH    = "ぴこだよ。なんでも聞いてみて！"
 GENERIC_REPROMPT = "他に質問あるかな？『続けて』で詳しくも話せるよ。"
 ERROR_SPEECH     = "ごめん、いまはうまく答えを取れなかった。『続けて』で試せるよ。"
+THINKING_SPEECH  = "ちょっと考えるね。"  # Progressive Response 用
+MORE_PAGES_HINT  = "続きは『続けて』と言ってね。"
 
 SYSTEM_PROMPT = (
     "あなたは『ぴこ』。日本語で話す、元気で可愛い相棒アシスタント。"
@@ -30,37 +36,140 @@ SYSTEM_PROMPT = (
 )
 FEWSHOT_USER      = "自己紹介して"
 FEWSHOT_ASSISTANT = "やっほー、ぼくは『ぴこ』だよ！短くわかりやすくお手伝いするね。何から話そっか？"
+# 毎回まったく同じ先頭部分（プロバイダーのプロンプトキャッシュを当てるため、ここには可変の内容を入れない）
+STATIC_PREFIX = [
+    {"role": "system", "content": SYSTEM_PROMPT},
+    {"role": "user", "content": FEWSHOT_USER},
+    {"role": "assistant", "content": FEWSHOT_ASSISTANT},
+]
 
 # ---------- SSML ----------
 _URL_RE   = re.compile(r'https?://\S+')
 _CTRL_RE  = re.compile(r'[\x00-\x08\x0b-\x0c\x0e-\x1f]')
 _EMOJI_RE = re.compile("[\U0001F300-\U0001FAFF\U00002700-\U000027BF\U00002600-\U000026FF\U0001F1E6-\U0001F1FF]+", flags=re.UNICODE)
 
-def to_safe_ssml(text: str) -> str:
-    if not text:
-        text = "……"
-    text = _CTRL_RE.sub("", text)
+_SSML_MAX_CHARS = 7000  # Alexa の outputSpeech の上限（8000）より少し下
+_PARA_BREAK = "<break time=\"200ms\"/>"
+_SPEAKABLE_ENDS = ("。", "！", "？", "!", "?", "…")
+# 文末（。！？…）までを1文とする。閉じ括弧は前の文に付ける
+_SPEAKABLE_RE = re.compile(r'[^。！？!?…]*[。！？!?…]+[」』）)]*|[^。！？!?…]+')
+
+def page_chars() -> int:
+    """1ターンで話す文字数の目安（SSML_PAGE_SEC=0 なら分けない）。"""
+    if SSML_PAGE_SEC <= 0:
+        return _SSML_MAX_CHARS
+    return max(40, int(SSML_PAGE_SEC * SSML_CHARS_PER_SEC))
+
+def _speakables(paragraph: str, limit: int) -> List[str]:
+    """段落を文に分ける。limit より長い文は読点（、）で、それでも長ければ limit 文字で分ける。"""
+    out = []
+    for m in _SPEAKABLE_RE.finditer(paragraph):
+        s = m.group(0)
+        while len(s) > limit:
+            cut = s.rfind("、", 0, limit) + 1 or limit
+            out.append(s[:cut])
+            s = s[cut:]
+        if s.strip():
+            out.append(s)
+    return out
+
+def render_ssml_page(text: str, *, max_chars: Optional[int] = None, more_hint: str = MORE_PAGES_HINT,
+                     tail: str = "") -> Tuple[str, str]:
+    """
+    text のうち1ターンで話す分（max_chars 文字、SSML で _SSML_MAX_CHARS まで）を SSML にし、
+    (SSML, 話しきれなかった残り) を返す。
+    - 文の単位で詰めるので、タグやエスケープした文字の途中では切れない
+    - 残りは段落の区切りを改行で残した素のテキスト（そのまま次のページとして渡せる）
+    - 残りがあるときは more_hint を、最後まで話せたときは tail（「続きを読んで」などの案内）を最後に添える
+      （案内はどちらか1つだけ）
+    """
+    limit = max_chars or page_chars()
+    text = _CTRL_RE.sub("", text or "……")
     text = _URL_RE.sub("リンク", text)
     text = _EMOJI_RE.sub("", text)
-    parts = [html.escape(p.strip()) for p in text.split("\n") if p.strip()]
-    if not parts:
-        parts = [html.escape("うまく説明できなかったよ。別の言い方で聞いてみてね。")]
-    norm = []
-    for p in parts:
-        if not p.endswith(("。","！","？","!","?","…")):
-            p += "。"
-        norm.append(f"<p>{p}</p>")
-    ssml = "<speak>" + "<break time=\"200ms\"/>".join(norm) + "</speak>"
-    if len(ssml) > 7000:
-        ssml = ssml[:6900] + "</speak>"
+    paras = [p.strip() for p in text.split("\n") if p.strip()]
+    if not paras:
+        paras = ["うまく説明できなかったよ。別の言い方で聞いてみてね。"]
+    hint = max(more_hint, tail, key=len)
+    reserve = len(_PARA_BREAK) + len(f"<p>{html.escape(hint)}</p>") if hint else 0
+    size = len("<speak></speak>") + reserve
+    spoken = 0
+    out: List[str] = []
+    rest: List[str] = []
+    for i, para in enumerate(paras):
+        sentences = _speakables(para, limit)
+        taken = []
+        for j, s in enumerate(sentences):
+            esc = html.escape(s.strip())
+            overhead = 0 if taken else len("<p>。</p>") + (len(_PARA_BREAK) if out else 0)
+            cost = len(esc) + overhead
+            if (out or taken) and (spoken + len(s) > limit or size + cost > _SSML_MAX_CHARS):
+                rest = ["".join(sentences[j:]).strip()] + paras[i + 1:]
+                break
+            if size + cost > _SSML_MAX_CHARS:
+                # 最初の1文だけで上限を超える（エスケープで伸びた）ときは、収まるところで切って残りは次へ
+                room = _SSML_MAX_CHARS - size - overhead
+                while len(esc) > room:
+                    s = s[:max(1, min(len(s) - 1, len(s) * room // len(esc)))]
+                    esc = html.escape(s.strip())
+                sentences[j + 1:j + 1] = [sentences[j][len(s):]]
+                cost = len(esc) + overhead
+            taken.append(esc)
+            spoken += len(s)
+            size += cost
+        if taken:
+            p = "".join(taken)
+            out.append(f"<p>{p if p.endswith(_SPEAKABLE_ENDS) else p + '。'}</p>")
+        if rest:
+            break
+    rest_text = "\n".join(r for r in rest if r)
+    if rest_text and more_hint:
+        out.append(f"<p>{html.escape(more_hint)}</p>")
+    elif not rest_text and tail:
+        out.append(f"<p>{html.escape(tail)}</p>")
+    return "<speak>" + _PARA_BREAK.join(out) + "</speak>", rest_text
+
+def to_safe_ssml(text: str) -> str:
+    """text を1つの SSML にする（上限を超える分は文の単位で落とす。続きを話すなら speak_paged）。"""
+    ssml, rest = render_ssml_page(text, max_chars=_SSML_MAX_CHARS, more_hint="")
+    if rest:
+        LOGGER.info(f"[ssml] dropped chars={len(rest)}")
+    return ssml
+
+def speak_paged(session: Dict[str, Any], text: str, *, tail: str = "") -> str:
+    """
+    text の最初のページの SSML を返し、話しきれなかった残りを session["ssml_rest"] に置く
+    （ContinuationIntent が take_next_page で LLM も Notion も呼ばずに次のページを話す）。
+    tail は最後のページの終わりにだけ添える案内（途中のページは「続けて」の案内だけ。残りと一緒に持ち越す）。
+    """
+    ssml, rest = render_ssml_page(text, tail=tail)
+    session.pop("ssml_rest", None)
+    session.pop("ssml_tail", None)
+    if rest:
+        if len(rest) > SSML_REST_MAX_CHARS:
+            kept = split_at_sentence_end(rest[:SSML_REST_MAX_CHARS])[0] or rest[:SSML_REST_MAX_CHARS]
+            LOGGER.info(f"[ssml] rest capped chars={len(rest)} kept={len(kept)}")
+            rest = kept
+        if rest:
+            session["ssml_rest"] = rest
+            if tail:
+                session["ssml_tail"] = tail
+    LOGGER.info(f"[ssml] page chars={len(ssml)} rest={len(rest)}")
     return ssml
 
+def take_next_page(session: Dict[str, Any]) -> str:
+    """前のターンで話しきれなかった残りがあれば、その次のページの SSML を返す（無ければ ""）。"""
+    rest = session.pop("ssml_rest", None) or ""
+    tail = session.pop("ssml_tail", None) or ""
+    return speak_paged(session, rest, tail=tail) if rest else ""
+
 # ---------- 共通 ----------
 def _now() -> float:
     return time.time()
 
-def _deadline_exceeded(start: float) -> bool:
-    return (_now() - start) >= HARD_DEADLINE_SEC
+def _budget_low() -> bool:
+    """リクエストの残り予算では LLM を1回呼ぶ余裕が無いか（あれば pending_prompt に回す）。"""
+    return budget_nearly_exhausted(MIN_LLM_BUDGET_SEC)
 
 def _get_session(handler_input) -> Dict[str, Any]:
     return handler_input.attributes_manager.session_attributes
@@ -81,18 +190,85 @@ def _last_user_utterance(session: Dict[str, Any]) -> str:
 
 # ---------- OpenAI ----------
 def _build_chat_messages(session: Dict[str, Any], user_query: str, snippets: Optional[list] = None) -> List[Dict[str, str]]:
-    msgs = [{"role": "system", "content": SYSTEM_PROMPT}]
-    if snippets:
-        msgs.append({"role": "system", "content": "参照ノート:\n" + "\n".join(snippets)})
-    msgs.append({"role": "user", "content": FEWSHOT_USER})
-    msgs.append({"role": "assistant", "content": FEWSHOT_ASSISTANT})
-    for t in session.get("history", []):
-        if t.get("role") in ("user","assistant") and (t.get("text") or "").strip():
-            msgs.append({"role": t["role"], "content": t["text"][:200]})
-    msgs.append({"role": "user", "content": (user_query or "").strip()[:400]})
-    return msgs
-
-def one_shot_answer(session: Dict[str, Any], user_query: str, snippets: Optional[list] = None) -> str:
-    client = get_openai_client_from_utils(timeout_sec=HTTP_TIMEOUT_SEC)
+    """固定プレフィックス + 予算内に収めた参照ノート・履歴 + 今回の質問（prompt_budget.build_messages）。"""
+    return build_messages(STATIC_PREFIX, session.get("history", []), user_query, snippets)
+
+def one_shot_answer(session: Dict[str, Any], user_query: str, snippets: Optional[list] = None, *,
+                    intent: Optional[str] = None) -> str:
+    """
+    モデル・max_tokens・タイムアウトは intent の経路（model_router）で決める。
+    ヘッジで届き切らなかったときは answer_with_resume と同じく、話せるところまで返して続きを
+    session["stream_resume"] に置く（途中で切れた回答は回答キャッシュにも先回りにも残さない）。
+    """
+    route = choose_route(intent, default_timeout=HTTP_TIMEOUT_SEC)
+    timeout = route.timeout or HTTP_TIMEOUT_SEC
+    client = get_openai_client_from_utils(timeout_sec=timeout)
+    messages = _build_chat_messages(session, user_query, snippets)
+    if OPENAI_HEDGE:
+        # ヘッジはストリーミングで送る（負けた方を閉じられるように）
+        text, complete = call_openai_chat_hedged(client, route.model, messages, timeout_sec=timeout,
+                                                 max_tokens=route.max_tokens)
+        return text if complete or not text else _cut_for_resume(session, user_query, text)
+    return call_openai_chat_once(client, route.model, messages, timeout_sec=timeout, max_tokens=route.max_tokens)
+
+# ---------- ストリーミング（期限で打ち切り → 文末で切って残りは「続けて」へ） ----------
+_SENTENCE_ENDS = "。！？!?"
+
+def split_at_sentence_end(text: str) -> Tuple[str, str]:
+    """最後の文末（。！？）で分ける。文末が無ければ全部を残りとして返す。"""
+    cut = max(text.rfind(c) for c in _SENTENCE_ENDS)
+    if cut < 0:
+        return "", text
+    return text[:cut + 1].strip(), text[cut + 1:].strip()
+
+_PAUSES = "、，,"
+_MIN_PAUSE_CUT = 20  # 読点で切るのはこの文字数以上話せるときだけ（短すぎる断片は話さない）
+
+def _cut_for_resume(session: Dict[str, Any], user_query: str, text: str) -> str:
+    """
+    途中で切れた回答を話せるところまで返し、続きは session["stream_resume"] に置く。
+    文末が無ければ最後の読点で切る。それも無ければ何も話さず、「続けて」で質問からやり直す。
+    """
+    spoken, tail = split_at_sentence_end(text)
+    if not spoken:
+        cut = max(text.rfind(c) for c in _PAUSES)
+        if cut + 1 >= _MIN_PAUSE_CUT:
+            spoken, tail = text[:cut + 1].strip(), text[cut + 1:].strip()
+    session["stream_resume"] = {"prompt": (user_query or "").strip()[:400], "tail": tail[:200],
+                                "spoken": bool(spoken)}
+    LOGGER.info(f"[stream] cut spoken={len(spoken)} tail={len(tail)}")
+    return spoken
+
+def answer_with_resume(session: Dict[str, Any], user_query: str, snippets: Optional[list] = None, *,
+                       intent: Optional[str] = None) -> str:
+    """
+    one_shot_answer のストリーミング版。期限までに届いた分を文末（無ければ読点）で切って返し、
+    途中で切れた残りは session["stream_resume"] に置いて ContinuationIntent で続きから話す。
+    LLM_STREAMING=0 なら従来どおり one_shot_answer。OPENAI_HEDGE=1 なら遅いときに2本目を送る（llm_hedge）。
+    """
+    session.pop("stream_resume", None)
+    if not LLM_STREAMING:
+        return one_shot_answer(session, user_query, snippets, intent=intent)
+    # ストリーミングは届いた分を使えるので、経路にタイムアウトが無ければ残り予算いっぱいまで待つ
+    route = choose_route(intent, default_timeout=HARD_DEADLINE_SEC, streaming=True)
+    client = get_openai_client_from_utils()
     messages = _build_chat_messages(session, user_query, snippets)
-    return call_openai_chat_once(client, OPENAI_MODEL, messages, timeout_sec=HTTP_TIMEOUT_SEC)
+    chat_stream = call_openai_chat_hedged if OPENAI_HEDGE else call_openai_chat_stream
+    text, complete = chat_stream(client, route.model, messages, timeout_sec=route.timeout or HARD_DEADLINE_SEC,
+                                 max_tokens=route.max_tokens)
+    if complete or not text:
+        return text
+    return _cut_for_resume(session, user_query, text)
+
+def take_resume_prompt(session: Dict[str, Any]) -> str:
+    """途中で切れた回答があれば、その続きを頼むプロンプトを返す（1回で消費）。"""
+    resume = session.pop("stream_resume", None) or {}
+    if not resume.get("prompt"):
+        return ""
+    if not resume.get("spoken", True):
+        # 何も話せていないので、続きではなく元の質問をもう一度聞く
+        return resume["prompt"]
+    tail = (resume.get("tail") or "").strip()
+    if tail:
+        return f"さっきの答えは「{tail}」のところで途切れたよ。その続きから話して。"
+    return "さっきの答えの続きを話して。"
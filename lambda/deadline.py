@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+deadline.py
+- 1リクエスト分の残り時間（デッドライン予算）を表すオブジェクト
+- lambda_handler が受信時に作り、ContextVar で下位の S3 / Notion / OpenAI 呼び出しへ伝える
+- 各呼び出しは「固定タイムアウト」と「残り予算」の小さい方で切る
+"""
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from config import HARD_DEADLINE_SEC, RESPONSE_RESERVE_SEC, MIN_CALL_TIMEOUT_SEC
+
+class Deadline:
+    def __init__(self, budget_sec: float, *, reserve_sec: float = RESPONSE_RESERVE_SEC):
+        self.start = time.monotonic()
+        self.budget_sec = float(budget_sec)
+        self.reserve_sec = float(reserve_sec)  # 応答の組み立て・S3書き出し用に残しておく分
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float:
+        """応答用の予備を除いた、上流呼び出しに使える残り秒数（負にはしない）。"""
+        return max(0.0, self.budget_sec - self.reserve_sec - self.elapsed())
+
+    def timeout(self, cap: Optional[float] = None, *, floor: float = MIN_CALL_TIMEOUT_SEC) -> float:
+        """cap と残り予算の小さい方。ただし floor 未満にはしない（即タイムアウトを避ける）。"""
+        t = self.remaining()
+        if cap is not None:
+            t = min(t, float(cap))
+        return max(floor, t)
+
+    def nearly_exhausted(self, need_sec: float) -> bool:
+        """need_sec 秒の仕事をする余裕がもう無いか。"""
+        return self.remaining() < need_sec
+
+_CURRENT: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("pico_deadline", default=None)
+
+@contextmanager
+def request_deadline(budget_sec: float = HARD_DEADLINE_SEC):
+    """このブロックの間、current_deadline() が同じ Deadline を返す。"""
+    dl = Deadline(budget_sec)
+    token = _CURRENT.set(dl)
+    try:
+        yield dl
+    finally:
+        _CURRENT.reset(token)
+
+def current_deadline() -> Optional[Deadline]:
+    return _CURRENT.get()
+
+def budget_timeout(cap: float, *, floor: float = MIN_CALL_TIMEOUT_SEC) -> float:
+    """現在のリクエスト予算で cap を切り詰めたタイムアウト（予算外なら cap のまま）。"""
+    dl = _CURRENT.get()
+    if dl is None:
+        return float(cap)
+    return dl.timeout(cap, floor=floor)
+
+def budget_nearly_exhausted(need_sec: float) -> bool:
+    dl = _CURRENT.get()
+    return dl is not None and dl.nearly_exhausted(need_sec)
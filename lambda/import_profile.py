@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+import_profile.py
+- PICO_IMPORT_PROFILE=1 のとき、モジュールごとの import 時間を計ってログに出す（コールドスタート調査用）
+- builtins.__import__ を包み、初めて読み込まれるモジュールだけを計る
+  - self : そのモジュール自身の実行時間（中で import した子の分は引く）
+  - 集計 : トップレベルのパッケージ（openai, boto3 など）ごとに self を合計
+- 初期化の終わり（phase=init）と最初の応答のあと（phase=first-request、遅延 import の分）に出す
+- 環境変数だけを見る（.env を読む config より前に有効にする必要があるため）
+"""
+import os
+import sys
+import time
+import logging
+import builtins
+import threading
+from typing import Dict, List, Optional
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+ENABLED = os.environ.get("PICO_IMPORT_PROFILE", "0").strip() == "1"
+TOP_N = int(os.environ.get("PICO_IMPORT_PROFILE_TOP", "15"))
+
+_ORIG_IMPORT = builtins.__import__
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_SELF_MS: Dict[str, float] = {}   # モジュール名 -> self 時間（ms）
+_REPORTED: Dict[str, float] = {}  # 前回までに出した分
+_STARTED_AT: Optional[float] = None
+
+def _stack() -> List[float]:
+    st = getattr(_LOCAL, "stack", None)
+    if st is None:
+        st = _LOCAL.stack = []
+    return st
+
+def _profiling_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _ORIG_IMPORT(name, globals, locals, fromlist, level)
+    stack = _stack()
+    stack.append(0.0)  # 子の import に使った時間をここへ足していく
+    t0 = time.perf_counter()
+    try:
+        return _ORIG_IMPORT(name, globals, locals, fromlist, level)
+    finally:
+        total = (time.perf_counter() - t0) * 1000
+        child = stack.pop()
+        if stack:
+            stack[-1] += total
+        with _LOCK:
+            _SELF_MS[name] = _SELF_MS.get(name, 0.0) + (total - child)
+
+def start() -> None:
+    """計測を始める（ENABLED でなければ何もしない）。"""
+    global _STARTED_AT
+    if not ENABLED or _STARTED_AT is not None:
+        return
+    _STARTED_AT = time.perf_counter()
+    builtins.__import__ = _profiling_import
+
+def stop() -> None:
+    """計測をやめて元の __import__ に戻す。"""
+    global _STARTED_AT
+    if _STARTED_AT is None:
+        return
+    builtins.__import__ = _ORIG_IMPORT
+    _STARTED_AT = None
+
+def report(phase: str) -> None:
+    """前回の report 以降に読み込まれた分を、パッケージ別に多い順でログに出す。"""
+    if _STARTED_AT is None:
+        return
+    with _LOCK:
+        fresh = {k: v - _REPORTED.get(k, 0.0) for k, v in _SELF_MS.items() if v > _REPORTED.get(k, 0.0)}
+        _REPORTED.update(_SELF_MS)
+    by_pkg: Dict[str, float] = {}
+    for name, ms in fresh.items():
+        pkg = name.split(".", 1)[0]
+        by_pkg[pkg] = by_pkg.get(pkg, 0.0) + ms
+    top = sorted(by_pkg.items(), key=lambda kv: kv[1], reverse=True)[:TOP_N]
+    total = sum(by_pkg.values())
+    elapsed = (time.perf_counter() - _STARTED_AT) * 1000
+    LOGGER.info(f"[import-profile] phase={phase} import_ms={total:.1f} since_start_ms={elapsed:.1f} modules={len(fresh)} "
+                + " ".join(f"{k}={v:.1f}" for k, v in top))
@@ -1,27 +1,48 @@
 # -*- coding: utf-8 -*-
+import import_profile  # PICO_IMPORT_PROFILE=1 なら、ここから先の import 時間を計る
+import_profile.start()
+
 import logging
 from typing import Any, Dict
 
 from ask_sdk_core.skill_builder import SkillBuilder
-from ask_sdk_core.dispatch_components import AbstractRequestHandler, AbstractExceptionHandler
+from ask_sdk_core.dispatch_components import (
+    AbstractRequestHandler, AbstractExceptionHandler, AbstractRequestInterceptor, AbstractResponseInterceptor
+)
 from ask_sdk_core.utils import is_request_type, is_intent_name
 from ask_sdk_model import Response
 
 from convo_core import (
-    LAUNCH_SPEECH, GENERIC_REPROMPT, ERROR_SPEECH,
-    _now, _deadline_exceeded, to_safe_ssml,
+    LAUNCH_SPEECH, GENERIC_REPROMPT, ERROR_SPEECH, THINKING_SPEECH, MORE_PAGES_HINT, page_chars,
+    _now, _budget_low, to_safe_ssml, speak_paged, take_next_page,
     _get_session, _append_history, _last_user_utterance,
-    one_shot_answer
+    answer_with_resume, take_resume_prompt
 )
 from notion_utils import (
-    notion_search_pages, notion_page_first_text,
-    notion_create_page, notion_add_to_database
+    notion_create_page, notion_add_to_database, notion_page_section,
+    start_prefetch_first_texts, record_prefetch_outcome,
+    notion_search_pages_async, notion_page_section_async, collect_prefetched_async,
+    cached_page_section_async
 )
 from rag_store_s3 import (
     s3_store_load_user, s3_store_save_user,
-    rag_add_items, rag_top_snippets,
-    save_last_notion_results, load_last_notion_results
+    rag_top_snippets, s3_unit_of_work,
+    rag_preload_async, rag_add_items_async,
+    save_last_notion_results_async, load_last_notion_results_async
 )
+from config import (
+    HARD_DEADLINE_SEC, PROGRESSIVE_RESPONSE, NOTION_PREFETCH, NOTION_PREFETCH_WAIT_SEC, NOTION_SECTION_CHARS,
+    NOTION_WRITE_BEHIND,
+    warn_if_missing
+)
+from deadline import request_deadline, budget_timeout
+from progressive import start_progressive_response
+from answer_cache import lookup_answer, store_answer
+from pregen import continuation_prompt, maybe_pregenerate, take_pregenerated
+from async_adapter import AsyncRequestHandler, gather_io
+from tracing import request_trace, traced_handler, record_payload
+from notion_rate import recently_throttled
+import outbox
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -34,6 +55,9 @@ INTENTS_WITH_QUERY = {
 }
 NOTION_SEARCH_INTENT = "NotionSearchIntent"
 NOTION_READ_INTENT   = "NotionReadIntent"
+NOTION_MORE_HINT     = "続きは『続きを読んで』と言ってね。"
+_NOTION_FRAME_CHARS  = 60  # 節の前後に付ける「『タイトル』の続きだよ。」の分（長いタイトルは文の単位で次のページへ）
+NOTION_BUSY_SPEECH   = "今Notionが混み合っているみたい。少し待ってからもう一度言ってね。"
 
 class LaunchRequestHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
@@ -53,17 +77,32 @@ class GenericQueryIntentsHandler(AbstractRequestHandler):
         return getattr(req, "name", "") in INTENTS_WITH_QUERY
     def handle(self, handler_input) -> Response:
         s = _get_session(handler_input)
+        s.pop("notion_resume", None)  # 別の質問に移ったら、読みかけの本文の続きは捨てる
         intent = handler_input.request_envelope.request.intent
         slots: Dict[str, Any] = getattr(intent, "slots", {}) or {}
         q = (slots.get("query").value if "query" in slots and slots["query"] else "") or ""
-        snippets = rag_top_snippets(handler_input, k=5)
-        ans = one_shot_answer(session=s, user_query=q, snippets=snippets)
+        snippets = rag_top_snippets(handler_input, k=5, query=q)
+        ans = lookup_answer(s, intent.name, q, snippets)
+        if not ans:
+            if _budget_low():
+                s["pending_prompt"] = q
+                return (handler_input.response_builder
+                        .speak(to_safe_ssml(ERROR_SPEECH))
+                        .ask(to_safe_ssml("『続けて』と言ってね。"))
+                        .response)
+            if PROGRESSIVE_RESPONSE:
+                # LLM 呼び出しの間、別スレッドで「ちょっと考えるね」を先に話す
+                start_progressive_response(handler_input, to_safe_ssml(THINKING_SPEECH))
+            t0 = _now()
+            ans = answer_with_resume(session=s, user_query=q, snippets=snippets, intent=intent.name)
+            store_answer(s, intent.name, q, snippets, ans, _now() - t0)
         if ans:
             _append_history(s, "user", q)
             _append_history(s, "assistant", ans)
             s["pending_prompt"] = None
+            maybe_pregenerate(handler_input, s)
             return (handler_input.response_builder
-                    .speak(to_safe_ssml(ans))
+                    .speak(speak_paged(s, ans))
                     .ask(to_safe_ssml(GENERIC_REPROMPT))
                     .response)
         return (handler_input.response_builder
@@ -71,19 +110,32 @@ class GenericQueryIntentsHandler(AbstractRequestHandler):
                 .ask(to_safe_ssml("『続けて』と言ってね。"))
                 .response)
 
-class NotionSearchIntentHandler(AbstractRequestHandler):
+class NotionSearchIntentHandler(AsyncRequestHandler):
     def can_handle(self, handler_input):
         return is_intent_name(NOTION_SEARCH_INTENT)(handler_input)
-    def handle(self, handler_input) -> Response:
+    async def handle_async(self, handler_input) -> Response:
         intent = handler_input.request_envelope.request.intent
         slots: Dict[str, Any] = getattr(intent, "slots", {}) or {}
         q = (slots.get("query").value if "query" in slots and slots["query"] else "") or ""
-        items = notion_search_pages(q)
+        _get_session(handler_input).pop("notion_resume", None)
+        # Notion 検索と RAG ドキュメントの S3 読み込みは独立なので並行に待つ
+        items, _ = await gather_io(notion_search_pages_async(q), rag_preload_async(handler_input))
         if items:
-            save_last_notion_results(handler_input, items)
-            rag_add_items(handler_input, [{"title":it["title"],"url":it["url"],"snippet":it["title"]} for it in items])
+            # 「1件目の本文を読んで」に備えて、タイトルを返す準備の裏で本文を先読みする
+            # 先読みの結果は本文キャッシュに入るので、この応答では待たない（NOTION_PREFETCH_WAIT_SEC 既定 0）。
+            # ここで拾うのは、すでに終わっていたもの（キャッシュに当たった本文）だけ
+            futures = start_prefetch_first_texts(items) if NOTION_PREFETCH else {}
+            await rag_add_items_async(handler_input, [{"title":it["title"],"url":it["url"],"snippet":it["title"]} for it in items])
+            bodies = await collect_prefetched_async(futures, budget_timeout(NOTION_PREFETCH_WAIT_SEC, floor=0.0))
+            await save_last_notion_results_async(handler_input, [
+                dict(it, snippet=(bodies.get(it.get("id")) or {}).get("text", ""),
+                     cursor=(bodies.get(it.get("id")) or {}).get("cursor"))
+                for it in items
+            ])
             lines = [f"{i+1}件目、{it['title']}" for i, it in enumerate(items)]
             speech = "Notionの上位3件だよ。 " + " ".join(lines) + "。本文が必要なら『1件目の本文を読んで』みたいに言ってね。"
+        elif recently_throttled():
+            speech = NOTION_BUSY_SPEECH  # 429・順番待ちで取れなかったのを「見つからなかった」と言わない
         else:
             speech = f"Notionで「{q}」は見つからなかったよ。"
         return (handler_input.response_builder
@@ -91,10 +143,10 @@ class NotionSearchIntentHandler(AbstractRequestHandler):
                 .ask(to_safe_ssml("ほかに探す？"))
                 .response)
 
-class NotionReadIntentHandler(AbstractRequestHandler):
+class NotionReadIntentHandler(AsyncRequestHandler):
     def can_handle(self, handler_input):
         return is_intent_name(NOTION_READ_INTENT)(handler_input)
-    def handle(self, handler_input) -> Response:
+    async def handle_async(self, handler_input) -> Response:
         import math
         intent = handler_input.request_envelope.request.intent
         slots: Dict[str, Any] = getattr(intent, "slots", {}) or {}
@@ -109,7 +161,8 @@ class NotionReadIntentHandler(AbstractRequestHandler):
         title_hint = (slots.get("title").value if "title" in slots and slots["title"] else "") or ""
         position   = (slots.get("position").value if "position" in slots and slots["position"] else "") or ""
 
-        items = load_last_notion_results(handler_input)
+        # 直近の検索結果と、本文を足す先の RAG ドキュメントを並行に読む
+        items, _ = await gather_io(load_last_notion_results_async(handler_input), rag_preload_async(handler_input))
         if not items:
             speech = "直近の検索結果が見つからないよ。まず『Notionで ◯◯ を探して』と言ってみてね。"
             return (handler_input.response_builder
@@ -146,19 +199,35 @@ class NotionReadIntentHandler(AbstractRequestHandler):
                     .response)
 
         pid = (target.get("id") or "").replace("-", "")
-        snippet = notion_page_first_text(pid) if pid else ""
+        snippet = target.get("snippet") or ""  # 検索時に先読みできていれば Notion を呼ばない
+        cursor = target.get("cursor") if snippet else None
+        if not snippet and pid:
+            # 検索の応答の後に終わった先読みは本文キャッシュに入っている
+            cached = await cached_page_section_async(pid, last_edited=target.get("edited") or None)
+            if cached:
+                snippet, cursor = cached.get("text") or "", cached.get("cursor")
+        if NOTION_PREFETCH:
+            record_prefetch_outcome(bool(snippet))
+        if not snippet and pid:
+            section = await notion_page_section_async(pid, last_edited=target.get("edited") or None)
+            snippet, cursor = section["text"], section["cursor"]
+        s = _get_session(handler_input)
+        s.pop("notion_resume", None)
         if not snippet:
-            speech = f"『{target.get('title')}』の本文は今うまく取れなかったよ。"
+            speech = NOTION_BUSY_SPEECH if recently_throttled() else f"『{target.get('title')}』の本文は今うまく取れなかったよ。"
         else:
-            rag_add_items(handler_input, [{
+            await rag_add_items_async(handler_input, [{
                 "title": target.get("title"),
                 "url": target.get("url"),
                 "snippet": snippet
             }])
             speech = f"『{target.get('title')}』の要点だよ。{snippet}"
+            if cursor:
+                # 「続きを読んで」でページの頭を取り直さずに次の節から読む
+                s["notion_resume"] = {"id": pid, "title": target.get("title"), "cursor": cursor}
 
         return (handler_input.response_builder
-                .speak(to_safe_ssml(speech))
+                .speak(speak_paged(s, speech, tail=NOTION_MORE_HINT if s.get("notion_resume") else ""))
                 .ask(to_safe_ssml(GENERIC_REPROMPT))
                 .response)
 
@@ -185,27 +254,29 @@ class RefineIntentHandler(AbstractRequestHandler):
         return is_intent_name("RefineIntent")(handler_input)
     def handle(self, handler_input) -> Response:
         s = _get_session(handler_input)
+        s.pop("notion_resume", None)
         intent = handler_input.request_envelope.request.intent
         slot = intent.slots.get("filter") if intent and intent.slots else None
         filt = (slot.value if slot else "") or ""
         base = s.get("pending_prompt") or _last_user_utterance(s) or filt
         refined = f"{base}。ただし条件は「{filt}」。要点だけ短く。"
 
-        start = _now()
-        if _deadline_exceeded(start):
+        snippets = rag_top_snippets(handler_input, k=5, query=refined)
+        if _budget_low():
             s["pending_prompt"] = refined
             return (handler_input.response_builder
                     .speak(to_safe_ssml(ERROR_SPEECH))
                     .ask(to_safe_ssml("『続けて』と言ってね。"))
                     .response)
 
-        ans = one_shot_answer(s, refined, snippets=rag_top_snippets(handler_input, k=5))
+        ans = answer_with_resume(s, refined, snippets=snippets, intent="RefineIntent")
         if ans:
             _append_history(s, "user", refined)
             _append_history(s, "assistant", ans)
             s["pending_prompt"] = None
+            maybe_pregenerate(handler_input, s)
             return (handler_input.response_builder
-                    .speak(to_safe_ssml(ans))
+                    .speak(speak_paged(s, ans))
                     .ask(to_safe_ssml(GENERIC_REPROMPT))
                     .response)
 
@@ -215,6 +286,35 @@ class RefineIntentHandler(AbstractRequestHandler):
                 .ask(to_safe_ssml("『続けて』と言ってね。"))
                 .response)
 
+def _notion_section_chars() -> int:
+    """「続きを読んで」1回で読む文字数（1ページに前置きと案内ごと収まるように、ページの長さで頭打ちにする）。"""
+    return max(100, min(NOTION_SECTION_CHARS, page_chars() - _NOTION_FRAME_CHARS))
+
+def _read_notion_more(handler_input, s: Dict[str, Any]) -> Response:
+    resume = s["notion_resume"]
+    title = resume.get("title") or ""
+    section = notion_page_section(resume.get("id") or "", max_chars=_notion_section_chars(),
+                                  cursor=resume.get("cursor"))
+    tail = ""
+    if not section["text"] and section["cursor"]:
+        speech = NOTION_BUSY_SPEECH if recently_throttled() else f"『{title}』の続きは今うまく取れなかったよ。"
+        reprompt = "もう一度『続きを読んで』と言ってね。"
+    elif not section["text"]:
+        s.pop("notion_resume", None)
+        speech, reprompt = f"『{title}』はここまでだよ。", GENERIC_REPROMPT
+    elif section["cursor"]:
+        resume["cursor"] = section["cursor"]
+        speech, reprompt = f"『{title}』の続きだよ。{section['text']}", NOTION_MORE_HINT
+        tail = NOTION_MORE_HINT
+    else:
+        s.pop("notion_resume", None)
+        speech, reprompt = f"『{title}』の続きだよ。{section['text']}", GENERIC_REPROMPT
+        tail = "これで最後だよ。"
+    return (handler_input.response_builder
+            .speak(speak_paged(s, speech, tail=tail))
+            .ask(to_safe_ssml(reprompt))
+            .response)
+
 class ContinuationIntentHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
         return is_intent_name("ContinuationIntent")(handler_input)
@@ -224,7 +324,23 @@ class ContinuationIntentHandler(AbstractRequestHandler):
         slot = intent.slots.get("query") if intent and intent.slots else None
         q_from_slot = (slot.value if slot else "") or ""
 
-        pending = (s.get("pending_prompt") or "").strip()
+        # 前のターンで話しきれなかったページがあれば、LLM も Notion も呼ばずにそれを話す
+        page = take_next_page(s)
+        if page:
+            reprompt = (MORE_PAGES_HINT if s.get("ssml_rest")
+                        else NOTION_MORE_HINT if s.get("notion_resume") else GENERIC_REPROMPT)
+            return (handler_input.response_builder
+                    .speak(page)
+                    .ask(to_safe_ssml(reprompt))
+                    .response)
+
+        # Notion の本文を読みかけなら、LLM は使わずに保存済みの読み位置から次の節を読む
+        if s.get("notion_resume"):
+            return _read_notion_more(handler_input, s)
+
+        # ストリーミングで途中まで話した回答があれば、最初からではなく続きから生成する
+        pending = take_resume_prompt(s) or (s.get("pending_prompt") or "").strip()
+        ans = ""
         if not pending:
             base = q_from_slot or _last_user_utterance(s)
             if not base:
@@ -232,23 +348,35 @@ class ContinuationIntentHandler(AbstractRequestHandler):
                         .speak(to_safe_ssml("今は続ける内容がないみたい。何を知りたい？"))
                         .ask(to_safe_ssml(GENERIC_REPROMPT))
                         .response)
-            pending = base + "。続きと詳細を短く。"
+            pending = continuation_prompt(base)
+            ans = take_pregenerated(handler_input, s, pending)
 
-        start = _now()
-        if _deadline_exceeded(start):
+        if ans:
+            _append_history(s, "user", pending)
+            _append_history(s, "assistant", ans)
+            s["pending_prompt"] = None
+            maybe_pregenerate(handler_input, s)
+            return (handler_input.response_builder
+                    .speak(speak_paged(s, ans))
+                    .ask(to_safe_ssml(GENERIC_REPROMPT))
+                    .response)
+
+        snippets = rag_top_snippets(handler_input, k=5, query=pending)
+        if _budget_low():
             s["pending_prompt"] = pending
             return (handler_input.response_builder
                     .speak(to_safe_ssml(ERROR_SPEECH))
                     .ask(to_safe_ssml("もう一度『続けて』と言ってね。"))
                     .response)
 
-        ans = one_shot_answer(s, pending, snippets=rag_top_snippets(handler_input, k=5))
+        ans = answer_with_resume(s, pending, snippets=snippets, intent="ContinuationIntent")
         if ans:
             _append_history(s, "user", pending)
             _append_history(s, "assistant", ans)
             s["pending_prompt"] = None
+            maybe_pregenerate(handler_input, s)
             return (handler_input.response_builder
-                    .speak(to_safe_ssml(ans))
+                    .speak(speak_paged(s, ans))
                     .ask(to_safe_ssml(GENERIC_REPROMPT))
                     .response)
 
@@ -295,11 +423,20 @@ class NotionCreatePageIntentHandler(AbstractRequestHandler):
             # コンテンツがない場合、タイトルのみのページを作成
             content = ""
 
+        # write-behind: outbox に積めたら、Notion の応答を待たずに答える
+        if title and outbox.enabled_for("page") and outbox.enqueue(handler_input, "page", title, content):
+            return (handler_input.response_builder
+                    .speak(to_safe_ssml(f"Notionに「{title}」を保存するね。"))
+                    .ask(to_safe_ssml("他に何かある？"))
+                    .response)
+
         # Notionページ作成
         result = notion_create_page(title=title, content=content)
 
         if result["success"]:
             speech = f"Notionに「{title}」を保存したよ！"
+        elif result.get("blocks_written"):
+            speech = f"Notionの「{title}」は途中まで保存したよ（{result['blocks_written']}／{result['blocks_total']}ブロック）。"
         else:
             speech = f"Notionへの保存に失敗したよ。エラー: {result['error']}"
 
@@ -329,11 +466,19 @@ class NotionAddToDatabaseIntentHandler(AbstractRequestHandler):
             # コンテンツがない場合、タイトルのみのエントリを作成
             content = ""
 
+        if title and outbox.enabled_for("database") and outbox.enqueue(handler_input, "database", title, content):
+            return (handler_input.response_builder
+                    .speak(to_safe_ssml(f"データベースに「{title}」を追加するね。"))
+                    .ask(to_safe_ssml("他に何かある？"))
+                    .response)
+
         # Notionデータベースにエントリ追加
         result = notion_add_to_database(title=title, content=content)
 
         if result["success"]:
             speech = f"データベースに「{title}」を追加したよ！"
+        elif result.get("blocks_written"):
+            speech = f"データベースの「{title}」は途中まで書けたよ（{result['blocks_written']}／{result['blocks_total']}ブロック）。"
         else:
             speech = f"データベースへの追加に失敗したよ。エラー: {result['error']}"
 
@@ -392,22 +537,90 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
                 .response)
 
 # -------- ルーティング --------
+class OutboxRequestInterceptor(AbstractRequestInterceptor):
+    """write-behind の保存が残っているセッション（と新しいセッション）で outbox を見て、再実行と失敗の報告を準備する。"""
+    def process(self, handler_input):
+        if not NOTION_WRITE_BEHIND:
+            return
+        session = getattr(handler_input.request_envelope, "session", None)
+        if not (_get_session(handler_input).get("outbox") or getattr(session, "new", False)):
+            return
+        failed = outbox.check(handler_input)
+        if failed:
+            handler_input.attributes_manager.request_attributes["outbox_failed"] = failed
+
+class SpeechPagesRequestInterceptor(AbstractRequestInterceptor):
+    """「続けて」以外の発話が来たら、前の回答の話しきれなかったページは捨てる。"""
+    def process(self, handler_input):
+        intent = getattr(handler_input.request_envelope.request, "intent", None)
+        if getattr(intent, "name", None) != "ContinuationIntent":
+            s = _get_session(handler_input)
+            s.pop("ssml_rest", None)
+            s.pop("ssml_tail", None)
+
+class OutboxResponseInterceptor(AbstractResponseInterceptor):
+    """失敗した保存があれば、応答の頭で伝える（伝えられたものだけ outbox から消す）。"""
+    def process(self, handler_input, response):
+        failed = handler_input.attributes_manager.request_attributes.get("outbox_failed")
+        speech = getattr(response, "output_speech", None) if response else None
+        ssml = getattr(speech, "ssml", None) or ""
+        if not failed or not ssml.startswith("<speak>"):
+            return
+        notice = to_safe_ssml(outbox.failure_notice(failed))[len("<speak>"):-len("</speak>")]
+        speech.ssml = "<speak>" + notice + "<break time=\"200ms\"/>" + ssml[len("<speak>"):]
+        outbox.acknowledge(handler_input, failed)
+
 sb = SkillBuilder()
-sb.add_request_handler(LaunchRequestHandler())
-sb.add_request_handler(NotionSearchIntentHandler())
-sb.add_request_handler(NotionReadIntentHandler())
-sb.add_request_handler(NotionCreatePageIntentHandler())
-sb.add_request_handler(NotionAddToDatabaseIntentHandler())
-sb.add_request_handler(RefineIntentHandler())
-sb.add_request_handler(GenericQueryIntentsHandler())
-sb.add_request_handler(ContinuationIntentHandler())
-sb.add_request_handler(TestIntentHandler())
-sb.add_request_handler(HelpHandler())
-sb.add_request_handler(StopCancelHandler())
-sb.add_request_handler(NavigateHomeHandler())
-sb.add_request_handler(FallbackHandler())
-sb.add_request_handler(SessionEndedRequestHandler())
-sb.add_request_handler(AnyRequestTypeHandler())
+sb.add_global_request_interceptor(OutboxRequestInterceptor())
+sb.add_global_request_interceptor(SpeechPagesRequestInterceptor())
+sb.add_global_response_interceptor(OutboxResponseInterceptor())
+sb.add_request_handler(traced_handler(LaunchRequestHandler()))
+sb.add_request_handler(traced_handler(NotionSearchIntentHandler()))
+sb.add_request_handler(traced_handler(NotionReadIntentHandler()))
+sb.add_request_handler(traced_handler(NotionCreatePageIntentHandler()))
+sb.add_request_handler(traced_handler(NotionAddToDatabaseIntentHandler()))
+sb.add_request_handler(traced_handler(RefineIntentHandler()))
+sb.add_request_handler(traced_handler(GenericQueryIntentsHandler()))
+sb.add_request_handler(traced_handler(ContinuationIntentHandler()))
+sb.add_request_handler(traced_handler(TestIntentHandler()))
+sb.add_request_handler(traced_handler(HelpHandler()))
+sb.add_request_handler(traced_handler(StopCancelHandler()))
+sb.add_request_handler(traced_handler(NavigateHomeHandler()))
+sb.add_request_handler(traced_handler(FallbackHandler()))
+sb.add_request_handler(traced_handler(SessionEndedRequestHandler()))
+sb.add_request_handler(traced_handler(AnyRequestTypeHandler()))
 sb.add_exception_handler(CatchAllExceptionHandler())
 
-lambda_handler = sb.lambda_handler()
+_skill_lambda_handler = sb.lambda_handler()
+
+def _request_label(event) -> str:
+    req = (event or {}).get("request", {}) or {}
+    return (req.get("intent", {}) or {}).get("name") or req.get("type") or "Unknown"
+
+def _request_budget(context) -> float:
+    """HARD_DEADLINE_SEC と Lambda 自体の残り時間の小さい方を、このリクエストの予算にする。"""
+    budget = HARD_DEADLINE_SEC
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if callable(get_remaining):
+        budget = min(budget, get_remaining() / 1000.0)
+    return budget
+
+import_profile.report("init")
+
+def lambda_handler(event, context):
+    warn_if_missing()  # import 時ではなく最初の呼び出しで一度だけ
+    label = _request_label(event)
+    try:
+        # ハンドラーと上流呼び出しの所要時間を集め、最後に EMF で1行出す（TRACING=0 で無効）
+        with request_trace(label):
+            # 受信時点から予算を数え、S3 / Notion / OpenAI の各呼び出しに残り時間を渡す
+            with request_deadline(_request_budget(context)):
+                # 1リクエスト中の S3 読み書きをまとめ、応答を返す前に一括で書き出す
+                with s3_unit_of_work(label):
+                    response = _skill_lambda_handler(event, context)
+            record_payload(event, response)
+            return response
+    finally:
+        # 最初の応答までに遅延 import した分を出して計測を終える
+        import_profile.report("first-request")
+        import_profile.stop()
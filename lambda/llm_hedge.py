@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+llm_hedge.py
+- OpenAI の遅いテール対策のヘッジ（OPENAI_HEDGE=1 のとき convo_core が使う）
+  - 1本目をストリーミングで送り、直近の「最初の出力までの時間」の OPENAI_HEDGE_PERCENTILE パーセンタイル
+    （llm_latency。サンプルが OPENAI_HEDGE_MIN_SAMPLES 未満なら OPENAI_HEDGE_DELAY_SEC）を過ぎても
+    何も届かなければ、2本目を OPENAI_HEDGE_MODEL（空なら同じモデル）に送る
+  - 1本目がヘッジ前に失敗したときは、すぐに2本目を送る（フォールバック）
+  - 先に最初の出力が届いた方を採り、もう一方は閉じる（応答待ちなら応答が来た時点で閉じる）
+- 戻り値は call_openai_chat_stream と同じ (text, complete)
+- 計測: HEDGE_STATS と [hedge] 行、span（openai.hedge）に hedged / hedge_win / extra_tokens
+  （EMF では OpenAIHedges / OpenAIHedgeWins / OpenAIHedgeExtraTokens）
+  - extra_tokens は採らなかった方（失敗したものを除く）の分。閉じた呼び出しは usage が来ないので、入力は送ったメッセージを数え、
+    出力は閉じるまでに届いた分を数える
+"""
+import time
+import queue
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from config import (
+    HTTP_TIMEOUT_SEC, MIN_LLM_BUDGET_SEC,
+    OPENAI_HEDGE_MODEL, OPENAI_HEDGE_PERCENTILE, OPENAI_HEDGE_MIN_SAMPLES, OPENAI_HEDGE_DELAY_SEC
+)
+from deadline import budget_timeout
+from tracing import span
+from utils import pump_chat_stream, close_stream, _record_usage, _MAX_TOKENS
+from prompt_budget import count_tokens, messages_tokens
+import llm_latency
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+LOGGER = logging.getLogger(__name__)
+
+HEDGE_STATS = {"calls": 0, "fired": 0, "fallbacks": 0, "hedge_wins": 0, "primary_wins": 0,
+               "extra_prompt_tokens": 0, "extra_completion_tokens": 0}
+_STATS_LOCK = threading.Lock()
+
+def _bump(**values: int) -> None:
+    with _STATS_LOCK:
+        for k, v in values.items():
+            HEDGE_STATS[k] += v
+
+def hedge_delay(model: str) -> float:
+    """1本目に何も届かないまま、この秒数が過ぎたら2本目を送る。"""
+    d = llm_latency.percentile(model, "first", OPENAI_HEDGE_PERCENTILE, min_samples=OPENAI_HEDGE_MIN_SAMPLES)
+    return OPENAI_HEDGE_DELAY_SEC if d is None else d
+
+def call_openai_chat_hedged(
+    client: "OpenAI",
+    model: str,
+    messages: List[Dict[str, str]],
+    *,
+    timeout_sec: Optional[float] = None,
+    max_tokens: int = _MAX_TOKENS,
+    hedge_model: Optional[str] = None,
+) -> Tuple[str, bool]:
+    """ヘッジ付きのストリーミング呼び出し。timeout_sec（残り予算で切り詰め）で打ち切る。"""
+    t = budget_timeout(float(timeout_sec or HTTP_TIMEOUT_SEC))
+    start = time.monotonic()
+    stop_at = start + t
+    hedge_model = hedge_model or OPENAI_HEDGE_MODEL or model
+    delay = hedge_delay(model)
+    events: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue()
+    legs: List[Dict[str, Any]] = []
+
+    def fire(leg_model: str) -> None:
+        i = len(legs)
+        leg = {"model": leg_model, "holder": {}, "started": time.monotonic(), "parts": [], "usage": None}
+        legs.append(leg)
+        threading.Thread(target=pump_chat_stream, daemon=True,
+                         args=(client, leg_model, messages, max_tokens, max(0.0, stop_at - leg["started"]),
+                               lambda kind, val: events.put((i, kind, val)), leg["holder"])).start()
+
+    winner: Optional[int] = None
+    complete = False
+    alive = set()
+    _bump(calls=1)
+    with span("openai.hedge", model=model) as rec:
+        rec["bytes_out"] = sum(len(m.get("content") or "") for m in messages)
+        fire(model)
+        alive.add(0)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            can_hedge = winner is None and len(legs) == 1 and stop_at - now >= MIN_LLM_BUDGET_SEC
+            wait = stop_at - now
+            if can_hedge:
+                wait = max(0.0, min(wait, start + delay - now))
+            try:
+                i, kind, val = events.get(timeout=wait)
+            except queue.Empty:
+                if can_hedge and time.monotonic() >= start + delay:
+                    fire(hedge_model)
+                    alive.add(1)
+                    _bump(fired=1)
+                continue
+            leg = legs[i]
+            if kind == "delta":
+                if winner is None:
+                    winner = i
+                    llm_latency.record(leg["model"], "first", time.monotonic() - leg["started"])
+                    for j, other in enumerate(legs):
+                        if j != i:
+                            other["holder"]["cancelled"] = True
+                            close_stream(other["holder"])
+                            if j == 0:
+                                # 1本目は「少なくともこれだけかかった」として残す（次のヘッジの待ち時間に効く）
+                                llm_latency.record(other["model"], "first", time.monotonic() - other["started"])
+                leg["parts"].append(val)
+            elif kind == "usage":
+                leg["usage"] = val
+            elif kind == "finish" and i == winner:
+                complete = (val == "stop")  # "length" は途中切れとして扱う
+                if complete:
+                    llm_latency.record(leg["model"], "total", time.monotonic() - leg["started"])
+            elif kind in ("end", "error"):
+                alive.discard(i)
+                leg["failed"] = kind == "error"
+                if kind == "error" and i == winner:
+                    rec["outcome"] = f"error:{type(val).__name__}"
+                if i == winner:
+                    break
+                if winner is None and not alive:
+                    if len(legs) == 1 and stop_at - time.monotonic() >= MIN_LLM_BUDGET_SEC:
+                        fire(hedge_model)  # ヘッジ前に1本目が失敗した
+                        alive.add(1)
+                        _bump(fired=1, fallbacks=1)
+                        continue
+                    if kind == "error":
+                        rec["outcome"] = f"error:{type(val).__name__}"
+                    break
+        for j, leg in enumerate(legs):
+            if j != winner:
+                leg["holder"]["cancelled"] = True
+                close_stream(leg["holder"])
+        if winner is not None and not complete:
+            legs[winner]["holder"]["cancelled"] = True
+            close_stream(legs[winner]["holder"])
+
+        # 採らなかった方（どちらも届かなければ2本目）のトークンを追加コストとして数える
+        base = winner if winner is not None else 0
+        extra_in = extra_out = 0
+        for j, leg in enumerate(legs):
+            if j == base or leg.get("failed"):
+                continue  # 失敗した呼び出しは生成していない
+            usage = leg["usage"]
+            extra_in += int(getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else messages_tokens(messages)
+            extra_out += (int(getattr(usage, "completion_tokens", 0) or 0) if usage is not None
+                          else count_tokens("".join(leg["parts"])))
+        parts = legs[winner]["parts"] if winner is not None else []
+        if winner is not None:
+            _record_usage(rec, legs[winner]["usage"])
+            rec["winner_model"] = legs[winner]["model"]
+        rec["bytes_in"] = sum(len(p) for p in parts)
+        if len(legs) > 1:
+            rec["hedged"] = 1
+            rec["hedge_win"] = int(winner == 1)
+            rec["extra_tokens"] = extra_in + extra_out
+            _bump(hedge_wins=int(winner == 1), primary_wins=int(winner == 0),
+                  extra_prompt_tokens=extra_in, extra_completion_tokens=extra_out)
+        rec.setdefault("outcome", "ok" if complete else "partial" if parts else "empty")
+    if len(legs) > 1:
+        LOGGER.info(f"[hedge] delay={delay:.2f}s winner={legs[winner]['model'] if winner is not None else '-'}"
+                    f"{'(hedge)' if winner == 1 else ''} extra_tokens={extra_in + extra_out} stats={HEDGE_STATS}")
+    return "".join(parts).strip(), complete
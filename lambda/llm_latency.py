@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+llm_latency.py
+- モデルごとの直近のレイテンシ（コンテナ内・直近 LLM_LATENCY_WINDOW 件）
+  - "first": 送ってから最初の出力が届くまで（ストリーミングの最初の差分だけ。一括の呼び出しは記録しない）
+  - "total": 送ってから回答を受け取り終わるまで
+- utils の OpenAI 呼び出しが成功のたびに記録し、ヘッジ（llm_hedge）の待ち時間などがパーセンタイルを読む
+- 期限で打ち切った呼び出しの "total" は記録しない（値は残り予算で決まり、モデルの速さを表さないので、
+  混ぜると p95 が予算いっぱいに張り付く）
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from config import LLM_LATENCY_WINDOW
+
+_WINDOWS: Dict[Tuple[str, str], Deque[float]] = {}
+_LOCK = threading.Lock()
+
+def record(model: str, kind: str, sec: float) -> None:
+    with _LOCK:
+        win = _WINDOWS.get((model, kind))
+        if win is None:
+            win = _WINDOWS[(model, kind)] = deque(maxlen=max(1, LLM_LATENCY_WINDOW))
+        win.append(float(sec))
+
+def count(model: str, kind: str) -> int:
+    with _LOCK:
+        return len(_WINDOWS.get((model, kind)) or ())
+
+def percentile(model: str, kind: str, p: float, *, min_samples: int = 1,
+               last: Optional[int] = None) -> Optional[float]:
+    """直近の p パーセンタイル（秒）。last を渡すと最新の last 件だけで見る。サンプルが min_samples 未満なら None。"""
+    with _LOCK:
+        xs = list(_WINDOWS.get((model, kind)) or ())
+    xs = sorted(xs[-last:] if last else xs)
+    if not xs or len(xs) < min_samples:
+        return None
+    return xs[min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1))))]
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """ログ用: モデル・種類ごとの件数と p50/p95。"""
+    with _LOCK:
+        keys = list(_WINDOWS)
+    out = {}
+    for model, kind in keys:
+        out[f"{model}/{kind}"] = {"n": count(model, kind),
+                                  "p50": round(percentile(model, kind, 50) or 0.0, 3),
+                                  "p95": round(percentile(model, kind, 95) or 0.0, 3)}
+    return out
+
+def reset() -> None:
+    """記録を捨てる（テスト・ベンチマーク用）。"""
+    with _LOCK:
+        _WINDOWS.clear()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+model_router.py
+- インテントごとに LLM のモデル・max_tokens・タイムアウトを決める
+  - 既定の表: 選択・移動のような短い応答は速いモデル（OPENAI_FAST_MODEL）で短く、
+    分析・哲学・詳しく のような長い応答は OPENAI_MODEL で長めに、それ以外は OPENAI_MODEL の標準
+  - MODEL_ROUTES（JSON）でインテント単位に上書きできる
+    例: {"AnalysisIntent": {"model": "gpt-5-chat-latest", "max_tokens": 240, "timeout": 4.0}}
+  - timeout が無い経路は呼び出し側の既定（一括は HTTP_TIMEOUT_SEC、ストリーミングは残り予算いっぱい）
+- 適応（MODEL_ROUTING_ADAPTIVE=1。既定は off）: 選んだモデルの直近 MODEL_ROUTING_WINDOW 件の p95 を見て、
+  速いモデルに落とす。一括の呼び出しは llm_latency の "total"、ストリーミングは "first"（最初の出力までの時間。
+  届いた分から話せるので、終わるまでの時間は予算で打ち切られるだけで遅さの目安にならない）
+  - OPENAI_FAST_MODEL が空（既定）なら落とし先が無いので、適応は何もしない
+  - p95: 経路の目安（timeout、無ければ MODEL_ROUTING_TARGET_SEC）を超えている
+  - budget: リクエストの残り予算（と呼び出し側の既定のタイムアウト）を超えている
+  - サンプルが MODEL_ROUTING_MIN_SAMPLES 未満のモデルは落とさない。速いモデルの方が遅いときも落とさない
+  - 落としている間も MODEL_ROUTING_PROBE_EVERY 回に1回は元のモデルに送り（目安ぶんの予算が残っているときだけ）、
+    直近の記録を新しくする（回復したら元に戻る）
+- 決めるたびに [route] 行を出し、ROUTE_STATS に「モデル:理由」ごとの回数を数える
+"""
+import json
+import logging
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from config import (
+    OPENAI_MODEL, OPENAI_FAST_MODEL, MODEL_ROUTES, MODEL_ROUTING_ADAPTIVE, MODEL_ROUTING_MIN_SAMPLES,
+    MODEL_ROUTING_TARGET_SEC, MODEL_ROUTING_PROBE_EVERY, MODEL_ROUTING_WINDOW
+)
+from deadline import current_deadline
+import llm_latency
+
+LOGGER = logging.getLogger(__name__)
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: int = 120
+    timeout: Optional[float] = None  # None なら呼び出し側の既定
+
+DEFAULT_ROUTE = Route(OPENAI_MODEL, 120)
+_QUICK = Route(OPENAI_FAST_MODEL or OPENAI_MODEL, 80, 2.0)
+_DEEP = Route(OPENAI_MODEL, 200)
+DEFAULT_TABLE: Dict[str, Route] = {
+    "SelectionIntent": _QUICK,
+    "NavigationIntent": _QUICK,
+    "AnalysisIntent": _DEEP,
+    "PhilosophicalIntent": _DEEP,
+    "DetailRequestIntent": _DEEP,
+}
+
+ROUTE_STATS: Dict[str, int] = {}
+_STATS_LOCK = threading.Lock()
+_DOWNGRADES: Dict[str, int] = {}  # モデルごとの「続けて落とした回数」（プローブの間隔に使う）
+
+def _load_table() -> Dict[str, Route]:
+    table = dict(DEFAULT_TABLE)
+    if not MODEL_ROUTES:
+        return table
+    try:
+        for intent, r in json.loads(MODEL_ROUTES).items():
+            base = table.get(intent, DEFAULT_ROUTE)
+            table[intent] = Route(r.get("model") or base.model, int(r.get("max_tokens") or base.max_tokens),
+                                  float(r["timeout"]) if r.get("timeout") else base.timeout)
+    except Exception as e:
+        LOGGER.warning(f"[route] MODEL_ROUTES ignored ex={type(e).__name__}")
+    return table
+
+_TABLE: Dict[str, Route] = _load_table()
+
+def set_table(table: Dict[str, Route]) -> Dict[str, Route]:
+    """経路表を差し替える（テスト・ベンチマーク用）。前の表を返す。"""
+    global _TABLE
+    prev, _TABLE = _TABLE, dict(table)
+    return prev
+
+def _count(key: str) -> None:
+    with _STATS_LOCK:
+        ROUTE_STATS[key] = ROUTE_STATS.get(key, 0) + 1
+
+def _should_probe(model: str) -> bool:
+    """落とし続けているモデルに、MODEL_ROUTING_PROBE_EVERY 回に1回は送る。"""
+    with _STATS_LOCK:
+        n = _DOWNGRADES[model] = _DOWNGRADES.get(model, 0) + 1
+        if MODEL_ROUTING_PROBE_EVERY > 0 and n >= MODEL_ROUTING_PROBE_EVERY:
+            _DOWNGRADES[model] = 0
+            return True
+    return False
+
+def choose_route(intent: Optional[str], *, default_timeout: float, streaming: bool = False) -> Route:
+    """intent の経路を返す（適応が有効なら、遅いモデルは速いモデルに落とす。streaming=True なら最初の出力までで見る）。"""
+    route = _TABLE.get(intent or "", DEFAULT_ROUTE)
+    dl = current_deadline()
+    available = route.timeout or default_timeout
+    if dl is not None:
+        available = min(available, dl.remaining())
+    reason = "table"
+    p95 = None
+    fast = OPENAI_FAST_MODEL
+    if MODEL_ROUTING_ADAPTIVE and fast and route.model != fast:
+        kind = "first" if streaming else "total"
+        p95 = llm_latency.percentile(route.model, kind, 95, min_samples=MODEL_ROUTING_MIN_SAMPLES,
+                                     last=MODEL_ROUTING_WINDOW)
+        fast_p95 = llm_latency.percentile(fast, kind, 95, min_samples=MODEL_ROUTING_MIN_SAMPLES,
+                                          last=MODEL_ROUTING_WINDOW)
+        target = route.timeout or MODEL_ROUTING_TARGET_SEC
+        if p95 is not None and (p95 > target or p95 > available) and (fast_p95 is None or fast_p95 < p95):
+            if available >= target and _should_probe(route.model):
+                reason = "probe"  # 目安ぶんの予算はあるので、元のモデルの今の速さを測り直す
+            else:
+                reason = "p95" if p95 > target else "budget"
+                route = route._replace(model=fast)
+        else:
+            with _STATS_LOCK:
+                _DOWNGRADES.pop(route.model, None)
+    _count(f"{route.model}:{reason}")
+    LOGGER.info(f"[route] intent={intent or '-'} model={route.model} reason={reason} max_tokens={route.max_tokens} "
+                f"timeout={route.timeout or default_timeout:.1f} available={available:.2f}"
+                f"{f' p95={p95:.2f}' if p95 is not None else ''}")
+    return route
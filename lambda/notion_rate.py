@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+notion_rate.py
+- Notion API のレート制限（1インテグレーションあたり約 3 リクエスト/秒）に合わせて送る量を絞る
+  - コンテナ内で共有するトークンバケット（NOTION_RATE_RPS / NOTION_RATE_BURST）。NotionClient.request が
+    送る前に1トークン取る。NOTION_RATE_RPS=0 なら絞らない
+  - 待ち行列は優先度順: interactive（ユーザーが待っている読み込み・保存）> prefetch（検索直後の本文先読み）
+    > background（outbox の書き込み）。同じ優先度は来た順
+  - 待てるのはリクエストの残り予算まで（background は _BACKGROUND_MAX_WAIT_SEC まで）。
+    間に合わないと分かった時点で NotionThrottled を上げる（呼び出し側は他の失敗と同じく握りつぶす）
+- 429 が返ったら Retry-After（秒数・HTTP 日付）の間、コンテナ内の全員を止める
+- NOTION_RATE_SHARED=1 のときは S3 の軽いリース（{S3_PREFIX}/pico_notion_rate/{コンテナ}.json）で
+  コンテナ間を調整する
+  - 各コンテナは NOTION_RATE_LEASE_SEC の 1/3 ごとにリースを書き直し、LIST の LastModified が
+    NOTION_RATE_LEASE_SEC 以内のリースの数で全体のレートを割った分だけ使う（中身は読まない。1回の更新は PUT + LIST）
+  - 受けた 429 の Retry-After は block-{解除時刻ミリ秒}-{コンテナ}.json というキーで知らせ、
+    他のコンテナもキー名だけ見て同じ時刻まで止まる
+  - 期限の切れたリースと解除済みの block は、見つけたコンテナが消す（凍結したまま戻らないコンテナの分も残らない）
+  - 更新は裏のスレッドで行う（リクエストの予算・Unit of Work・計測を引き継がない空のコンテキスト）
+- 計測: RATE_STATS と [notion-rate] 行、span に rate_wait_ms / throttled / rate_timeouts
+  （EMF では NotionRateWaitMs / NotionThrottles / NotionRateTimeouts）
+- recently_throttled() で「見つからなかった」と「混んでいて取れなかった」を言い分ける
+"""
+import time
+import uuid
+import heapq
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Callable, List, Optional, Tuple
+
+from config import (
+    S3_PREFIX, MIN_CALL_TIMEOUT_SEC,
+    NOTION_RATE_RPS, NOTION_RATE_BURST, NOTION_RATE_MAX_WAIT_SEC, NOTION_RATE_SHARED, NOTION_RATE_LEASE_SEC
+)
+from deadline import budget_timeout
+from tracing import annotate
+
+LOGGER = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BACKGROUND = 2
+
+_BACKGROUND_MAX_WAIT_SEC = 20.0  # 応答後も続く書き込みは、予算が無いぶん長めに待つ
+_DEFAULT_RETRY_AFTER_SEC = 1.0   # 429 に Retry-After が無いとき
+_THROTTLED_WINDOW_SEC = 10.0     # recently_throttled() が見る範囲
+
+RATE_STATS = {"acquired": 0, "waited": 0, "wait_ms": 0.0, "timeouts": 0, "throttled": 0,
+              "containers": 1, "shared_blocks": 0}
+
+class NotionThrottled(Exception):
+    """レート制限の順番が予算内に回ってこなかった（Notion には送っていない）。"""
+
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar("pico_notion_priority", default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def notion_priority(level: int):
+    """このブロックの中の Notion 呼び出しを level の優先度で並ばせる。"""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+class TokenBucket:
+    """
+    rate トークン/秒で貯まり、burst まで持てるバケット。取れるまで優先度順に待たせる。
+    block_until(t) の間は貯まっていても渡さない（429 の Retry-After 用）。
+    """
+    def __init__(self, rate: float, burst: float, *, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []  # (優先度, 到着順) のヒープ
+        self._seq = itertools.count()
+
+    def _refill(self, now: float) -> None:
+        since = max(self.updated, self.blocked_until)  # 止めている間は貯めない
+        if now > since:
+            self.tokens = min(self.burst, self.tokens + (now - since) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def set_rate(self, rate: float, burst: float) -> None:
+        with self._cond:
+            self._refill(self.clock())
+            self.rate, self.burst = float(rate), max(1.0, float(burst))
+            self.tokens = min(self.tokens, self.burst)
+            self._cond.notify_all()
+
+    def block_until(self, until: float) -> None:
+        with self._cond:
+            if until > self.blocked_until:
+                self.blocked_until = until
+                self.tokens = 0.0  # 解除直後にまとめて送らない
+            self._cond.notify_all()
+
+    def acquire(self, priority: int, max_wait: float) -> float:
+        """1トークン取る。待った秒数を返す。max_wait 秒以内に取れない（と分かった）ら NotionThrottled。"""
+        start = self.clock()
+        end = start + max(0.0, max_wait)
+        me = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, me)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    head = self._waiters[0] == me
+                    if head and now >= self.blocked_until and self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return now - start
+                    if now >= end or self.blocked_until > end:
+                        raise NotionThrottled(f"waited {now - start:.2f}s")
+                    if head:
+                        ready = max(now, self.blocked_until) + (1.0 - self.tokens) / self.rate if self.rate > 0 else end
+                        self._cond.wait(max(0.001, min(ready, end) - now))
+                    else:
+                        self._cond.wait(end - now)  # 前の人が取る・諦めるたびに起こされる
+            finally:
+                self._waiters.remove(me)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+# ==== コンテナで共有するバケット ====
+_BUCKET: Optional[TokenBucket] = None
+_BUCKET_READY = False
+_BUCKET_LOCK = threading.Lock()
+_LAST_THROTTLED = 0.0
+
+def get_bucket() -> Optional[TokenBucket]:
+    """共有のバケット（NOTION_RATE_RPS=0 なら None = 絞らない）。最初の1回だけ作る。"""
+    global _BUCKET, _BUCKET_READY
+    if _BUCKET_READY:
+        return _BUCKET
+    with _BUCKET_LOCK:
+        if not _BUCKET_READY:
+            _BUCKET = TokenBucket(NOTION_RATE_RPS, NOTION_RATE_BURST) if NOTION_RATE_RPS > 0 else None
+            _BUCKET_READY = True
+    return _BUCKET
+
+def set_bucket(bucket: Optional[TokenBucket]) -> Optional[TokenBucket]:
+    """バケットを差し替える（None で絞らない。テスト・ベンチマーク用）。前のバケットを返す。"""
+    global _BUCKET, _BUCKET_READY
+    with _BUCKET_LOCK:
+        prev, _BUCKET, _BUCKET_READY = _BUCKET, bucket, True
+    return prev
+
+def _mark_throttled() -> None:
+    global _LAST_THROTTLED
+    _LAST_THROTTLED = time.monotonic()
+
+def recently_throttled(window_sec: float = _THROTTLED_WINDOW_SEC) -> bool:
+    """このコンテナが直近 window_sec 秒に 429 を受けたか、順番待ちで諦めたか。"""
+    return _LAST_THROTTLED > 0 and time.monotonic() - _LAST_THROTTLED < window_sec
+
+def acquire(endpoint: str) -> float:
+    """Notion に1回送る前に呼ぶ。待った秒数を返す（順番が来なければ NotionThrottled）。"""
+    bucket = get_bucket()
+    if bucket is None:
+        return 0.0
+    _maybe_refresh_share()
+    priority = _PRIORITY.get()
+    cap = _BACKGROUND_MAX_WAIT_SEC if priority >= PRIORITY_BACKGROUND else NOTION_RATE_MAX_WAIT_SEC
+    # 取れたあとに呼び出し自体の時間が残るように、最短のタイムアウト分は空けておく
+    max_wait = max(0.0, budget_timeout(cap, floor=0.0) - MIN_CALL_TIMEOUT_SEC)
+    try:
+        waited = bucket.acquire(priority, max_wait)
+    except NotionThrottled:
+        RATE_STATS["timeouts"] += 1
+        _mark_throttled()
+        annotate(rate_timeouts=1)
+        LOGGER.info(f"[notion-rate] gave up endpoint={endpoint} priority={priority} "
+                    f"max_wait={max_wait:.2f}s stats={RATE_STATS}")
+        raise
+    RATE_STATS["acquired"] += 1
+    if waited > 0.001:
+        RATE_STATS["waited"] += 1
+        RATE_STATS["wait_ms"] += round(waited * 1000, 1)
+        annotate(rate_wait_ms=round(waited * 1000, 1))
+    return waited
+
+def retry_after_sec(resp, default: float = _DEFAULT_RETRY_AFTER_SEC) -> float:
+    """Retry-After（秒数 or HTTP 日付）を秒数にする。読めなければ default。"""
+    value = (resp.headers.get("Retry-After") or "").strip() if resp is not None else ""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+def record_response(resp) -> Optional[float]:
+    """応答を見て、429 ならコンテナ全体を Retry-After の間止める。止めた秒数（429 以外は None）を返す。"""
+    if resp is None or resp.status_code != 429:
+        return None
+    delay = retry_after_sec(resp)
+    bucket = get_bucket()
+    if bucket is not None:
+        bucket.block_until(bucket.clock() + delay)
+    RATE_STATS["throttled"] += 1
+    _mark_throttled()
+    annotate(throttled=1)
+    _share_block(time.time() + delay)
+    LOGGER.info(f"[notion-rate] 429 retry_after={delay:.1f}s stats={RATE_STATS}")
+    return delay
+
+# ==== コンテナ間の調整（S3 のリース） ====
+_CONTAINER_ID = uuid.uuid4().hex[:12]
+_LEASE_DIR = f"{S3_PREFIX}/pico_notion_rate"
+_SHARE_LOCK = threading.Lock()
+_NEXT_REFRESH = 0.0
+_SHARED_BLOCKED_UNTIL = 0.0  # このコンテナが受けた 429 の解除時刻（エポック秒。block のキーで知らせる）
+_PUBLISHED_BLOCK = 0.0       # block のキーで知らせ済みの解除時刻
+_BLOCK_PREFIX = "block-"
+_MAX_DELETES_PER_REFRESH = 50  # 溜まった古いリースは何回かの更新に分けて消す
+
+def _maybe_refresh_share() -> None:
+    global _NEXT_REFRESH
+    if not NOTION_RATE_SHARED:
+        return
+    now = time.monotonic()
+    if now < _NEXT_REFRESH:
+        return
+    with _SHARE_LOCK:
+        if now < _NEXT_REFRESH:
+            return
+        _NEXT_REFRESH = now + NOTION_RATE_LEASE_SEC / 3.0  # 期限切れ前に2回は書き直す
+    threading.Thread(target=contextvars.Context().run, args=(_refresh_share,),
+                     name="pico-notion-rate", daemon=True).start()
+
+def _share_block(until: float) -> None:
+    global _SHARED_BLOCKED_UNTIL, _NEXT_REFRESH
+    if not NOTION_RATE_SHARED:
+        return
+    with _SHARE_LOCK:
+        _SHARED_BLOCKED_UNTIL = max(_SHARED_BLOCKED_UNTIL, until)
+        _NEXT_REFRESH = 0.0  # 次の呼び出しで他のコンテナにも知らせる
+
+def _block_until_of(name: str) -> float:
+    """block-{ミリ秒}-{コンテナ}.json の解除時刻（エポック秒）。読めなければ 0。"""
+    try:
+        return int(name[len(_BLOCK_PREFIX):].split("-", 1)[0]) / 1000.0
+    except ValueError:
+        return 0.0
+
+def _refresh_share() -> None:
+    """
+    自分のリースを書き直し、LIST の LastModified で生きているリースを数えて自分の取り分を決める。
+    期限切れのリースと解除済みの block は消す。
+    """
+    global _PUBLISHED_BLOCK
+    from rag_store_s3 import s3_put_json, s3_list_objects, s3_delete_key
+    bucket = get_bucket()
+    if bucket is None:
+        return
+    now = time.time()
+    blocked_until = _SHARED_BLOCKED_UNTIL
+    try:
+        s3_put_json(f"{_LEASE_DIR}/{_CONTAINER_ID}.json", {"expires": now + NOTION_RATE_LEASE_SEC})
+        if blocked_until > max(now, _PUBLISHED_BLOCK):
+            s3_put_json(f"{_LEASE_DIR}/{_BLOCK_PREFIX}{int(blocked_until * 1000):013d}-{_CONTAINER_ID}.json", {})
+            _PUBLISHED_BLOCK = blocked_until
+        objects = s3_list_objects(f"{_LEASE_DIR}/", strict=True)
+    except Exception as e:
+        LOGGER.info(f"[notion-rate] lease refresh failed ex={type(e).__name__}")
+        return
+    n, blocked, stale = 0, 0.0, []
+    for key, modified in objects:
+        name = key.rsplit("/", 1)[-1]
+        if name.startswith(_BLOCK_PREFIX):
+            until = _block_until_of(name)
+            if until > now:
+                blocked = max(blocked, until)
+            else:
+                stale.append(key)
+        elif now - modified <= NOTION_RATE_LEASE_SEC:
+            n += 1
+        else:
+            stale.append(key)
+    n = max(1, n)
+    RATE_STATS["containers"] = n
+    bucket.set_rate(NOTION_RATE_RPS / n, NOTION_RATE_BURST / n)
+    if blocked > now:
+        RATE_STATS["shared_blocks"] += 1
+        bucket.block_until(bucket.clock() + (blocked - now))
+    removed = sum(s3_delete_key(key) for key in stale[:_MAX_DELETES_PER_REFRESH])
+    LOGGER.info(f"[notion-rate] containers={n} rate={NOTION_RATE_RPS / n:.2f}/s "
+                f"removed={removed} backlog={len(stale) - removed}")
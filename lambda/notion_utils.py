@@ -1,19 +1,164 @@
 # -*- coding: utf-8 -*-
 import json
-import requests
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 from config import (
     NOTION_TOKEN, NOTION_VERSION, HTTP_TIMEOUT_SEC,
-    NOTION_SEARCH_LIMIT, NOTION_BLOCKS_PAGE_SZ, NOTION_SNIPPET_CHARS,
-    NOTION_DEFAULT_PARENT_ID, NOTION_DEFAULT_DATABASE_ID
+    NOTION_SEARCH_LIMIT, NOTION_BLOCKS_PAGE_SZ, NOTION_SNIPPET_CHARS, NOTION_BLOCK_MAX_DEPTH,
+    NOTION_DEFAULT_PARENT_ID, NOTION_DEFAULT_DATABASE_ID, MIN_CALL_TIMEOUT_SEC,
+    NOTION_WRITE_RETRIES, NOTION_WRITE_BACKOFF_SEC,
+    PAGE_CACHE_MEM_BYTES, PAGE_CACHE_TMP_BYTES, PAGE_CACHE_S3, PAGE_CACHE_S3_BYTES
 )
+from deadline import budget_timeout, budget_nearly_exhausted
+from cache_tiers import TieredCache, ByteLRU, TmpFileStore, S3Store
+from tracing import traced, annotate
+import notion_rate
+from notion_rate import notion_priority, PRIORITY_PREFETCH
+
+# requests はクライアント生成時に読み込む（Notion を使わない要求のコールドスタートに載せない）
+if TYPE_CHECKING:
+    import requests
+
+LOGGER = logging.getLogger(__name__)
+
+# ==== 共有 Notion クライアント（コネクションプール付き） ====
+NOTION_API_BASE = "https://api.notion.com/v1"
+
+# エンドポイント別の既定タイムアウト（秒）。呼び出し側が timeout を渡せばそちらが優先。
+# どちらもリクエストの残り予算（deadline）で切り詰められる。
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    "search":         HTTP_TIMEOUT_SEC,
+    "blocks.read":    HTTP_TIMEOUT_SEC,
+    "blocks.append":  HTTP_TIMEOUT_SEC,
+    "pages.create":   HTTP_TIMEOUT_SEC,
+}
 
-def _notion_headers():
-    return {
-        "Authorization": f"Bearer {NOTION_TOKEN}",
-        "Notion-Version": NOTION_VERSION,
-        "Content-Type": "application/json"
-    }
+# retry_policy(endpoint, attempt, resp, exc) -> 待ち秒数 or None（None ならリトライしない）
+RetryPolicy = Callable[[str, int, Optional["requests.Response"], Optional[Exception]], Optional[float]]
+
+# 読み込みは何度送っても同じなので、429 も再送してよい（書き込みの再送は _write_with_retry が決める）
+_READ_ENDPOINTS = {"search", "blocks.read"}
+
+def _failed_before_send(exc: Optional[Exception]) -> bool:
+    """接続を張る段階で失敗した（リクエストを1バイトも送っていない）なら True。"""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc is not None and exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+def default_retry_policy(endpoint: str, attempt: int, resp, exc) -> Optional[float]:
+    """
+    1回だけ即リトライする（429 の Retry-After はレート制限の待ち行列が守るので、ここでは待たない）。
+    - 読み込み: キープアライブ切れ等の接続エラーと 429
+    - 書き込み: 送る前に失敗した接続エラーだけ（送った後に切れた "Connection aborted" などは、
+      Notion 側で反映済みかもしれないので再送しない）
+    """
+    import requests
+    if attempt >= 1:
+        return None
+    if isinstance(exc, requests.ConnectionError):
+        return 0.0 if endpoint in _READ_ENDPOINTS or _failed_before_send(exc) else None
+    if resp is not None and resp.status_code == 429 and endpoint in _READ_ENDPOINTS:
+        return 0.0
+    return None
+
+class NotionClient:
+    """
+    Notion API 呼び出しを1つのセッションに集約するクライアント。
+    - ヘッダーは生成時に1回だけ組み立てる
+    - HTTPAdapter のプールでウォーム起動間も接続を使い回す
+    - リトライ方針は retry_policy で差し替え可能
+    - 送る前に notion_rate のトークンを取る（レート制限。429 を受けたら Retry-After の間止まる）
+    """
+    def __init__(self, token: str, version: str, *, pool_size: int = 4,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 base_url: str = NOTION_API_BASE):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.base_url = base_url.rstrip("/")
+        self.headers = {
+            "Authorization": f"Bearer {token}",
+            "Notion-Version": version,
+            "Content-Type": "application/json"
+        }
+        self.timeouts = dict(DEFAULT_ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        self.retry_policy = retry_policy or default_retry_policy
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def timeout_for(self, endpoint: str, timeout: Optional[float] = None) -> float:
+        cap = timeout if timeout is not None else self.timeouts.get(endpoint, HTTP_TIMEOUT_SEC)
+        return budget_timeout(cap)
+
+    def request(self, method: str, path: str, *, endpoint: str,
+                payload: Optional[Dict[str, Any]] = None,
+                params: Optional[Dict[str, Any]] = None,
+                timeout: Optional[float] = None) -> "requests.Response":
+        """
+        1回の API 呼び出し（retry_policy に従って再試行）。例外はそのまま上げる
+        （レート制限の順番が予算内に来なければ notion_rate.NotionThrottled）。
+        """
+        import requests
+        url = f"{self.base_url}{path}"
+        data = json.dumps(payload) if payload is not None else None
+        attempt = 0
+        while True:
+            t = self.timeout_for(endpoint, timeout)  # リトライ時は減った残り予算で切る
+            resp, exc = None, None
+            if notion_rate.acquire(endpoint):
+                t = self.timeout_for(endpoint, timeout)  # 順番を待った分だけ残り予算が減っている
+            try:
+                resp = self.session.request(method, url, data=data, params=params, timeout=t)
+                annotate(http_calls=1, http_status=resp.status_code,
+                         bytes_out=len(data or ""), bytes_in=len(resp.content or b""))
+                notion_rate.record_response(resp)
+            except requests.RequestException as e:
+                exc = e
+                annotate(http_calls=1, outcome=f"error:{type(e).__name__}")
+            delay = self.retry_policy(endpoint, attempt, resp, exc)
+            if delay is not None and budget_nearly_exhausted(delay + MIN_CALL_TIMEOUT_SEC):
+                delay = None  # 待ってから再送する予算が無い
+            if delay is None:
+                if exc is not None:
+                    raise exc
+                return resp
+            attempt += 1
+            if delay > 0:
+                time.sleep(delay)
+
+    def pool_stats(self) -> Dict[str, int]:
+        """urllib3 プールの接続数/リクエスト数（接続の使い回し確認用）。"""
+        conns = reqs = 0
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                conns += pool.num_connections
+                reqs  += pool.num_requests
+        return {"connections": conns, "requests": reqs}
+
+_CLIENT: Optional[NotionClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_notion_client() -> NotionClient:
+    """コンテナ内で共有する NotionClient（初回呼び出し時に生成）。"""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = NotionClient(NOTION_TOKEN, NOTION_VERSION)
+    return _CLIENT
 
 def _extract_title_from_page(page):
     props = page.get("properties", {}) or []
@@ -24,14 +169,14 @@ def _extract_title_from_page(page):
                 return "".join([seg.get("plain_text","") for seg in rich]).strip() or "無題"
     return "無題"
 
-def notion_search_pages(query: str, *, limit: int = None, timeout: float = None):
-    """検索は既定で .env の NOTION_SEARCH_LIMIT 件（通常3）。本文は取得しない。"""
+@traced("notion.search")
+def notion_search_pages(query: str, *, limit: int = None, timeout: float = None, strict: bool = False):
+    """
+    検索は既定で .env の NOTION_SEARCH_LIMIT 件（通常3）。本文は取得しない。
+    失敗は空のリストで返す（strict=True なら例外で上げる。「無かった」と「分からない」を分けたいとき）。
+    """
     if limit is None:
         limit = NOTION_SEARCH_LIMIT
-    if timeout is None:
-        timeout = HTTP_TIMEOUT_SEC
-
-    url = "https://api.notion.com/v1/search"
     payload = {
         "query": query or "",
         "page_size": limit,
@@ -39,8 +184,10 @@ def notion_search_pages(query: str, *, limit: int = None, timeout: float = None)
         "sort": {"direction": "descending", "timestamp": "last_edited_time"}
     }
     try:
-        resp = requests.post(url, headers=_notion_headers(), data=json.dumps(payload), timeout=timeout)
+        resp = get_notion_client().request("POST", "/search", endpoint="search", payload=payload, timeout=timeout)
         if resp.status_code != 200:
+            if strict:
+                resp.raise_for_status()
             return []
         results = resp.json().get("results", []) or []
         out = []
@@ -49,9 +196,12 @@ def notion_search_pages(query: str, *, limit: int = None, timeout: float = None)
                 continue
             title = _extract_title_from_page(it)
             page_url = it.get("url") or ""
-            out.append({"id": it.get("id"), "title": title, "url": page_url})
+            out.append({"id": it.get("id"), "title": title, "url": page_url,
+                        "edited": it.get("last_edited_time") or ""})
         return out
     except Exception:
+        if strict:
+            raise
         return []
 
 BLOCK_TYPES_WITH_TEXT = {
@@ -69,31 +219,310 @@ def _block_to_text(block):
         return _rich_text_to_plain(block.get(btype,{}).get("rich_text"))
     return ""
 
-def notion_page_first_text(page_id: str, *, max_chars: int = None, timeout: float = None) -> str:
+# ==== ブロックの遅延走査 ====
+# 読み位置（カーソル）は「次に読むブロック」を指すフレームの積み重ね（浅い順）:
+#   [{"id": 親ブロック(ページ)ID, "cursor": その子一覧のページの start_cursor, "skip": そのページで読み終えた件数}, ...]
+# 一番深いフレームから再開し、読み終えたら1つ浅いフレームの続きへ戻る。
+# Notion の start_cursor はブロック ID なので、ページが編集されない限り後から使っても同じ位置を指す。
+
+# 子を持っていても中を読まないブロック（別ページ・別データベース）
+_NO_DESCEND_TYPES = {"child_page", "child_database"}
+
+def _child_frame(block_id: str) -> Dict[str, Any]:
+    return {"id": block_id, "cursor": None, "skip": 0}
+
+def notion_first_block_text(page_id: str, *, timeout: Optional[float] = None) -> str:
+    """ページの最初のブロックのテキスト（無ければ空文字）。HTTP エラーは例外で上げる。"""
+    resp = get_notion_client().request("GET", f"/blocks/{page_id}/children", endpoint="blocks.read",
+                                       params={"page_size": 1}, timeout=timeout)
+    resp.raise_for_status()
+    results = resp.json().get("results") or []
+    return _block_to_text(results[0]) if results else ""
+
+def _walk_children(client: "NotionClient", frame: Dict[str, Any], depth: int, path: List[Dict[str, Any]],
+                   max_depth: int, timeout: Optional[float]) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """frame の位置から子ブロックを順に返す（has_children なら中へ潜る）。次の読み位置も一緒に返す。"""
+    cursor, skip = frame.get("cursor"), int(frame.get("skip") or 0)
+    while True:
+        params = {"page_size": NOTION_BLOCKS_PAGE_SZ}
+        if cursor:
+            params["start_cursor"] = cursor
+        resp = client.request("GET", f"/blocks/{frame['id']}/children", endpoint="blocks.read",
+                              params=params, timeout=timeout)
+        if resp.status_code != 200:
+            raise RuntimeError(f"blocks.read status={resp.status_code}")
+        data = resp.json()
+        results = data.get("results", []) or []
+        for i in range(skip, len(results)):
+            b = results[i]
+            here = path + [{"id": frame["id"], "cursor": cursor, "skip": i + 1}]
+            descend = (b.get("has_children") and depth < max_depth and b.get("type") not in _NO_DESCEND_TYPES)
+            if descend:
+                child = _child_frame(b.get("id"))
+                yield b, here + [child]
+                yield from _walk_children(client, child, depth + 1, here, max_depth, timeout)
+            else:
+                yield b, here
+        if not data.get("has_more") or not data.get("next_cursor"):
+            return
+        cursor, skip = data["next_cursor"], 0
+
+def iter_page_blocks(page_id: str, *, position: Optional[List[Dict[str, Any]]] = None,
+                     max_depth: Optional[int] = None, timeout: Optional[float] = None
+                     ) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    ページのブロックを文書順に1つずつ返すジェネレーター（(block, 次の読み位置) の組）。
+    has_more/next_cursor と入れ子の子ブロック（トグル・リスト等）は、取り出されたときに初めて取りに行く。
+    position を渡すとその位置から再開する。HTTP エラーは例外で上げる。
+    """
+    client = get_notion_client()
+    max_depth = NOTION_BLOCK_MAX_DEPTH if max_depth is None else max_depth
+    stack = position or [_child_frame(page_id)]
+    for level in range(len(stack) - 1, -1, -1):
+        yield from _walk_children(client, stack[level], level, stack[:level], max_depth, timeout)
+
+# ==== 本文キャッシュ（page_id + last_edited_time がキー。編集されるまでネットワーク不要） ====
+_PAGE_CACHE: Optional[TieredCache] = None
+
+def _page_cache() -> TieredCache:
+    global _PAGE_CACHE
+    if _PAGE_CACHE is None:
+        tiers = [ByteLRU(PAGE_CACHE_MEM_BYTES), TmpFileStore("notion_pages", PAGE_CACHE_TMP_BYTES)]
+        if PAGE_CACHE_S3:
+            tiers.append(S3Store("notion_pages", PAGE_CACHE_S3_BYTES))
+        _PAGE_CACHE = TieredCache("notion_pages", tiers)
+    return _PAGE_CACHE
+
+def _page_cache_key(page_id: str, last_edited: str, max_chars: int) -> str:
+    return f"{page_id.replace('-', '')}@{last_edited}#{max_chars}/section"
+
+_SECTION_SEP = " ／ "
+_SENTENCE_ENDS = "。！？!?"
+
+def _section_cut(text: str, room: int) -> int:
+    """room 文字に収まる切り位置。後半に文末があればそこで切る。"""
+    if room <= 0:
+        return 0
+    end = max(text.rfind(c, 0, room) for c in _SENTENCE_ENDS) + 1
+    return end if end * 2 >= room else room
+
+def cached_page_section(page_id: str, *, last_edited: Optional[str],
+                        max_chars: int = None) -> Optional[Dict[str, Any]]:
+    """先頭の節が本文キャッシュにあれば {"text", "cursor"} を返す（Notion は呼ばない）。無ければ None。"""
+    if not last_edited:
+        return None
+    return _page_cache().get(_page_cache_key(page_id, last_edited,
+                                             NOTION_SNIPPET_CHARS if max_chars is None else max_chars))
+
+@traced("notion.page_text")
+def notion_page_section(page_id: str, *, max_chars: int = None, cursor: Optional[Dict[str, Any]] = None,
+                        timeout: float = None, last_edited: Optional[str] = None) -> Dict[str, Any]:
+    """
+    ページ本文を max_chars 文字ぶん読み、{"text": 本文, "cursor": 続きの読み位置 or None} を返す。
+    - cursor（前回の戻り値）を渡すと、その続きから読む（ページの頭は取り直さない）
+    - 文字数に達したらその場で走査をやめる（残りのブロックは取りに行かない）
+    - ブロックの途中で切ったときは、カーソルにその文字位置（offset）も残す
+    - 先頭の節だけは last_edited が分かれば本文キャッシュを使う
+    - 途中で失敗・予算切れになったら、そこまでの本文と、失敗した位置のカーソルを返す
+    """
     if max_chars is None:
         max_chars = NOTION_SNIPPET_CHARS
-    if timeout is None:
-        timeout = HTTP_TIMEOUT_SEC
-
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children?page_size={NOTION_BLOCKS_PAGE_SZ}"
+    cache_key = _page_cache_key(page_id, last_edited, max_chars) if last_edited and not cursor else None
+    if cache_key:
+        cached = cached_page_section(page_id, last_edited=last_edited, max_chars=max_chars)
+        if cached is not None:
+            annotate(cache="hit")
+            return cached
+
+    position = (cursor or {}).get("position") or None
+    offset = int((cursor or {}).get("offset") or 0)
+    here = position or [_child_frame(page_id)]  # 次に読むブロックの位置
+    lines: List[str] = []
+    total = 0
+    next_cursor: Optional[Dict[str, Any]] = None
+    finished = False
     try:
-        resp = requests.get(url, headers=_notion_headers(), timeout=timeout)
-        if resp.status_code != 200:
-            return ""
-        blocks = resp.json().get("results", []) or []
-        lines = []
-        total = 0
-        for b in blocks:
-            t = _block_to_text(b).strip()
-            if t:
-                lines.append(t)
-                total += len(t)
-                if total >= int(max_chars * 1.5):
+        blocks = iter_page_blocks(page_id, position=position, timeout=timeout)
+        for b, after in blocks:
+            start, offset = offset, 0  # offset は再開直後の1ブロックにだけ効く
+            t = _block_to_text(b).strip()[start:]
+            if t.strip():
+                room = max_chars - total - (len(_SECTION_SEP) if lines else 0)
+                if len(t) > room:
+                    # 次の節に丸ごと入るブロックは切らずに回す。1節より長いブロックだけ途中で切る
+                    cut = 0 if lines and len(t) <= max_chars else _section_cut(t, room)
+                    if t[:cut].strip():
+                        lines.append(t[:cut].strip())
+                    next_cursor = {"position": here, "offset": start + cut}  # 同じブロックの途中から
                     break
-        return " ／ ".join(lines)[:max_chars]
+                lines.append(t)
+                total += len(t) + (len(_SECTION_SEP) if len(lines) > 1 else 0)
+            here = after
+            if total >= max_chars:
+                next_cursor = {"position": here, "offset": 0}
+                break
+            if budget_nearly_exhausted(MIN_CALL_TIMEOUT_SEC):
+                next_cursor = {"position": here, "offset": 0}
+                break
+        else:
+            finished = True
+        blocks.close()
+    except Exception as e:
+        LOGGER.info(f"[notion] page read stopped ex={type(e).__name__} chars={total}")
+        if not lines:
+            return {"text": "", "cursor": cursor}  # 続きの読み込みなら同じ位置からやり直せるように
+        next_cursor = {"position": here, "offset": 0}
+    result = {"text": _SECTION_SEP.join(lines), "cursor": None if finished else next_cursor}
+    if cache_key and result["text"]:
+        _page_cache().put(cache_key, result)
+    return result
+
+def notion_page_first_text(page_id: str, *, max_chars: int = None, timeout: float = None,
+                           last_edited: Optional[str] = None) -> str:
+    """ページ冒頭のテキストを返す（notion_page_section の先頭の節）。"""
+    return notion_page_section(page_id, max_chars=max_chars, timeout=timeout, last_edited=last_edited)["text"]
+
+# ==== 検索直後の本文先読み（NotionReadIntent を Notion 呼び出し無しで返すため） ====
+_PREFETCH_POOL: Optional[ThreadPoolExecutor] = None
+_PREFETCH_LOCK = threading.Lock()
+PREFETCH_STATS = {"started": 0, "ready": 0, "hits": 0, "misses": 0}
+
+def _prefetch_pool() -> ThreadPoolExecutor:
+    global _PREFETCH_POOL
+    if _PREFETCH_POOL is None:
+        with _PREFETCH_LOCK:
+            if _PREFETCH_POOL is None:
+                _PREFETCH_POOL = ThreadPoolExecutor(max_workers=max(1, NOTION_SEARCH_LIMIT), thread_name_prefix="pico-prefetch")
+    return _PREFETCH_POOL
+
+def _prefetch_section(page_id: str, last_edited: Optional[str]) -> Dict[str, Any]:
+    # 先読みはユーザーが待っている呼び出しに Notion のレートを譲る
+    with notion_priority(PRIORITY_PREFETCH):
+        return notion_page_section(page_id, last_edited=last_edited)
+
+def start_prefetch_first_texts(items: Iterable[Dict[str, str]]) -> Dict[str, Future]:
+    """検索結果の各ページの冒頭の節の取得をバックグラウンドで始める（page_id -> Future）。"""
+    futures = {}
+    for it in items:
+        pid = it.get("id")
+        if not pid or pid in futures:
+            continue
+        # 各タスクに現在のリクエスト予算（ContextVar）を持たせる
+        ctx = contextvars.copy_context()
+        futures[pid] = _prefetch_pool().submit(
+            ctx.run, _prefetch_section, pid.replace("-", ""), it.get("edited") or None
+        )
+    PREFETCH_STATS["started"] += len(futures)
+    return futures
+
+def collect_prefetched(futures: Dict[str, Future], timeout: float) -> Dict[str, Dict[str, Any]]:
+    """timeout 秒まで待って、取れた分（page_id -> {"text", "cursor"}）だけ返す（間に合わなかったものは諦める）。"""
+    if not futures:
+        return {}
+    wait(list(futures.values()), timeout=timeout)
+    out = {}
+    for pid, fut in futures.items():
+        if fut.done() and not fut.cancelled() and fut.exception() is None and (fut.result() or {}).get("text"):
+            out[pid] = fut.result()
+    PREFETCH_STATS["ready"] += len(out)
+    return out
+
+def record_prefetch_outcome(hit: bool) -> None:
+    PREFETCH_STATS["hits" if hit else "misses"] += 1
+    LOGGER.info(f"[notion-prefetch] {'hit' if hit else 'miss'} stats={PREFETCH_STATS}")
+
+# ==== 書き込み（ページ作成・DB 追加・追記の共通エンジン） ====
+NOTION_TEXT_MAX = 2000      # rich_text 1つの content の上限（Notion API の制限）
+NOTION_CHILDREN_MAX = 100   # 1リクエストで送れる子ブロック数の上限（Notion API の制限）
+# 書き込みが反映されていないと分かる応答だけ再送する（タイムアウトや 500 / 502 / 504 は、ゲートウェイの先で
+# 反映済みかもしれないので二重書きを避ける）
+_WRITE_RETRY_STATUSES = {409, 429, 503}
+
+def paragraph_blocks(content: str) -> List[Dict[str, Any]]:
+    """本文を NOTION_TEXT_MAX 文字ごとの段落ブロックにする（改行・空行は本文のまま残す）。"""
+    content = content or ""
+    return [{
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {"rich_text": [{"text": {"content": content[i:i + NOTION_TEXT_MAX]}}]}
+    } for i in range(0, len(content), NOTION_TEXT_MAX)]
+
+def _api_error(resp) -> str:
+    try:
+        msg = resp.json().get("message") or "不明なエラー"
     except Exception:
-        return ""
+        msg = "不明なエラー"
+    return f"API エラー: {msg}"
 
+def _write_with_retry(method: str, path: str, *, endpoint: str, payload: Dict[str, Any],
+                      timeout: Optional[float]) -> Tuple[Optional["requests.Response"], Optional[str], bool]:
+    """
+    書き込み1回分。反映されていない失敗（429 等）なら NOTION_WRITE_RETRIES 回まで再送する。
+    (resp, error, 反映されたかもしれないか) を返す（タイムアウト・切断・5xx は Notion 側で反映済みのことがある）。
+    """
+    attempt = 0
+    while True:
+        try:
+            resp = get_notion_client().request(method, path, endpoint=endpoint, payload=payload, timeout=timeout)
+        except notion_rate.NotionThrottled:
+            return None, "Notion が混み合っていて送れなかった", False
+        except Exception as e:
+            return None, f"例外: {type(e).__name__}", not _failed_before_send(e)
+        if resp.status_code == 200:
+            return resp, None, True
+        if resp.status_code not in _WRITE_RETRY_STATUSES or attempt >= NOTION_WRITE_RETRIES:
+            return None, _api_error(resp), resp.status_code >= 500 and resp.status_code != 503
+        if resp.status_code == 429 and notion_rate.get_bucket() is not None:
+            # record_response がバケットを Retry-After の間止めている。待つのは次の acquire だけにする
+            wait, delay = notion_rate.retry_after_sec(resp), 0.0
+        else:
+            wait = delay = max(notion_rate.retry_after_sec(resp, 0.0), NOTION_WRITE_BACKOFF_SEC * (2 ** attempt))
+        if budget_nearly_exhausted(wait + MIN_CALL_TIMEOUT_SEC):
+            return None, _api_error(resp), False
+        attempt += 1
+        annotate(write_retries=1)
+        if delay:
+            time.sleep(delay)
+
+def notion_write_blocks(blocks: List[Dict[str, Any]], *, create: Optional[Dict[str, Any]] = None,
+                        page_id: Optional[str] = None, timeout: float = None) -> Dict[str, Any]:
+    """
+    blocks を NOTION_CHILDREN_MAX 件ずつ順番に書く。
+    - create（POST /pages の parent/properties）があれば、最初のバッチを children にしてページを作る
+    - 残りのバッチ（create が無ければ全部）は page_id に PATCH /blocks/{id}/children で追記する
+    - 追記は順序を保つため1バッチずつ送る。失敗したバッチはそこで止める（後ろのバッチは送らない）
+
+    Returns:
+        dict: {"success": bool, "page_id": str, "url": str, "blocks_written": int, "blocks_total": int, "error": str,
+               "maybe_applied": bool}（maybe_applied: 失敗した書き込みが Notion 側で反映されたかもしれない）
+    """
+    batches = [blocks[i:i + NOTION_CHILDREN_MAX] for i in range(0, len(blocks), NOTION_CHILDREN_MAX)]
+    out: Dict[str, Any] = {"success": False, "page_id": page_id, "url": None,
+                           "blocks_written": 0, "blocks_total": len(blocks), "error": None, "maybe_applied": False}
+    if create is not None:
+        first = batches.pop(0) if batches else []
+        resp, err, applied = _write_with_retry("POST", "/pages", endpoint="pages.create",
+                                               payload=dict(create, children=first), timeout=timeout)
+        if err:
+            out.update(error=err, maybe_applied=applied)
+            return out
+        result = resp.json()
+        out.update(page_id=result.get("id"), url=result.get("url"), blocks_written=len(first))
+    for batch in batches:
+        _, err, applied = _write_with_retry("PATCH", f"/blocks/{out['page_id']}/children", endpoint="blocks.append",
+                                            payload={"children": batch}, timeout=timeout)
+        if err:
+            out.update(error=err, maybe_applied=applied)
+            break
+        out["blocks_written"] += len(batch)
+    out["success"] = out["error"] is None
+    annotate(blocks_written=out["blocks_written"], batches=len(batches) + (create is not None))
+    if len(blocks) > NOTION_CHILDREN_MAX or not out["success"]:
+        LOGGER.info(f"[notion-write] blocks={out['blocks_written']}/{len(blocks)} success={out['success']} "
+                    f"error={out['error']}")
+    return out
+
+@traced("notion.create_page")
 def notion_create_page(title: str, content: str, *, parent_id: str = None, timeout: float = None):
     """
     Notionに新しいページを作成
@@ -105,106 +534,37 @@ def notion_create_page(title: str, content: str, *, parent_id: str = None, timeo
         timeout: タイムアウト秒数
 
     Returns:
-        dict: {"success": bool, "page_id": str, "url": str, "error": str}
+        dict: {"success": bool, "page_id": str, "url": str, "blocks_written": int, "blocks_total": int, "error": str}
     """
-    if timeout is None:
-        timeout = HTTP_TIMEOUT_SEC
-
     if parent_id is None:
         parent_id = NOTION_DEFAULT_PARENT_ID
 
     if not parent_id:
         return {"success": False, "error": "親ページIDが指定されていません"}
 
-    url = "https://api.notion.com/v1/pages"
-
-    # ページプロパティ（タイトル）
-    properties = {
-        "title": {
-            "title": [{"text": {"content": title}}]
-        }
-    }
-
-    # 本文ブロック（段落として追加）
-    children = []
-    if content:
-        # 長い文章は2000文字ごとに分割（Notion APIの制限）
-        max_len = 2000
-        content_parts = [content[i:i+max_len] for i in range(0, len(content), max_len)]
-        for part in content_parts:
-            children.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [{"text": {"content": part}}]
-                }
-            })
-
-    payload = {
+    create = {
         "parent": {"page_id": parent_id},
-        "properties": properties,
-        "children": children
+        "properties": {"title": {"title": [{"text": {"content": title}}]}},
     }
+    return notion_write_blocks(paragraph_blocks(content), create=create, timeout=timeout)
 
-    try:
-        resp = requests.post(url, headers=_notion_headers(), data=json.dumps(payload), timeout=timeout)
-        if resp.status_code != 200:
-            error_msg = resp.json().get("message", "不明なエラー")
-            return {"success": False, "error": f"API エラー: {error_msg}"}
-
-        result = resp.json()
-        return {
-            "success": True,
-            "page_id": result.get("id"),
-            "url": result.get("url"),
-            "error": None
-        }
-    except Exception as e:
-        return {"success": False, "error": f"例外: {type(e).__name__}"}
-
-def notion_append_blocks(page_id: str, content: str, *, timeout: float = None):
+@traced("notion.append_blocks")
+def notion_append_blocks(page_id: str, content: str, *, skip_blocks: int = 0, timeout: float = None):
     """
     既存ページに本文を追加
 
     Args:
         page_id: 追加先ページID
         content: 追加する本文
+        skip_blocks: 本文の先頭から飛ばすブロック数（途中まで書けた書き込みの再開用）
         timeout: タイムアウト秒数
 
     Returns:
-        dict: {"success": bool, "error": str}
+        dict: {"success": bool, "blocks_written": int, "blocks_total": int, "error": str}
     """
-    if timeout is None:
-        timeout = HTTP_TIMEOUT_SEC
-
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-
-    # 本文ブロック
-    children = []
-    if content:
-        max_len = 2000
-        content_parts = [content[i:i+max_len] for i in range(0, len(content), max_len)]
-        for part in content_parts:
-            children.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [{"text": {"content": part}}]
-                }
-            })
-
-    payload = {"children": children}
-
-    try:
-        resp = requests.patch(url, headers=_notion_headers(), data=json.dumps(payload), timeout=timeout)
-        if resp.status_code != 200:
-            error_msg = resp.json().get("message", "不明なエラー")
-            return {"success": False, "error": f"API エラー: {error_msg}"}
-
-        return {"success": True, "error": None}
-    except Exception as e:
-        return {"success": False, "error": f"例外: {type(e).__name__}"}
+    return notion_write_blocks(paragraph_blocks(content)[skip_blocks:], page_id=page_id, timeout=timeout)
 
+@traced("notion.add_to_database")
 def notion_add_to_database(title: str, content: str, *, database_id: str = None, timeout: float = None):
     """
     データベースに新しいエントリを追加
@@ -216,58 +576,30 @@ def notion_add_to_database(title: str, content: str, *, database_id: str = None,
         timeout: タイムアウト秒数
 
     Returns:
-        dict: {"success": bool, "page_id": str, "url": str, "error": str}
+        dict: {"success": bool, "page_id": str, "url": str, "blocks_written": int, "blocks_total": int, "error": str}
     """
-    if timeout is None:
-        timeout = HTTP_TIMEOUT_SEC
-
     if database_id is None:
         database_id = NOTION_DEFAULT_DATABASE_ID
 
     if not database_id:
         return {"success": False, "error": "データベースIDが指定されていません"}
 
-    url = "https://api.notion.com/v1/pages"
-
     # データベースエントリのプロパティ（Nameプロパティを想定）
-    properties = {
-        "Name": {
-            "title": [{"text": {"content": title}}]
-        }
+    create = {
+        "parent": {"database_id": database_id},
+        "properties": {"Name": {"title": [{"text": {"content": title}}]}},
     }
+    return notion_write_blocks(paragraph_blocks(content), create=create, timeout=timeout)
 
-    # 本文ブロック
-    children = []
-    if content:
-        max_len = 2000
-        content_parts = [content[i:i+max_len] for i in range(0, len(content), max_len)]
-        for part in content_parts:
-            children.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [{"text": {"content": part}}]
-                }
-            })
+# ==== asyncio 版（ブロッキング呼び出しをスレッドで実行。予算などの ContextVar は引き継がれる） ====
+async def notion_search_pages_async(query: str, **kwargs):
+    return await asyncio.to_thread(notion_search_pages, query, **kwargs)
 
-    payload = {
-        "parent": {"database_id": database_id},
-        "properties": properties,
-        "children": children
-    }
+async def notion_page_section_async(page_id: str, **kwargs) -> Dict[str, Any]:
+    return await asyncio.to_thread(notion_page_section, page_id, **kwargs)
 
-    try:
-        resp = requests.post(url, headers=_notion_headers(), data=json.dumps(payload), timeout=timeout)
-        if resp.status_code != 200:
-            error_msg = resp.json().get("message", "不明なエラー")
-            return {"success": False, "error": f"API エラー: {error_msg}"}
+async def cached_page_section_async(page_id: str, **kwargs) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(cached_page_section, page_id, **kwargs)
 
-        result = resp.json()
-        return {
-            "success": True,
-            "page_id": result.get("id"),
-            "url": result.get("url"),
-            "error": None
-        }
-    except Exception as e:
-        return {"success": False, "error": f"例外: {type(e).__name__}"}
+async def collect_prefetched_async(futures: Dict[str, Future], timeout: float) -> Dict[str, Dict[str, Any]]:
+    return await asyncio.to_thread(collect_prefetched, futures, timeout)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+outbox.py
+- Notion への保存（ページ作成・DB 追加）の write-behind（NOTION_WRITE_BEHIND=1 のとき）
+  - ハンドラーは操作を S3 の outbox に書いて（write-through）すぐ「保存するね」と答える
+  - 実際の書き込みは裏のスレッドで行う。途中で凍結・失敗したものは、同じユーザーの次の呼び出しで拾い直す
+  - 失敗が確定した操作は、次のターンの応答の頭で伝えてから outbox から消す（成功したものは黙って消す）
+- 1操作 = 1オブジェクト: {S3_PREFIX}/pico_outbox/{user_id}/{op_id}.json
+  - op_id（べき等キー）= 種類・タイトル・本文のハッシュ。同じ保存の言い直しや Alexa の再送は1件にまとまる
+  - 書き込みの進み具合（page_id / blocks_written）を都度残すので、再試行は書けた続きから追記する
+    （ページを作り直さない）
+  - 作成の結果が分からないまま終わった操作（応答待ちで凍結した・タイムアウトした等）は、作り直す前に
+    同じタイトルで op を積んだ分以降に更新され、最初のブロックが本文の頭と同じページを探し、あればそれを使う
+    （last_edited_time は分に切り捨てられるので分で比べる）。検索の索引は遅れて更新されるので、
+    作成を送ってから _SEARCH_LAG_SEC の間は「見つからない」を「作られていない」とはみなさず、待ってから探し直す
+    （検索そのものの失敗は adopt_errors に数え、NOTION_OUTBOX_MAX_ATTEMPTS 回続いたら failed にして伝える）
+  - 実行中は lease_until まで他の呼び出しに拾わせない
+  - Notion へは background の優先度で送る（レート制限の順番はユーザーが待っている呼び出しに譲る）
+- 状態: pending（未実行・再試行待ち）/ sending（実行中）/ done / failed
+"""
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from config import (
+    S3_PREFIX, NOTION_WRITE_BEHIND, NOTION_OUTBOX_MAX_ATTEMPTS, NOTION_OUTBOX_LEASE_SEC,
+    NOTION_DEFAULT_PARENT_ID, NOTION_DEFAULT_DATABASE_ID
+)
+from notion_utils import (
+    notion_create_page, notion_add_to_database, notion_append_blocks, notion_search_pages,
+    notion_first_block_text, paragraph_blocks, NOTION_CHILDREN_MAX
+)
+from notion_rate import notion_priority, PRIORITY_BACKGROUND
+from rag_store_s3 import s3_get_json, s3_put_json, s3_list_keys, s3_delete_key
+
+LOGGER = logging.getLogger(__name__)
+
+OUTBOX_STATS = {"enqueued": 0, "deduped": 0, "sent": 0, "done": 0, "retried": 0, "failed": 0, "adopted": 0}
+
+_OUTBOX_DIR = f"{S3_PREFIX}/pico_outbox"
+_DEDUPE_SEC = 600  # 同じ保存が done になってからこの秒数以内なら、言い直しとみなして積まない
+_SEARCH_LAG_SEC = 120  # 作ったページが Notion の検索に出てくるまでの遅れの見込み
+_ADOPT_SEARCH_LIMIT = 10  # 同じタイトルの古いページがあっても新しい方まで届くように
+
+# このプロセスで実行中の op（同じ op を2本のスレッドで書かない）
+_ACTIVE: set = set()
+_ACTIVE_LOCK = threading.Lock()
+
+def _uid(handler_input) -> str:
+    return handler_input.request_envelope.context.system.user.user_id or "anon"
+
+def _user_prefix(uid: str) -> str:
+    return f"{_OUTBOX_DIR}/{hashlib.sha1(uid.encode('utf-8')).hexdigest()[:24]}/"
+
+def _op_key(uid: str, op_id: str) -> str:
+    return f"{_user_prefix(uid)}{op_id}.json"
+
+def op_id_for(kind: str, title: str, content: str) -> str:
+    return hashlib.sha1(f"{kind}\n{title}\n{content}".encode("utf-8")).hexdigest()[:20]
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def enabled_for(kind: str) -> bool:
+    """write-behind を使うか（保存先 ID が無い設定ミスは、その場で同期の書き込みに任せて伝える）。"""
+    if not NOTION_WRITE_BEHIND:
+        return False
+    return bool(NOTION_DEFAULT_PARENT_ID if kind == "page" else NOTION_DEFAULT_DATABASE_ID)
+
+# ==== 積む ====
+def enqueue(handler_input, kind: str, title: str, content: str) -> Optional[Dict[str, Any]]:
+    """
+    操作を outbox に書き、裏で実行を始める。書けたら op を、S3 に書けなければ None を返す
+    （None のときは呼び出し側が同期で書き込む）。
+    """
+    uid = _uid(handler_input)
+    op_id = op_id_for(kind, title, content)
+    key = _op_key(uid, op_id)
+    now = time.time()
+    existing = s3_get_json(key, None)
+    if existing and (existing.get("status") in ("pending", "sending")
+                     or (existing.get("status") == "done" and now - existing.get("updated", 0) < _DEDUPE_SEC)):
+        OUTBOX_STATS["deduped"] += 1
+        LOGGER.info(f"[outbox] dedupe op={op_id} status={existing.get('status')}")
+        _mark_session(handler_input)
+        return existing
+    op = {
+        "id": op_id, "kind": kind, "title": title, "content": content,
+        "status": "pending", "attempts": 0, "created": now, "created_iso": _iso(now), "updated": now,
+        "lease_until": now + NOTION_OUTBOX_LEASE_SEC,  # 裏のスレッドが拾うまで、次の呼び出しには拾わせない
+        "page_id": None, "url": None, "blocks_written": 0, "blocks_total": len(paragraph_blocks(content)),
+        "create_sent_at": None, "error": None,
+    }
+    try:
+        s3_put_json(key, op, write_through=True)  # 応答より先に必ず S3 に置く
+    except Exception as e:
+        LOGGER.warning(f"[outbox] enqueue failed ex={type(e).__name__}; falling back to a synchronous write")
+        return None
+    OUTBOX_STATS["enqueued"] += 1
+    _mark_session(handler_input)
+    start_drain(uid, [op])
+    return op
+
+def _mark_session(handler_input) -> None:
+    handler_input.attributes_manager.session_attributes["outbox"] = True
+
+# ==== 実行 ====
+def _adopt_created_page(op: Dict[str, Any]) -> Optional[bool]:
+    """
+    前回の作成が Notion に届いたか分からないとき、作成済みのページを探す。
+    True: 見つけて使う / False: 作られていない / None: まだ分からない（検索の失敗・索引の遅れ）
+    """
+    since = op["created_iso"][:16]  # "YYYY-MM-DDTHH:MM"。last_edited_time は分に切り捨てられている
+    blocks = paragraph_blocks(op["content"])
+    head = blocks[0]["paragraph"]["rich_text"][0]["text"]["content"] if blocks else ""
+    try:
+        for it in notion_search_pages(op["title"], limit=_ADOPT_SEARCH_LIMIT, strict=True):
+            if it.get("title") != op["title"] or (it.get("edited") or "")[:16] < since:
+                continue
+            if head and notion_first_block_text(it["id"]) != head:
+                continue  # 同じタイトルの別のページ
+            op["page_id"], op["url"] = it.get("id"), it.get("url")
+            op["blocks_written"] = min(op["blocks_total"], NOTION_CHILDREN_MAX)  # 作成は最初のバッチごと成功する
+            OUTBOX_STATS["adopted"] += 1
+            LOGGER.info(f"[outbox] adopted existing page op={op['id']}")
+            return True
+    except Exception as e:
+        op["adopt_errors"] = op.get("adopt_errors", 0) + 1
+        LOGGER.info(f"[outbox] adopt check failed op={op['id']} errors={op['adopt_errors']} ex={type(e).__name__}")
+        return None
+    if time.time() - op.get("create_sent_at", 0) < _SEARCH_LAG_SEC:
+        return None  # まだ検索に出ていないだけかもしれない
+    return False
+
+def _postpone(key: str, op: Dict[str, Any], until: float) -> Dict[str, Any]:
+    """作成の結果が分かるまで作り直さずに待つ（試行回数は数えない。検索の失敗は adopt_errors で数える）。"""
+    op.update(status="pending", updated=time.time(), lease_until=until)
+    s3_put_json(key, op)
+    LOGGER.info(f"[outbox] op={op['id']} waiting for the earlier create to show up in search")
+    return op
+
+def run_op(uid: str, op: Dict[str, Any]) -> Dict[str, Any]:
+    """1つの op を最後まで（または失敗まで）実行し、結果を S3 に残して返す。"""
+    key = _op_key(uid, op["id"])
+    if op.get("create_sent_at") and not op.get("page_id"):
+        found = _adopt_created_page(op)
+        if found is None and op.get("adopt_errors", 0) >= NOTION_OUTBOX_MAX_ATTEMPTS:
+            # 作られたかどうか確かめられないまま。作り直すと二重になりうるので、ここで諦めて伝える
+            op.update(status="failed", unconfirmed=True, updated=time.time(),
+                      error="作成済みか Notion の検索で確かめられなかった")
+            OUTBOX_STATS["failed"] += 1
+            s3_put_json(key, op)
+            LOGGER.info(f"[outbox] op={op['id']} status=failed adopt_errors={op['adopt_errors']} stats={OUTBOX_STATS}")
+            return op
+        if found is None:
+            return _postpone(key, op, max(time.time() + 2 ** (op["attempts"] + op.get("adopt_errors", 0)),
+                                          op["create_sent_at"] + _SEARCH_LAG_SEC))
+        if found is False:
+            op["create_sent_at"] = None  # 作られていないと分かったので作り直す
+    if op["attempts"]:
+        OUTBOX_STATS["retried"] += 1
+    op.update(status="sending", attempts=op["attempts"] + 1, updated=time.time(),
+              lease_until=time.time() + NOTION_OUTBOX_LEASE_SEC)
+    if not op.get("page_id"):
+        op["create_sent_at"] = time.time()  # 作成の応答を受け取る前に凍結しても、次の試行で探せるように残す
+    s3_put_json(key, op)
+    OUTBOX_STATS["sent"] += 1
+
+    if op.get("page_id"):
+        r = notion_append_blocks(op["page_id"], op["content"], skip_blocks=op["blocks_written"])
+        written = op["blocks_written"] + r.get("blocks_written", 0)
+    elif op["kind"] == "page":
+        r = notion_create_page(op["title"], op["content"])
+        written = r.get("blocks_written", 0)
+    else:
+        r = notion_add_to_database(op["title"], op["content"])
+        written = r.get("blocks_written", 0)
+    op.update(page_id=op.get("page_id") or r.get("page_id"), url=op.get("url") or r.get("url"),
+              blocks_written=written, updated=time.time())
+    if not op["page_id"] and not r.get("maybe_applied"):
+        op["create_sent_at"] = None  # 作成は届かなかった（4xx・順番待ち）ので、次は探さずに作る
+    if r["success"]:
+        op.update(status="done", error=None)
+        OUTBOX_STATS["done"] += 1
+    elif op["attempts"] >= NOTION_OUTBOX_MAX_ATTEMPTS:
+        op.update(status="failed", error=r.get("error"))
+        OUTBOX_STATS["failed"] += 1
+    else:
+        # 少し置いてから、次の呼び出し（または次のスレッド）で書けた続きから再試行する
+        op.update(status="pending", error=r.get("error"), lease_until=time.time() + 2 ** op["attempts"])
+    s3_put_json(key, op)
+    LOGGER.info(f"[outbox] op={op['id']} status={op['status']} attempts={op['attempts']} "
+                f"blocks={op['blocks_written']}/{op['blocks_total']} stats={OUTBOX_STATS}")
+    return op
+
+def _drain(uid: str, ops: List[Dict[str, Any]]) -> None:
+    for op in ops:
+        with _ACTIVE_LOCK:
+            if op["id"] in _ACTIVE:
+                continue
+            _ACTIVE.add(op["id"])
+        try:
+            with notion_priority(PRIORITY_BACKGROUND):
+                run_op(uid, op)
+        except Exception as e:
+            LOGGER.warning(f"[outbox] op={op['id']} ex={type(e).__name__}")
+        finally:
+            with _ACTIVE_LOCK:
+                _ACTIVE.discard(op["id"])
+
+def start_drain(uid: str, ops: List[Dict[str, Any]]) -> Optional[threading.Thread]:
+    """裏のスレッドで ops を実行する。リクエストの予算・Unit of Work・計測を引き継がない空のコンテキストで動かす
+    （応答後も続くので、S3 へは直接書き、Notion の待ち時間も既定のタイムアウトで切る）。"""
+    if not ops:
+        return None
+    th = threading.Thread(target=contextvars.Context().run, args=(_drain, uid, ops),
+                          name="pico-outbox", daemon=True)
+    th.start()
+    return th
+
+# ==== 次のターン: 拾い直し・結果の報告 ====
+def _due(op: Dict[str, Any], now: float) -> bool:
+    return op.get("status") in ("pending", "sending") and op.get("lease_until", 0) <= now
+
+def check(handler_input) -> List[Dict[str, Any]]:
+    """
+    このユーザーの outbox を見て、期限の来た op を裏で再実行し、失敗が確定した op を返す（報告用）。
+    古い done の op は消す。何も残っていなければ session の目印も消す。
+    """
+    uid = _uid(handler_input)
+    now = time.time()
+    ops = [op for op in (s3_get_json(k, None) for k in s3_list_keys(_user_prefix(uid))) if op]
+    for op in ops:
+        if op.get("status") == "done" and now - op.get("updated", 0) >= _DEDUPE_SEC:
+            s3_delete_key(_op_key(uid, op["id"]))
+    start_drain(uid, [op for op in ops if _due(op, now)])
+    if not any(op.get("status") in ("pending", "sending", "failed") for op in ops):
+        handler_input.attributes_manager.session_attributes.pop("outbox", None)
+    return [op for op in ops if op.get("status") == "failed"]
+
+def acknowledge(handler_input, ops: List[Dict[str, Any]]) -> None:
+    """ユーザーに伝えた失敗を outbox から消す。"""
+    uid = _uid(handler_input)
+    for op in ops:
+        s3_delete_key(_op_key(uid, op["id"]))
+
+def failure_notice(failed: List[Dict[str, Any]]) -> str:
+    if not failed:
+        return ""
+    parts = []
+    for op in failed:
+        where = "Notion" if op.get("kind") == "page" else "データベース"
+        if op.get("unconfirmed"):
+            parts.append(f"前に頼まれた「{op['title']}」の{where}への保存は、できたかどうか確かめられなかったよ。"
+                         f"{where}を見てみてね。")
+        elif op.get("blocks_written"):
+            parts.append(f"前に頼まれた「{op['title']}」の{where}への保存は途中まで"
+                         f"（{op['blocks_written']}／{op['blocks_total']}ブロック）しかできなかったよ。")
+        else:
+            parts.append(f"前に頼まれた「{op['title']}」の{where}への保存は失敗しちゃった。")
+    return "".join(parts) + "もう一度言ってくれたら保存し直すね。"
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+pregen.py
+- 「続けて」の回答を先回りで作っておく（PREGEN_MODE で切り替え）
+  - off        : 何もしない（既定）
+  - inline     : 回答を返す前に、予算が残っていればその場で続きも生成して session に置く
+  - background : 応答後も動くスレッドで生成し、プロセス内と S3 に置く（ウォームコンテナ向け）
+- ContinuationIntent は同じプロンプトの先回り結果があれば LLM を呼ばずに返す
+- 使われなかった生成（wasted）とヒット率を PREGEN_STATS で追う
+"""
+import logging
+import threading
+from typing import Any, Dict
+
+from config import PREGEN_MODE, HTTP_TIMEOUT_SEC
+from convo_core import one_shot_answer, _last_user_utterance, _budget_low
+from deadline import budget_timeout
+from rag_store_s3 import rag_top_snippets, save_pregenerated, load_pregenerated
+
+LOGGER = logging.getLogger(__name__)
+
+PREGEN_STATS = {"started": 0, "ready": 0, "hits": 0, "wasted": 0}
+
+# background モードの生成中/生成済み（user_id -> {"prompt", "text", "done"}）
+_INFLIGHT: Dict[str, Dict[str, Any]] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+def continuation_prompt(base: str) -> str:
+    """ContinuationIntent が前の発話から作る「続き」プロンプト（先回り生成と同じ文面にする）。"""
+    return base + "。続きと詳細を短く。"
+
+def _uid(handler_input) -> str:
+    return handler_input.request_envelope.context.system.user.user_id or "anon"
+
+def _discard_unused(handler_input, session: Dict[str, Any]) -> None:
+    if session.pop("pregen", None):
+        PREGEN_STATS["wasted"] += 1
+    with _INFLIGHT_LOCK:
+        _INFLIGHT.pop(_uid(handler_input), None)
+
+def maybe_pregenerate(handler_input, session: Dict[str, Any]) -> None:
+    """回答を返した直後に呼ぶ。直前のユーザー発話に対する「続き」を先に作っておく。"""
+    if PREGEN_MODE not in ("inline", "background"):
+        return
+    _discard_unused(handler_input, session)
+    if session.get("stream_resume"):
+        return  # 途中で切れた回答の続きは stream_resume 側で作る
+    base = _last_user_utterance(session)
+    if not base:
+        return
+    prompt = continuation_prompt(base)
+    snippets = rag_top_snippets(handler_input, k=5, query=prompt)
+
+    if PREGEN_MODE == "inline":
+        if _budget_low():
+            return
+        PREGEN_STATS["started"] += 1
+        scratch = {"history": list(session.get("history", []))}
+        text = one_shot_answer(scratch, prompt, snippets, intent="ContinuationIntent")
+        if text and not scratch.get("stream_resume"):  # 途中で切れた続きは先回りに残さない
+            PREGEN_STATS["ready"] += 1
+            session["pregen"] = {"prompt": prompt, "text": text}
+        return
+
+    # background: 応答後もスレッドは生き残る（コンテナが凍結されたら次の起動で再開する）
+    uid = _uid(handler_input)
+    snapshot = {"history": list(session.get("history", []))}
+    slot = {"prompt": prompt, "text": "", "done": threading.Event()}
+    with _INFLIGHT_LOCK:
+        _INFLIGHT[uid] = slot
+
+    def _run() -> None:
+        try:
+            text = one_shot_answer(snapshot, prompt, snippets, intent="ContinuationIntent")
+            if text and not snapshot.get("stream_resume"):
+                slot["text"] = text
+                PREGEN_STATS["ready"] += 1
+                save_pregenerated(handler_input, prompt, text)
+        except Exception as e:
+            LOGGER.warning(f"[pregen] background failed ex={type(e).__name__}")
+        finally:
+            slot["done"].set()
+
+    PREGEN_STATS["started"] += 1
+    session["pregen"] = {"prompt": prompt}
+    threading.Thread(target=_run, name="pico-pregen", daemon=True).start()
+
+def take_pregenerated(handler_input, session: Dict[str, Any], prompt: str) -> str:
+    """prompt と同じ先回り結果があれば返す（無ければ空文字）。1回で消費する。"""
+    marker = session.pop("pregen", None)
+    if not marker:
+        return ""
+    if marker.get("prompt") != prompt:
+        PREGEN_STATS["wasted"] += 1
+        return ""
+    text = marker.get("text") or ""
+    if not text:
+        with _INFLIGHT_LOCK:
+            slot = _INFLIGHT.pop(_uid(handler_input), None)
+        if slot and slot["prompt"] == prompt:
+            # LLM を呼び直すのと同じだけは待つ価値がある
+            slot["done"].wait(timeout=budget_timeout(HTTP_TIMEOUT_SEC, floor=0.0))
+            text = slot["text"]
+        if not text:
+            stored = load_pregenerated(handler_input)
+            if stored.get("prompt") == prompt:
+                text = stored.get("text") or ""
+    PREGEN_STATS["hits" if text else "wasted"] += 1
+    looked = PREGEN_STATS["hits"] + PREGEN_STATS["wasted"]
+    LOGGER.info(f"[pregen] {'hit' if text else 'miss'} hit_rate={PREGEN_STATS['hits'] / looked:.2f} stats={PREGEN_STATS}")
+    return text
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+progressive.py
+- Alexa の Progressive Response（VoicePlayer.Speak ディレクティブ）を別スレッドで送る
+- LLM の応答待ちの間に「ちょっと考えるね」を先に話し、無音の時間を減らす
+- 送信はクリティカルパスに載せない（待たない・失敗しても応答には影響しない）
+- テスト用に、送信内容と時刻を記録するだけの RecordingDirectiveSender を用意
+"""
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import PROGRESSIVE_TIMEOUT_SEC
+
+LOGGER = logging.getLogger(__name__)
+
+class HttpDirectiveSender:
+    """envelope の apiEndpoint / apiAccessToken 宛てに Directive Service へ POST する。"""
+    def __init__(self, timeout: float = PROGRESSIVE_TIMEOUT_SEC):
+        import requests  # 初めて送るときまで読み込まない
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, api_endpoint: str, api_access_token: str, request_id: str, ssml: str) -> bool:
+        payload = {
+            "header": {"requestId": request_id},
+            "directive": {"type": "VoicePlayer.Speak", "speech": ssml},
+        }
+        try:
+            resp = self.session.post(
+                f"{api_endpoint.rstrip('/')}/v1/directives",
+                headers={"Authorization": f"Bearer {api_access_token}", "Content-Type": "application/json"},
+                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                timeout=self.timeout,
+            )
+            return resp.status_code == 204
+        except Exception as e:
+            LOGGER.warning(f"[progressive] send failed ex={type(e).__name__}")
+            return False
+
+class RecordingDirectiveSender:
+    """ローカル代替。送信の順序とタイミングを検証できるよう、呼ばれた内容を記録する。"""
+    def __init__(self, delay_sec: float = 0.0):
+        self.delay_sec = delay_sec
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def send(self, api_endpoint: str, api_access_token: str, request_id: str, ssml: str) -> bool:
+        started = time.monotonic()
+        if self.delay_sec:
+            time.sleep(self.delay_sec)
+        with self._lock:
+            self.calls.append({
+                "api_endpoint": api_endpoint, "request_id": request_id, "ssml": ssml,
+                "started": started, "finished": time.monotonic(),
+            })
+        return True
+
+_SENDER = None
+
+def get_directive_sender():
+    global _SENDER
+    if _SENDER is None:
+        _SENDER = HttpDirectiveSender()
+    return _SENDER
+
+def set_directive_sender(sender):
+    """送信先を差し替える（テスト・ベンチマーク用）。前の sender を返す。"""
+    global _SENDER
+    prev, _SENDER = _SENDER, sender
+    return prev
+
+def start_progressive_response(handler_input, ssml: str) -> Optional[threading.Thread]:
+    """Progressive Response をバックグラウンドで送る。送れない envelope なら何もしない。"""
+    envelope = handler_input.request_envelope
+    system = getattr(getattr(envelope, "context", None), "system", None)
+    api_endpoint = getattr(system, "api_endpoint", None)
+    api_access_token = getattr(system, "api_access_token", None)
+    request_id = getattr(getattr(envelope, "request", None), "request_id", None)
+    if not (api_endpoint and api_access_token and request_id):
+        return None
+    sender = get_directive_sender()
+    th = threading.Thread(
+        target=sender.send, args=(api_endpoint, api_access_token, request_id, ssml),
+        name="pico-progressive", daemon=True,
+    )
+    th.start()
+    return th
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+prompt_budget.py
+- LLM に送るメッセージを入力トークン予算（PROMPT_TOKEN_BUDGET）に収めて組み立てる
+- トークン数はローカルで数える: tiktoken があればそれ、無ければ文字種ごとの概算（多めに見積もる）
+- 並び: [固定プレフィックス（システムプロンプト + few-shot）] [参照ノート] [履歴] [今回の質問]
+  - 固定プレフィックスは毎回同じ文字列なので、プロバイダーのプロンプトキャッシュが当たる
+    （変わる部分＝参照ノートはプレフィックスの後ろに置く）
+  - 今回の質問は必ず入れる。残りの予算を、履歴（1往復単位）と参照ノートに関連度の高い順で割り当てる
+    - 関連度: 新しさ（直近ほど高い / ノートは検索順位が高いほど高い）+ 今回の質問との文字 n-gram の重なり
+    - 1メッセージ・1ノートは PROMPT_ITEM_MAX_TOKENS まで（長い回答1つで予算を使い切らないように）
+    - 入りきらない項目は、残りが PROMPT_MIN_ITEM_TOKENS 以上なら切り詰めて入れる
+  - 選んだ項目は元の順（履歴は古い順、ノートは渡された順）で並べる
+- 組み立てるたびに [prompt] 行で送るトークン数を出す
+"""
+import math
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    OPENAI_MODEL, PROMPT_TOKEN_BUDGET, PROMPT_ITEM_MAX_TOKENS, PROMPT_MIN_ITEM_TOKENS, PROMPT_TOKENIZER
+)
+from rag_index import ngrams
+
+LOGGER = logging.getLogger(__name__)
+
+MSG_OVERHEAD_TOKENS = 4    # 1メッセージごとの role 等の分
+REPLY_PRIMING_TOKENS = 3   # 応答の開始分
+QUERY_MAX_CHARS = 400
+
+# ==== トークン数 ====
+_ENCODER: Any = None
+_ENCODER_READY = False
+_ENCODER_LOCK = threading.Lock()
+
+def _encoder():
+    """tiktoken のエンコーダー（無い・読めないときは None）。最初の1回だけ作る。"""
+    global _ENCODER, _ENCODER_READY
+    if _ENCODER_READY:
+        return _ENCODER
+    with _ENCODER_LOCK:
+        if not _ENCODER_READY:
+            if PROMPT_TOKENIZER != "heuristic":
+                try:
+                    import tiktoken
+                    try:
+                        _ENCODER = tiktoken.encoding_for_model(OPENAI_MODEL)
+                    except KeyError:
+                        _ENCODER = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    LOGGER.info(f"[prompt] tiktoken unavailable ({type(e).__name__}); using heuristic counts")
+                    _ENCODER = None
+            _ENCODER_READY = True
+    return _ENCODER
+
+def tokenizer_name() -> str:
+    return "tiktoken" if _encoder() is not None else "heuristic"
+
+def _char_cost(ch: str) -> float:
+    # 英数字はおよそ4文字で1トークン、かな・漢字・記号は1文字1トークンとみなす（少なく見積もらない側）
+    return 0.3 if ch.isascii() else 1.0
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoder()
+    if enc is not None:
+        return len(enc.encode(text))
+    return int(math.ceil(sum(_char_cost(ch) for ch in text)))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """先頭から max_tokens に収まる分だけ残す。"""
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = _encoder()
+    if enc is not None:
+        ids = enc.encode(text)
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += _char_cost(ch)
+        if used > max_tokens:
+            return text[:i]
+    return text
+
+def messages_tokens(msgs: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(m["content"]) + MSG_OVERHEAD_TOKENS for m in msgs) + REPLY_PRIMING_TOKENS
+
+# ==== 組み立て ====
+def _history_turns(history: List[Dict[str, Any]]) -> List[List[Dict[str, str]]]:
+    """履歴を「user から次の user の手前まで」の往復にまとめる（古い順）。"""
+    turns: List[List[Dict[str, str]]] = []
+    for t in history or []:
+        role, text = t.get("role"), (t.get("text") or "").strip()
+        if role not in ("user", "assistant") or not text:
+            continue
+        if role == "user" or not turns:
+            turns.append([])
+        turns[-1].append({"role": role, "content": truncate_to_tokens(text, PROMPT_ITEM_MAX_TOKENS)})
+    return turns
+
+def _overlap(query_grams: set, text: str) -> float:
+    if not query_grams:
+        return 0.0
+    return len(query_grams & set(ngrams(text))) / len(query_grams)
+
+def _fit(msgs: List[Dict[str, str]], room: int) -> Tuple[List[Dict[str, str]], int]:
+    """msgs を room トークンに収める。入りきらなければ後ろのメッセージから切り詰める。"""
+    cost = messages_tokens(msgs) - REPLY_PRIMING_TOKENS
+    if cost <= room:
+        return msgs, cost
+    if room < PROMPT_MIN_ITEM_TOKENS:
+        return [], 0
+    out, used = [], 0
+    for m in msgs:
+        left = room - used - MSG_OVERHEAD_TOKENS
+        if left < PROMPT_MIN_ITEM_TOKENS:
+            break
+        content = truncate_to_tokens(m["content"], left)
+        if not content:
+            break
+        out.append({"role": m["role"], "content": content})
+        used += count_tokens(content) + MSG_OVERHEAD_TOKENS
+    return out, used
+
+def build_messages(prefix: List[Dict[str, str]], history: List[Dict[str, Any]], user_query: str,
+                   snippets: Optional[List[str]] = None, budget: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    prefix（固定）+ 参照ノート + 履歴 + 今回の質問 を budget トークン以内で返す。
+    snippets は rag_top_snippets の並び（関連度の高いものが末尾）で渡す。
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    query = {"role": "user", "content": (user_query or "").strip()[:QUERY_MAX_CHARS]}
+    fixed = messages_tokens(prefix + [query])
+    room = max(0, budget - fixed)
+    q_grams = set(ngrams(query["content"]))
+
+    # (スコア, 種類, 元の位置, メッセージ列)
+    candidates: List[Tuple[float, str, int, List[Dict[str, str]]]] = []
+    turns = _history_turns(history)
+    for i, turn in enumerate(turns):
+        age = len(turns) - 1 - i
+        candidates.append((0.5 ** age + _overlap(q_grams, " ".join(m["content"] for m in turn)), "history", i, turn))
+    snippets = [truncate_to_tokens(s.strip(), PROMPT_ITEM_MAX_TOKENS) for s in (snippets or []) if (s or "").strip()]
+    for i, snip in enumerate(snippets):
+        rank = len(snippets) - 1 - i
+        candidates.append((0.5 ** rank + _overlap(q_grams, snip), "snippet", i,
+                           [{"role": "system", "content": snip}]))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    chosen_turns: Dict[int, List[Dict[str, str]]] = {}
+    chosen_snips: Dict[int, str] = {}
+    header = "参照ノート:\n"
+    header_cost = count_tokens(header) + MSG_OVERHEAD_TOKENS
+    for _, kind, pos, msgs in candidates:
+        if kind == "snippet":
+            extra = 0 if chosen_snips else header_cost  # ノートは1つの system メッセージにまとめる
+            fitted, used = _fit([{"role": "system", "content": msgs[0]["content"]}], room - extra)
+            if fitted:
+                chosen_snips[pos] = fitted[0]["content"]
+                room -= used - MSG_OVERHEAD_TOKENS + extra + 1  # 改行の分
+        else:
+            fitted, used = _fit(msgs, room)
+            if fitted:
+                chosen_turns[pos] = fitted
+                room -= used
+        if room < PROMPT_MIN_ITEM_TOKENS:
+            break
+
+    out = list(prefix)
+    if chosen_snips:
+        out.append({"role": "system", "content": header + "\n".join(chosen_snips[i] for i in sorted(chosen_snips))})
+    for i in sorted(chosen_turns):
+        out.extend(chosen_turns[i])
+    out.append(query)
+
+    total = messages_tokens(out)
+    LOGGER.info(f"[prompt] tokens={total} budget={budget} prefix={messages_tokens(prefix) - REPLY_PRIMING_TOKENS} "
+                f"history={len(chosen_turns)}/{len(turns)} snippets={len(chosen_snips)}/{len(snippets)} "
+                f"counter={tokenizer_name()}")
+    return out
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+rag_index.py
+- RAG メモ用の小さな転置インデックス（文字 2-gram / 3-gram）と BM25 スコアリング
+- 日本語は単語境界が無いので、形態素解析の代わりに文字 n-gram を使う
+- インデックスは JSON でそのまま S3 に置ける形（dict / list / int のみ）
+
+形式:
+    {"post": {gram: [doc_id, tf, doc_id, tf, ...]},   # フラットな (文書, 出現回数) の並び
+     "dl":   {doc_id: 文書長(gram数)}}
+"""
+import math
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Tuple, Any
+
+NGRAM_SIZES = (2, 3)
+BM25_K1 = 1.2
+BM25_B  = 0.75
+MIN_IDF = 0.1
+
+# 空白・句読点・記号は n-gram を作る前に落とす
+_STRIP_RE = re.compile(r"[\s　、。，．・！？!?「」『』（）()\[\]【】｜|:：;；,.\-―…■]+")
+
+def new_index() -> Dict[str, Any]:
+    return {"post": {}, "dl": {}}
+
+def _normalize(text: str) -> str:
+    return _STRIP_RE.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+def ngrams(text: str) -> List[str]:
+    s = _normalize(text)
+    if len(s) < min(NGRAM_SIZES):
+        return [s] if s else []
+    out = []
+    for n in NGRAM_SIZES:
+        out.extend(s[i:i + n] for i in range(len(s) - n + 1))
+    return out
+
+def index_add(index: Dict[str, Any], doc_id: int, text: str) -> None:
+    grams = ngrams(text)
+    tf: Dict[str, int] = {}
+    for g in grams:
+        tf[g] = tf.get(g, 0) + 1
+    post = index["post"]
+    for g, n in tf.items():
+        post.setdefault(g, []).extend((doc_id, n))
+    index["dl"][str(doc_id)] = len(grams)
+
+def index_remove(index: Dict[str, Any], doc_ids: Iterable[int]) -> None:
+    drop = set(doc_ids)
+    if not drop:
+        return
+    post = index["post"]
+    for g in list(post.keys()):
+        pl = post[g]
+        kept = []
+        for i in range(0, len(pl), 2):
+            if pl[i] not in drop:
+                kept.extend((pl[i], pl[i + 1]))
+        if kept:
+            post[g] = kept
+        else:
+            del post[g]
+    for d in drop:
+        index["dl"].pop(str(d), None)
+
+def bm25_scores(index: Dict[str, Any], query: str) -> List[Tuple[int, float]]:
+    """クエリに対する (doc_id, score) をスコア降順で返す（score>0 のみ）。"""
+    dl = index.get("dl") or {}
+    n_docs = len(dl)
+    if not n_docs:
+        return []
+    avgdl = (sum(dl.values()) / n_docs) or 1.0
+    post = index.get("post") or {}
+    # 文書長の正規化項は文書ごとに1回だけ計算する
+    k1, b = BM25_K1, BM25_B
+    norm = {int(d): k1 * (1.0 - b + b * n / avgdl) for d, n in dl.items()}
+    scores: Dict[int, float] = {}
+    for g in set(ngrams(query)):
+        pl = post.get(g)
+        if not pl:
+            continue
+        df = len(pl) // 2
+        idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        if idf < MIN_IDF:
+            continue  # ほぼ全文書に出る gram（「について」等）は順位にほぼ効かないので飛ばす
+        w = idf * (k1 + 1.0)
+        for d, tf in zip(pl[0::2], pl[1::2]):
+            scores[d] = scores.get(d, 0.0) + w * tf / (tf + norm.get(d, k1))
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+rag_segments.py
+- ユーザー別 RAG メモの追記型の形式（S3 の読み書きは rag_store_s3 が行う。ここは形式と合成だけ）
+  - {S3_PREFIX}/pico_rag/{user_id}/ の下に置く
+    - d-{ミリ秒}-{乱数}.json : 差分（1回の追加分の items）。書いたら変えない
+    - s-{ミリ秒}-{乱数}.json.gz : スナップショット（items と BM25 インデックス。gzip）
+    - manifest.json : いまのスナップショットと、それに畳み込み済みの差分のキー
+  - 追加は差分を1つ PUT するだけ（全体を読み直して書き戻さない。同じユーザーの2台が同時に書いても消えない）
+  - 読むときはスナップショットに、畳み込まれていない差分をキーの順（= 書いた順）に重ねる
+  - 差分が溜まったら圧縮（compact）: スナップショットを作り直して manifest を差し替え、
+    1つ前の世代の差分とスナップショットを消す（読みかけの相手が困らないよう、消すのは1世代遅れ）
+- 保持は件数ではなくサイズで決める（RAG_RETAIN_BYTES。RAG_RETAIN_ITEMS を 0 以外にすると件数でも切る）。
+  古いものから落とす
+- 同じ (url, title) のメモは先に入っていた方を残す
+"""
+import json
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import RAG_RETAIN_BYTES, RAG_RETAIN_ITEMS
+from rag_index import new_index, index_add, index_remove
+
+FORMAT_VERSION = 3
+MANIFEST = "manifest.json"
+DELTA_PREFIX = "d-"
+SNAPSHOT_PREFIX = "s-"
+
+def _stamp(now: Optional[float] = None) -> str:
+    return f"{int((time.time() if now is None else now) * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+def delta_name(now: Optional[float] = None) -> str:
+    return f"{DELTA_PREFIX}{_stamp(now)}.json"
+
+def snapshot_name(now: Optional[float] = None) -> str:
+    return f"{SNAPSHOT_PREFIX}{_stamp(now)}.json.gz"
+
+def name_time(name: str) -> float:
+    """差分・スナップショットの名前に入れた時刻（秒）。読めなければ 0。"""
+    try:
+        return int(name.split("-", 2)[1]) / 1000.0
+    except (IndexError, ValueError):
+        return 0.0
+
+def index_text(item: Dict[str, Any]) -> str:
+    return f"{item.get('title') or ''} {item.get('snippet') or ''}"
+
+def item_bytes(item: Dict[str, Any]) -> int:
+    return len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
+
+def empty_doc() -> Dict[str, Any]:
+    return {"v": FORMAT_VERSION, "items": [], "index": new_index(), "next_id": 0, "bytes": 0}
+
+def from_legacy(data: Any) -> Dict[str, Any]:
+    """旧形式（{"v": 2, "items", "index", "next_id"} か items の配列）を読み込み用の形にする。"""
+    if isinstance(data, dict) and isinstance(data.get("index"), dict):
+        doc = dict(data)
+        doc["bytes"] = sum(item_bytes(it) for it in doc.get("items") or [])
+        return doc
+    doc = empty_doc()
+    apply_items(doc, data if isinstance(data, list) else [], retain=False)
+    return doc
+
+def normalize_items(new_items: Iterable[Dict[str, Any]], snippet_max: int, ts: int) -> List[Dict[str, Any]]:
+    """追加するメモを保存する形にする（id は読むときに振る）。"""
+    out = []
+    for it in new_items:
+        title = (it.get("title") or "無題").strip()[:120]
+        out.append({"title": title, "url": (it.get("url") or "").strip(),
+                    "snippet": (it.get("snippet") or title)[:snippet_max], "ts": int(it.get("ts") or ts)})
+    return out
+
+def apply_items(doc: Dict[str, Any], items: Iterable[Dict[str, Any]], *, retain: bool = True,
+                max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    doc に items を足す（同じ (url, title) は足さない）。足したものを返す。
+    retain=True なら保持の上限を超えた古いメモを落とす。
+    """
+    seen = doc.get("_seen")
+    if seen is None:
+        seen = doc["_seen"] = {(it.get("url"), it.get("title")) for it in doc["items"]}
+    added = []
+    next_id = int(doc.get("next_id", len(doc["items"])))
+    for it in items:
+        key = (it.get("url"), it.get("title"))
+        if key in seen:
+            continue
+        item = dict(it, id=next_id)
+        doc["items"].append(item)
+        seen.add(key)
+        index_add(doc["index"], next_id, index_text(item))
+        doc["bytes"] = int(doc.get("bytes", 0)) + item_bytes(item)
+        next_id += 1
+        added.append(item)
+    doc["next_id"] = next_id
+    if retain:
+        apply_retention(doc, max_items=max_items)
+    return added
+
+def apply_retention(doc: Dict[str, Any], *, max_items: Optional[int] = None) -> int:
+    """サイズ（と件数）の上限を超えた分を古い順に落とし、落とした件数を返す。"""
+    items = doc["items"]
+    limit_items = max_items if max_items is not None else RAG_RETAIN_ITEMS
+    size = int(doc.get("bytes", 0))
+    cut = 0
+    while cut < len(items) - 1 and ((RAG_RETAIN_BYTES > 0 and size > RAG_RETAIN_BYTES)
+                                    or (limit_items > 0 and len(items) - cut > limit_items)):
+        size -= item_bytes(items[cut])
+        cut += 1
+    if not cut:
+        return 0
+    dropped = items[:cut]
+    index_remove(doc["index"], [it["id"] for it in dropped])
+    seen = doc.get("_seen")
+    if seen is not None:
+        for it in dropped:
+            seen.discard((it.get("url"), it.get("title")))
+    doc["items"] = items[cut:]
+    doc["bytes"] = size
+    return cut
+
+def merge(base: Dict[str, Any], deltas: Iterable[Tuple[str, Any]]) -> Dict[str, Any]:
+    """スナップショット（か旧形式）に、(名前, 差分) を名前の順に重ねる。base はそのまま書き換える。"""
+    for _, delta in sorted(deltas, key=lambda kv: kv[0]):
+        if isinstance(delta, dict):
+            apply_items(base, delta.get("items") or [], retain=False)
+    apply_retention(base)
+    return base
+
+def snapshot_body(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """スナップショットとして保存する形（作業用のキーを除く）。"""
+    return {"v": FORMAT_VERSION, "items": doc["items"], "index": doc["index"],
+            "next_id": int(doc.get("next_id", 0)), "bytes": int(doc.get("bytes", 0))}
+
+def live_deltas(names: Iterable[str], manifest: Dict[str, Any]) -> List[str]:
+    """まだスナップショットに畳み込まれていない差分の名前（書いた順）。"""
+    folded = set(manifest.get("folded") or ())
+    return sorted(n for n in names if n.startswith(DELTA_PREFIX) and n not in folded)
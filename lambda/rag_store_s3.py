@@ -1,12 +1,250 @@
 # -*- coding: utf-8 -*-
+import gzip
 import json
 import time
-from typing import List, Dict, Any
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
-import boto3
-from config import S3_BUCKET, S3_PREFIX
+from config import S3_BUCKET, S3_PREFIX, HTTP_TIMEOUT_SEC, RAG_COMPACT_DELTAS, RAG_CACHE_MEM_BYTES
+from deadline import budget_timeout
+from rag_index import bm25_scores
+from tracing import span, traced
+import rag_segments
 
-s3 = boto3.client("s3")
+LOGGER = logging.getLogger(__name__)
+
+# ==== S3 クライアント（タイムアウト段階ごとに1つ） ====
+# boto3 は呼び出しごとにタイムアウトを渡せないので、残り予算に合う段階のクライアントを選ぶ。
+# boto3 の import とクライアント生成は重いので、最初に S3 を使うときまで遅らせる
+# （段階ごとのクライアントは1つの Session を共有し、サービス定義の読み込みは1回で済ませる）。
+_S3_TIMEOUT_STEPS = tuple(sorted({0.5, 1.0, HTTP_TIMEOUT_SEC}))
+_S3_WRITE_FLOOR_SEC = 1.0  # 書き込みは予算切れでも最低これだけ待つ（取りこぼし防止）
+_S3_CLIENTS: Dict[float, Any] = {}
+_S3_CLIENTS_LOCK = threading.Lock()
+_BOTO_SESSION = None
+
+def _boto_session():
+    global _BOTO_SESSION
+    if _BOTO_SESSION is None:
+        import boto3
+        _BOTO_SESSION = boto3.session.Session()
+    return _BOTO_SESSION
+
+def _s3_client(timeout: float = HTTP_TIMEOUT_SEC):
+    step = _S3_TIMEOUT_STEPS[0]
+    for st in _S3_TIMEOUT_STEPS:
+        if st <= timeout:
+            step = st
+    client = _S3_CLIENTS.get(step)
+    if client is None:
+        with _S3_CLIENTS_LOCK:
+            client = _S3_CLIENTS.get(step)
+            if client is None:
+                from botocore.config import Config
+                client = _boto_session().client("s3", config=Config(
+                    connect_timeout=step, read_timeout=step,
+                    retries={"max_attempts": 1, "mode": "standard"},  # 予算内で盲目的に再送しない
+                ))
+                _S3_CLIENTS[step] = client
+    return client
+
+# ==== S3 の素の読み書き（JSON。gzip で置いたものは読むときに展開する） ====
+_GZIP_MAGIC = b"\x1f\x8b"
+
+def _s3_get_json_raw(key: str, default: Any, *, timeout: Optional[float] = None, strict: bool = False) -> Any:
+    """strict=True なら、無い（NoSuchKey）とき以外の失敗は default にせず送出する。"""
+    with span("s3.get") as rec:
+        s3 = _s3_client(timeout if timeout is not None else budget_timeout(HTTP_TIMEOUT_SEC))
+        try:
+            obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+            body = obj["Body"].read()
+            rec["bytes_in"] = len(body)
+            if body[:2] == _GZIP_MAGIC:
+                body = gzip.decompress(body)
+            return json.loads(body.decode("utf-8"))
+        except s3.exceptions.NoSuchKey:
+            rec["outcome"] = "miss"
+            return default
+        except Exception as e:
+            rec["outcome"] = f"error:{type(e).__name__}"
+            if strict:
+                raise
+            return default
+
+def _s3_put_json_raw(key: str, data: Any, *, timeout: Optional[float] = None, compress: bool = False) -> None:
+    with span("s3.put") as rec:
+        if timeout is None:
+            timeout = budget_timeout(HTTP_TIMEOUT_SEC, floor=_S3_WRITE_FLOOR_SEC)
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        extra = {}
+        if compress:
+            body = gzip.compress(body)
+            extra["ContentEncoding"] = "gzip"
+        rec["bytes_out"] = len(body)
+        _s3_client(timeout).put_object(
+            Bucket=S3_BUCKET, Key=key,
+            Body=body,
+            ContentType="application/json; charset=utf-8",
+            **extra
+        )
+
+def s3_list_objects(prefix: str, *, timeout: Optional[float] = None, strict: bool = False) -> List[Tuple[str, float]]:
+    """
+    prefix 以下の (キー, 最終更新のエポック秒)。1000件を超えたら続きも取る。Unit of Work は通さない
+    （失敗は空リスト。strict=True なら例外で上げる）。
+    """
+    return [(key, modified) for key, modified, _ in s3_list_sized(prefix, timeout=timeout, strict=strict)]
+
+def s3_list_sized(prefix: str, *, timeout: Optional[float] = None, strict: bool = False) -> List[Tuple[str, float, int]]:
+    """s3_list_objects にバイト数を足したもの: (キー, 最終更新のエポック秒, バイト数)。"""
+    with span("s3.list") as rec:
+        out: List[Tuple[str, float, int]] = []
+        kwargs: Dict[str, Any] = {"Bucket": S3_BUCKET, "Prefix": prefix}
+        try:
+            while True:
+                client = _s3_client(timeout if timeout is not None else budget_timeout(HTTP_TIMEOUT_SEC))
+                resp = client.list_objects_v2(**kwargs)
+                for o in resp.get("Contents") or []:
+                    modified = o.get("LastModified")
+                    out.append((o["Key"], modified.timestamp() if modified is not None else 0.0, int(o.get("Size") or 0)))
+                if not resp.get("IsTruncated") or not resp.get("NextContinuationToken"):
+                    break
+                kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+        except Exception as e:
+            rec["outcome"] = f"error:{type(e).__name__}"
+            if strict:
+                raise
+            return []
+        if not out:
+            rec["outcome"] = "empty"
+        return out
+
+def s3_list_keys(prefix: str, *, timeout: Optional[float] = None) -> List[str]:
+    """prefix 以下のキー。Unit of Work は通さない（失敗は空リスト）。"""
+    return [key for key, _ in s3_list_objects(prefix, timeout=timeout)]
+
+def s3_delete_key(key: str, *, timeout: Optional[float] = None) -> bool:
+    """キーを消す（Unit of Work は通さない。失敗はログのみで False を返す）。"""
+    with span("s3.delete") as rec:
+        try:
+            _s3_client(timeout if timeout is not None else budget_timeout(HTTP_TIMEOUT_SEC)).delete_object(
+                Bucket=S3_BUCKET, Key=key)
+        except Exception as e:
+            rec["outcome"] = f"error:{type(e).__name__}"
+            LOGGER.warning(f"[s3] delete failed key={key} ex={type(e).__name__}")
+            return False
+        return True
+
+# ==== リクエスト単位の Unit of Work ====
+# 1リクエストの間、同じキーの GET は1回だけにし、PUT は最後にまとめて並列で流す。
+_MISSING = object()
+
+class S3UnitOfWork:
+    def __init__(self, label: str = ""):
+        self.label = label
+        self._cache: Dict[str, Any] = {}
+        self._dirty: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.reads = 0    # 呼び出し側が要求した読み込み回数
+        self.writes = 0   # 呼び出し側が要求した書き込み回数
+        self.s3_gets = 0  # 実際に S3 へ出した GET
+        self.s3_puts = 0  # 実際に S3 へ出した PUT
+        self.memo: Dict[str, Any] = {}  # 読んだものから組み立てた値（RAG の合成結果など）のリクエスト内キャッシュ
+        self.committed = False
+
+    def get(self, key: str, default: Any) -> Any:
+        with self._lock:
+            self.reads += 1
+            if key in self._cache:
+                val = self._cache[key]
+                return default if val is _MISSING else val
+            self.s3_gets += 1
+        val = _s3_get_json_raw(key, _MISSING)
+        with self._lock:
+            # 取得中に put された値があればそちらを優先
+            val = self._cache.setdefault(key, val)
+        return default if val is _MISSING else val
+
+    def put(self, key: str, data: Any, *, write_through: bool = False) -> None:
+        """
+        書き込みをバッファする（write_through=True ならすぐ書く）。
+        commit の後に来た書き込み（応答を返した後に終わった先読みなど）は、バッファしても誰も流さないのですぐ書く。
+        """
+        with self._lock:
+            self.writes += 1
+            self._cache[key] = data
+            if not (write_through or self.committed):
+                self._dirty[key] = data
+                return
+            self._dirty.pop(key, None)
+            self.s3_puts += 1
+        _s3_put_json_raw(key, data)
+
+    def commit(self) -> None:
+        """バッファした変更を並列で S3 に書き出す（失敗はログのみ）。"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self.s3_puts += len(dirty)
+            self.committed = True
+        if not dirty:
+            return
+        # タイムアウトは全件で同じ値にするため、ここで1回だけ決める
+        timeout = budget_timeout(HTTP_TIMEOUT_SEC, floor=_S3_WRITE_FLOOR_SEC)
+        if len(dirty) == 1:
+            key, data = next(iter(dirty.items()))
+            self._flush_one(key, data, timeout)
+            return
+        with ThreadPoolExecutor(max_workers=len(dirty)) as pool:
+            for key, data in dirty.items():
+                # 計測（tracing）の span が同じ呼び出しに記録されるよう ContextVar を引き継ぐ
+                pool.submit(contextvars.copy_context().run, self._flush_one, key, data, timeout)
+
+    @staticmethod
+    def _flush_one(key: str, data: Any, timeout: float) -> None:
+        try:
+            _s3_put_json_raw(key, data, timeout=timeout)
+        except Exception as e:
+            LOGGER.warning(f"[s3-uow] flush failed key={key} ex={type(e).__name__}")
+
+    def saved_ops(self) -> int:
+        return (self.reads + self.writes) - (self.s3_gets + self.s3_puts)
+
+_UOW: contextvars.ContextVar[Optional[S3UnitOfWork]] = contextvars.ContextVar("pico_s3_uow", default=None)
+
+@contextmanager
+def s3_unit_of_work(label: str = ""):
+    """このブロック内の S3 読み書きを1つの Unit of Work にまとめる（抜けるときに commit）。"""
+    uow = S3UnitOfWork(label)
+    token = _UOW.set(uow)
+    try:
+        yield uow
+    finally:
+        _UOW.reset(token)
+        uow.commit()
+        LOGGER.info(
+            f"[s3-uow] intent={label} reads={uow.reads} writes={uow.writes} "
+            f"s3_gets={uow.s3_gets} s3_puts={uow.s3_puts} saved={uow.saved_ops()}"
+        )
+
+def s3_get_json(key: str, default: Any) -> Any:
+    """JSON を読む（Unit of Work 内ならリクエスト中1回だけ S3 に取りに行く）。"""
+    uow = _UOW.get()
+    if uow is not None:
+        return uow.get(key, default)
+    return _s3_get_json_raw(key, default)
+
+def s3_put_json(key: str, data: Any, *, write_through: bool = False) -> None:
+    """JSON を書く（Unit of Work 内なら終了時にまとめて書き出す）。"""
+    uow = _UOW.get()
+    if uow is not None:
+        uow.put(key, data, write_through=write_through)
+        return
+    _s3_put_json_raw(key, data)
 
 # ==== ユーザー別の簡易KV（TestIntent等） ====
 def _user_key(handler_input) -> str:
@@ -14,66 +252,220 @@ def _user_key(handler_input) -> str:
     return f"{S3_PREFIX}/pico_persist/{uid}.json"
 
 def s3_store_load_user(handler_input) -> Dict[str, Any]:
-    key = _user_key(handler_input)
-    try:
-        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-        return json.loads(obj["Body"].read().decode("utf-8"))
-    except s3.exceptions.NoSuchKey:
-        return {}
-    except Exception:
-        return {}
+    return s3_get_json(_user_key(handler_input), {})
 
 def s3_store_save_user(handler_input, data: Dict[str, Any]) -> None:
-    key = _user_key(handler_input)
-    s3.put_object(
-        Bucket=S3_BUCKET, Key=key,
-        Body=json.dumps(data, ensure_ascii=False).encode("utf-8"),
-        ContentType="application/json; charset=utf-8"
-    )
-
-# ==== RAG（ユーザー別の軽量メモ） ====
+    # 保存の成否をその場で返したい（TestIntent）ので即時書き込み
+    s3_put_json(_user_key(handler_input), data, write_through=True)
+
+# ==== RAG（ユーザー別の軽量メモ。形式は rag_segments: 差分 + スナップショット + manifest） ====
 _RAG_DIR = f"{S3_PREFIX}/pico_rag"
+_RAG_ORPHAN_GRACE_SEC = 300  # manifest に載らなかったスナップショット（同時の圧縮に負けた方）を消すまでの猶予
+RAG_STATS = {"appends": 0, "reads": 0, "delta_gets": 0, "cache_hits": 0,
+             "compactions": 0, "compacted_deltas": 0, "compact_failures": 0, "migrated": 0}
+_RAG_STATS_LOCK = threading.Lock()
+_RAG_OBJECTS = None  # 変わらない差分・スナップショットの中身（キー -> JSON 文字列）
+_COMPACTING: set = set()
+_COMPACTING_LOCK = threading.Lock()
 
-def _rag_key(handler_input) -> str:
-    uid = handler_input.request_envelope.context.system.user.user_id or "anon"
+def _rag_bump(**values: int) -> None:
+    with _RAG_STATS_LOCK:
+        for k, v in values.items():
+            RAG_STATS[k] += v
+
+def _rag_uid(handler_input) -> str:
+    return handler_input.request_envelope.context.system.user.user_id or "anon"
+
+def _rag_prefix(uid: str) -> str:
+    return f"{_RAG_DIR}/{uid}/"
+
+def _rag_legacy_key(uid: str) -> str:
+    """1ファイルに全部を書き戻していた頃のキー（読むだけ。最初の圧縮でスナップショットに移す）。"""
     return f"{_RAG_DIR}/{uid}.json"
 
-def _rag_load(handler_input) -> List[Dict[str, Any]]:
-    key = _rag_key(handler_input)
+def _rag_objects():
+    global _RAG_OBJECTS
+    if _RAG_OBJECTS is None:
+        from cache_tiers import ByteLRU  # cache_tiers はこのモジュールを import するので遅らせる
+        _RAG_OBJECTS = ByteLRU(RAG_CACHE_MEM_BYTES)
+    return _RAG_OBJECTS
+
+def _rag_get_copy(key: str, *, immutable: bool = True) -> Any:
+    """
+    RAG のオブジェクトを、書き換えてよい新しいコピーで読む（Unit of Work が持つ値は他の読み手と共有なので触らない）。
+    差分・スナップショットは書いたら変わらないので、コンテナ内で覚えておける。
+    """
+    hit = _rag_objects().get(key) if immutable else None
+    if hit is not None:
+        _rag_bump(cache_hits=1)
+        return json.loads(hit["json"])
+    data = s3_get_json(key, None)
+    if data is None:
+        return None
+    text = json.dumps(data, ensure_ascii=False)
+    if immutable:
+        _rag_objects().put(key, {"json": text})
+    return json.loads(text)
+
+def _run_many(keys: List[str], fn) -> Dict[str, Any]:
+    """keys それぞれに fn を並行に呼び、キー -> 結果 を返す。"""
+    if len(keys) <= 1:
+        return {k: fn(k) for k in keys}
+    with ThreadPoolExecutor(max_workers=min(8, len(keys))) as pool:
+        futs = {k: pool.submit(contextvars.copy_context().run, fn, k) for k in keys}
+    return {k: f.result() for k, f in futs.items()}
+
+def _rag_read(uid: str) -> Tuple[Dict[str, Any], bool]:
+    """スナップショット（無ければ旧形式）に未圧縮の差分を重ねた RAG ドキュメントと、圧縮したほうがよいかを返す。"""
+    prefix = _rag_prefix(uid)
+    # manifest と一覧は互いに依存しないので並行に取る
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        f_manifest = pool.submit(contextvars.copy_context().run, s3_get_json, prefix + rag_segments.MANIFEST, None)
+        f_keys = pool.submit(contextvars.copy_context().run, s3_list_keys, prefix)
+    manifest = f_manifest.result() or {}
+    names = [k[len(prefix):] for k in f_keys.result()]
+    live = rag_segments.live_deltas(names, manifest)
+    base_key = prefix + manifest["snapshot"] if manifest.get("snapshot") else _rag_legacy_key(uid)
+    got = _run_many([base_key] + [prefix + n for n in live],
+                    lambda k: _rag_get_copy(k, immutable=k != _rag_legacy_key(uid)))
+    base = got.pop(base_key)
+    doc = rag_segments.from_legacy(base) if base is not None else rag_segments.empty_doc()
+    rag_segments.merge(doc, ((k[len(prefix):], d) for k, d in got.items()))
+    _rag_bump(reads=1, delta_gets=len(live))
+    migrate = not manifest and base is not None
+    return doc, len(live) >= max(1, RAG_COMPACT_DELTAS) or migrate
+
+def _rag_load(handler_input) -> Dict[str, Any]:
+    """
+    RAG ドキュメント {"v": 3, "items": [...], "index": {...}, "next_id": n, "bytes": b} を読む。
+    Unit of Work 内ならリクエスト中1回だけ組み立てる（このリクエストで足したメモも入る）。
+    差分が RAG_COMPACT_DELTAS 以上溜まっていたら、裏で圧縮を始める。
+    """
+    uid = _rag_uid(handler_input)
+    uow = _UOW.get()
+    memo_key = f"rag:{uid}"
+    if uow is not None and memo_key in uow.memo:
+        return uow.memo[memo_key]
+    doc, compact = _rag_read(uid)
+    if uow is not None:
+        doc = uow.memo.setdefault(memo_key, doc)
+    if compact:
+        start_rag_compaction(uid)
+    return doc
+
+@traced("rag.add_items")
+def rag_add_items(handler_input, new_items: List[Dict[str, Any]], snippet_max: int = 300):
+    """新しいメモを差分1つとして追記する（既にある (url, title) は足さない）。保持の上限は読むときと圧縮で効く。"""
+    doc = _rag_load(handler_input)
+    items = rag_segments.normalize_items(new_items, snippet_max, int(time.time()))
+    added = rag_segments.apply_items(doc, items)
+    if not added:
+        return
+    delta = {"v": rag_segments.FORMAT_VERSION, "items": [{k: v for k, v in it.items() if k != "id"} for it in added]}
+    key = _rag_prefix(_rag_uid(handler_input)) + rag_segments.delta_name()
+    s3_put_json(key, delta)
+    # 自分で書いた差分は次に読むとき取りに行かない（書き込みに失敗しても一覧に出ないので使われない）
+    _rag_objects().put(key, {"json": json.dumps(delta, ensure_ascii=False)})
+    _rag_bump(appends=1)
+
+def compact_rag(uid: str) -> bool:
+    """
+    uid の差分をスナップショットに畳み込む（圧縮）。Unit of Work は通さずに S3 へ直接読み書きする。
+    manifest・スナップショット・差分のどれかが読めなければ何も書かずにやめる（消えたように見える状態で上書きしない）。
+    """
+    prefix = _rag_prefix(uid)
+    try:
+        manifest = _s3_get_json_raw(prefix + rag_segments.MANIFEST, None, strict=True) or {}
+        names = [k[len(prefix):] for k in s3_list_keys(prefix)]
+        live = rag_segments.live_deltas(names, manifest)
+        legacy = None
+        if manifest.get("snapshot"):
+            hit = _rag_objects().get(prefix + manifest["snapshot"])
+            base = (json.loads(hit["json"]) if hit is not None
+                    else _s3_get_json_raw(prefix + manifest["snapshot"], None, strict=True))
+            if base is None:
+                raise LookupError(f"snapshot missing {manifest['snapshot']}")
+        else:
+            base = legacy = _s3_get_json_raw(_rag_legacy_key(uid), None, strict=True)
+        if not live and legacy is None:
+            return False
+        got = _run_many(live, lambda n: _s3_get_json_raw(prefix + n, None, strict=True))
+        missing = [n for n, d in got.items() if d is None]
+        if missing:
+            raise LookupError(f"delta missing {missing[0]}")  # 同時に走った圧縮が消した（その結果は manifest にある）
+        doc = rag_segments.merge(rag_segments.from_legacy(base) if base is not None else rag_segments.empty_doc(),
+                                 got.items())
+        snap = rag_segments.snapshot_name()
+        body = rag_segments.snapshot_body(doc)
+        _s3_put_json_raw(prefix + snap, body, timeout=HTTP_TIMEOUT_SEC, compress=True)
+        _rag_objects().put(prefix + snap, {"json": json.dumps(body, ensure_ascii=False)})
+        existing = set(names)
+        folded = set(manifest.get("folded") or ())
+        _s3_put_json_raw(prefix + rag_segments.MANIFEST, {
+            "v": rag_segments.FORMAT_VERSION, "snapshot": snap, "prev_snapshot": manifest.get("snapshot"),
+            "folded": sorted((folded & existing) | set(live)),
+            "items": len(doc["items"]), "bytes": doc["bytes"], "ts": int(time.time()),
+        }, timeout=HTTP_TIMEOUT_SEC)
+    except Exception as e:
+        _rag_bump(compact_failures=1)
+        LOGGER.warning(f"[rag] compaction failed uid={uid} ex={type(e).__name__}")
+        return False
+    # 消すのは1世代前の分（今の manifest を読む前の相手が、まだ前のスナップショットを読んでいるかもしれない）
+    now = time.time()
+    keep = {snap, manifest.get("snapshot"), manifest.get("prev_snapshot")}
+    stale = [n for n in folded if n in existing]
+    if manifest.get("prev_snapshot") in existing:
+        stale.append(manifest["prev_snapshot"])
+    stale += [n for n in names if n.startswith(rag_segments.SNAPSHOT_PREFIX) and n not in keep
+              and now - rag_segments.name_time(n) > _RAG_ORPHAN_GRACE_SEC]
+    _run_many(stale, lambda n: s3_delete_key(prefix + n, timeout=HTTP_TIMEOUT_SEC))
+    if legacy is not None:
+        s3_delete_key(_rag_legacy_key(uid), timeout=HTTP_TIMEOUT_SEC)
+        _rag_bump(migrated=1)
+    _rag_bump(compactions=1, compacted_deltas=len(live))
+    LOGGER.info(f"[rag] compacted uid={uid} deltas={len(live)} items={len(doc['items'])} bytes={doc['bytes']} "
+                f"deleted={len(stale)}{' migrated' if legacy is not None else ''}")
+    return True
+
+def _compact_once(uid: str) -> None:
     try:
-        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-        return json.loads(obj["Body"].read().decode("utf-8"))
-    except s3.exceptions.NoSuchKey:
-        return []
-    except Exception:
-        return []
-
-def _rag_save(handler_input, items: List[Dict[str, Any]]) -> None:
-    key = _rag_key(handler_input)
-    s3.put_object(
-        Bucket=S3_BUCKET, Key=key,
-        Body=json.dumps(items, ensure_ascii=False).encode("utf-8"),
-        ContentType="application/json; charset=utf-8"
-    )
-
-def rag_add_items(handler_input, new_items: List[Dict[str, Any]], max_items: int = 40, snippet_max: int = 300):
-    cur  = _rag_load(handler_input)
-    seen = {(it.get("url"), it.get("title")) for it in cur}
-    ts   = int(time.time())
-    for it in new_items:
-        title   = (it.get("title") or "無題").strip()[:120]
-        url     = (it.get("url") or "").strip()
-        snippet = (it.get("snippet") or title)[:snippet_max]
-        if (url, title) not in seen:
-            cur.append({"title": title, "url": url, "snippet": snippet, "ts": ts})
-    cur = cur[-max_items:]
-    _rag_save(handler_input, cur)
-
-def rag_top_snippets(handler_input, k: int = 5) -> List[str]:
-    items = _rag_load(handler_input)
-    return [f"■{it['title']}｜抜粋: {it['snippet']}" for it in items[-k:]]
-
-# ==== 直近のNotion検索結果（本文なし：id/title/urlのみ） ====
+        compact_rag(uid)
+    finally:
+        with _COMPACTING_LOCK:
+            _COMPACTING.discard(uid)
+
+def start_rag_compaction(uid: str) -> Optional[threading.Thread]:
+    """裏のスレッドで uid を圧縮する（同じ uid が圧縮中なら何もしない）。リクエストの予算・Unit of Work は引き継がない。"""
+    with _COMPACTING_LOCK:
+        if uid in _COMPACTING:
+            return None
+        _COMPACTING.add(uid)
+    th = threading.Thread(target=contextvars.Context().run, args=(_compact_once, uid),
+                          name="pico-rag-compact", daemon=True)
+    th.start()
+    return th
+
+def rag_preload(handler_input) -> None:
+    """RAG ドキュメントを先に Unit of Work へ読み込んでおく（他の I/O と並行に流す用）。"""
+    _rag_load(handler_input)
+
+@traced("rag.top_snippets")
+def rag_top_snippets(handler_input, k: int = 5, query: Optional[str] = None) -> List[str]:
+    """
+    query があれば BM25 で関連度の高い順に最大 k 件（一致しないメモは入れない）。
+    query が無いときは従来どおり直近 k 件。
+    """
+    doc = _rag_load(handler_input)
+    items = doc["items"]
+    if query is not None:
+        by_id = {it.get("id"): it for it in items}
+        ranked = [by_id[d] for d, _ in bm25_scores(doc["index"], query) if d in by_id]
+        items = list(reversed(ranked[:k]))  # 関連度の高いものをプロンプトの末尾側に
+    else:
+        items = items[-k:]
+    return [f"■{it['title']}｜抜粋: {it['snippet']}" for it in items]
+
+# ==== 直近のNotion検索結果（id/title/url/edited と、先読みできた本文 snippet） ====
 _NOTION_LAST_DIR = f"{S3_PREFIX}/pico_notion"
 
 def _notion_last_key(handler_input) -> str:
@@ -81,21 +473,43 @@ def _notion_last_key(handler_input) -> str:
     return f"{_NOTION_LAST_DIR}/{uid}.json"
 
 def save_last_notion_results(handler_input, items: List[Dict[str, str]]) -> None:
-    key = _notion_last_key(handler_input)
-    payload = [{"id": it.get("id"), "title": it.get("title"), "url": it.get("url")} for it in items]
-    s3.put_object(
-        Bucket=S3_BUCKET, Key=key,
-        Body=json.dumps({"items": payload, "ts": int(time.time())}, ensure_ascii=False).encode("utf-8"),
-        ContentType="application/json; charset=utf-8"
-    )
+    payload = []
+    for it in items:
+        row = {"id": it.get("id"), "title": it.get("title"), "url": it.get("url"), "edited": it.get("edited") or ""}
+        if it.get("snippet"):
+            row["snippet"] = it["snippet"]
+        if it.get("cursor"):
+            row["cursor"] = it["cursor"]  # 先読みした冒頭の節の続きの読み位置
+        payload.append(row)
+    s3_put_json(_notion_last_key(handler_input), {"items": payload, "ts": int(time.time())})
 
 def load_last_notion_results(handler_input) -> List[Dict[str, str]]:
-    key = _notion_last_key(handler_input)
-    try:
-        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-        data = json.loads(obj["Body"].read().decode("utf-8"))
-        return data.get("items", []) or []
-    except s3.exceptions.NoSuchKey:
-        return []
-    except Exception:
-        return []
+    data = s3_get_json(_notion_last_key(handler_input), {})
+    return data.get("items", []) or []
+
+# ==== 先回り生成した「続き」（pregen の background モード） ====
+_PREGEN_DIR = f"{S3_PREFIX}/pico_pregen"
+
+def _pregen_key(handler_input) -> str:
+    uid = handler_input.request_envelope.context.system.user.user_id or "anon"
+    return f"{_PREGEN_DIR}/{uid}.json"
+
+def save_pregenerated(handler_input, prompt: str, text: str) -> None:
+    s3_put_json(_pregen_key(handler_input), {"prompt": prompt, "text": text, "ts": int(time.time())})
+
+def load_pregenerated(handler_input) -> Dict[str, Any]:
+    data = s3_get_json(_pregen_key(handler_input), {})
+    return data if isinstance(data, dict) else {}
+
+# ==== asyncio 版（スレッドで実行。Unit of Work とデッドライン予算はそのまま引き継がれる） ====
+async def rag_preload_async(handler_input) -> None:
+    await asyncio.to_thread(rag_preload, handler_input)
+
+async def rag_add_items_async(handler_input, new_items: List[Dict[str, Any]], **kwargs) -> None:
+    await asyncio.to_thread(rag_add_items, handler_input, new_items, **kwargs)
+
+async def save_last_notion_results_async(handler_input, items: List[Dict[str, str]]) -> None:
+    await asyncio.to_thread(save_last_notion_results, handler_input, items)
+
+async def load_last_notion_results_async(handler_input) -> List[Dict[str, str]]:
+    return await asyncio.to_thread(load_last_notion_results, handler_input)
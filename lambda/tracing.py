@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+tracing.py
+- 1回の呼び出しの中の区間（span）を記録し、最後に CloudWatch EMF（Embedded Metric Format）の JSON を1行出す
+  - request_trace(label)  : lambda_handler を囲む。抜けるときに EMF を出す
+  - span(name)            : with で囲んだ区間の所要時間と結果（outcome）を記録
+  - traced(name)          : 関数に付けるデコレーター版（"" / [] / success=False も outcome に残す）
+  - traced_handler(h)     : ask-sdk ハンドラーの handle を span で包む
+  - annotate(**kv)        : いまの span にバイト数・トークン数などを足す（数値は加算）
+- span 名の "." より前（openai / notion / s3 / rag）ごとに時間・回数・失敗数を合計してメトリクスにする
+  （並行に走った span や、rag.* の中の s3.get のような入れ子もそれぞれ数えるので、合計は経過時間を超えうる）
+- TRACING=0 なら何も記録しない
+"""
+import json
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from config import TRACING, TRACE_NAMESPACE
+
+# span 名の接頭辞 -> メトリクス名の接頭辞
+UPSTREAMS = {"openai": "OpenAI", "notion": "Notion", "s3": "S3", "rag": "Rag"}
+
+class Trace:
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.props: Dict[str, Any] = {}
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            if not self.closed:  # 応答後に終わった裏のスレッド（先読み等）の分は捨てる
+                self.spans.append(rec)
+
+_TRACE: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("pico_trace", default=None)
+_SPAN: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("pico_span", default=None)
+
+def _print_line(line: str) -> None:
+    print(line, flush=True)  # EMF は1行まるごと JSON である必要があるので logging を通さない
+
+_EMITTER: Callable[[str], None] = _print_line
+
+def set_emitter(emitter: Callable[[str], None]) -> Callable[[str], None]:
+    """EMF の出力先を差し替える（テスト・ベンチマーク用）。前の出力先を返す。"""
+    global _EMITTER
+    prev, _EMITTER = _EMITTER, emitter
+    return prev
+
+def result_outcome(result: Any) -> str:
+    """握りつぶされた失敗を見分ける: success=False は fail、空の結果は empty。"""
+    if isinstance(result, dict) and result.get("success") is False:
+        return "fail"
+    if result == "" or result == [] or result == {}:
+        return "empty"
+    return "ok"
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    trace = _TRACE.get()
+    if trace is None:
+        yield {}
+        return
+    rec: Dict[str, Any] = dict(attrs, name=name)
+    token = _SPAN.set(rec)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        rec["outcome"] = f"error:{type(e).__name__}"
+        raise
+    finally:
+        rec["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        rec.setdefault("outcome", "ok")
+        _SPAN.reset(token)
+        trace.add(rec)
+
+def annotate(**values: Any) -> None:
+    rec = _SPAN.get()
+    if rec is None:
+        return
+    for k, v in values.items():
+        old = rec.get(k)
+        if isinstance(v, (int, float)) and not isinstance(v, bool) and isinstance(old, (int, float)):
+            rec[k] = old + v
+        else:
+            rec[k] = v
+
+def traced(name: str, *, outcome: Callable[[Any], str] = result_outcome):
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _TRACE.get() is None:
+                return fn(*args, **kwargs)
+            with span(name) as rec:
+                result = fn(*args, **kwargs)
+                rec.setdefault("outcome", outcome(result))  # 中で annotate(outcome=...) 済みならそちらを残す
+                return result
+        return wrapper
+    return deco
+
+def traced_handler(handler):
+    """ハンドラーの handle を span（handler.<クラス名>）で包んで返す。"""
+    handle = handler.handle
+    name = f"handler.{type(handler).__name__}"
+
+    @functools.wraps(handle)
+    def _handle(handler_input):
+        with span(name):
+            return handle(handler_input)
+    handler.handle = _handle
+    return handler
+
+def _json_size(obj: Any) -> int:
+    try:
+        return len(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    except Exception:
+        return 0
+
+def record_payload(event: Dict[str, Any], response: Optional[Dict[str, Any]]) -> None:
+    """リクエスト/応答/セッション属性のバイト数を記録する。"""
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    trace.props["RequestBytes"] = _json_size(event)
+    trace.props["ResponseBytes"] = _json_size(response or {})
+    trace.props["SessionBytes"] = _json_size((response or {}).get("sessionAttributes") or {})
+
+def build_emf(trace: Trace) -> Dict[str, Any]:
+    values: Dict[str, float] = {"TotalMs": round((time.perf_counter() - trace.started) * 1000, 2), "HandlerMs": 0.0}
+    for metric in UPSTREAMS.values():
+        values[f"{metric}Ms"] = 0.0
+        values[f"{metric}Calls"] = 0
+        values[f"{metric}Errors"] = 0
+    values["PromptTokens"] = 0
+    values["CompletionTokens"] = 0
+    values["NotionRateWaitMs"] = 0.0  # Notion のレート制限の順番待ち（NotionMs の内数）
+    values["NotionThrottles"] = 0     # 受けた 429
+    values["NotionRateTimeouts"] = 0  # 順番が予算内に来ず送らなかった呼び出し
+    values["OpenAIHedges"] = 0           # 2本目を送った回数
+    values["OpenAIHedgeWins"] = 0        # 2本目が先に届いた回数
+    values["OpenAIHedgeExtraTokens"] = 0  # 採らなかった方のトークン
+    for rec in trace.spans:
+        prefix = rec["name"].split(".", 1)[0]
+        if prefix == "handler":
+            values["HandlerMs"] += rec["ms"]
+            continue
+        metric = UPSTREAMS.get(prefix)
+        if metric is None:
+            continue
+        values[f"{metric}Ms"] += rec["ms"]
+        values[f"{metric}Calls"] += 1
+        if rec["outcome"] == "fail" or rec["outcome"].startswith("error"):
+            values[f"{metric}Errors"] += 1
+        values["PromptTokens"] += int(rec.get("prompt_tokens") or 0)
+        values["CompletionTokens"] += int(rec.get("completion_tokens") or 0)
+        values["NotionRateWaitMs"] += float(rec.get("rate_wait_ms") or 0)
+        values["NotionThrottles"] += int(rec.get("throttled") or 0)
+        values["NotionRateTimeouts"] += int(rec.get("rate_timeouts") or 0)
+        values["OpenAIHedges"] += int(rec.get("hedged") or 0)
+        values["OpenAIHedgeWins"] += int(rec.get("hedge_win") or 0)
+        values["OpenAIHedgeExtraTokens"] += int(rec.get("extra_tokens") or 0)
+    values.update(trace.props)
+    units = {k: ("Milliseconds" if k.endswith("Ms") else "Bytes" if k.endswith("Bytes") else "Count") for k in values}
+    doc: Dict[str, Any] = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": TRACE_NAMESPACE,
+                "Dimensions": [["Intent"], []],
+                "Metrics": [{"Name": k, "Unit": u} for k, u in units.items()],
+            }],
+        },
+        "Intent": trace.label,
+        "spans": trace.spans,  # メトリクスにはならない（Logs Insights で見る用）
+    }
+    doc.update({k: round(v, 2) if isinstance(v, float) else v for k, v in values.items()})
+    return doc
+
+def emit(trace: Trace) -> None:
+    with trace._lock:
+        trace.closed = True
+    try:
+        _EMITTER(json.dumps(build_emf(trace), ensure_ascii=False, separators=(",", ":")))
+    except Exception:
+        pass  # 計測の失敗で応答を落とさない
+
+@contextmanager
+def request_trace(label: str):
+    """1回の呼び出しを計測し、抜けるときに EMF を1行出す（TRACING=0 なら何もしない）。"""
+    if not TRACING:
+        yield None
+        return
+    trace = Trace(label)
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
+        emit(trace)
@@ -1,37 +1,268 @@
 # -*- coding: utf-8 -*-
 import os
-from typing import Optional, List, Dict
-from openai import OpenAI, APIError, APITimeoutError, RateLimitError
+import time
+import queue
+import logging
+import threading
+import importlib.util
+from typing import Any, Callable, Optional, List, Dict, Tuple, TYPE_CHECKING
 
-# 環境変数からAPIキーを取得（本番はSecretsまたは環境変数を使用）
-_OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
+from deadline import budget_timeout
+from tracing import span
+import llm_latency
+
+# openai（+ httpx / pydantic）は import だけで数百 ms かかるので、最初に LLM を呼ぶときに読み込む。
+# LaunchRequest など LLM を使わない要求のコールドスタートに載せない。
+if TYPE_CHECKING:
+    import httpx
+    from openai import OpenAI
+
+LOGGER = logging.getLogger(__name__)
 
 _DEFAULT_HTTP_TIMEOUT = 3.0  # 8s対策：1回の外部呼び出しは3秒で切る
 _MAX_TOKENS = 120            # 音声向けに短め
 
-def get_openai_client_from_utils(timeout_sec: Optional[float] = None) -> OpenAI:
-    timeout = float(timeout_sec or _DEFAULT_HTTP_TIMEOUT)
-    # ここは古いSDKでも通る安全な引数のみ
-    return OpenAI(api_key=_OPENAI_API_KEY, timeout=timeout)
+# ==== OpenAI クライアントのレジストリ（ウォーム起動間で使い回す） ====
+# Lambda のコンテナが生きている間はモジュール変数が残るので、
+# httpx のコネクションプールごと保持して TLS ハンドシェイクを省く。
+_POOL_MAX_CONNECTIONS  = int(os.environ.get("OPENAI_POOL_MAX_CONNECTIONS", "4"))
+_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_POOL_KEEPALIVE_SEC", "60"))
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None  # httpx[http2] が入っていれば使う
+
+_CLIENTS: Dict[Tuple[str, str], "OpenAI"] = {}
+_CLIENTS_LOCK = threading.Lock()
+_POOL_STATS = {
+    "hits": 0,             # レジストリから既存クライアントを返した回数
+    "clients": 0,          # 新規に作ったクライアント数
+    "requests": 0,         # HTTP リクエスト数
+    "new_connections": 0,  # TCP 接続を張った回数
+    "reconnects": 0,       # 切れた接続の張り直し（同時に使う本数が増えただけの接続は数えない）
+}
+_STATS_LOCK = threading.Lock()
+
+def _bump(name: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _POOL_STATS[name] += n
+
+def _make_pool_tracer(holder: Dict[str, Any]):
+    """
+    httpcore の trace 拡張で接続の新規/張り直しを数える（クライアント単位）。
+    張った時点でプールにある接続の数が、これまでの最多以下なら、前の接続が切れて（期限切れで）抜けた分の
+    張り直し。最多を超えたなら同時に使う本数が増えただけ（ヘッジの2本目など）なので reconnects には数えない。
+    """
+    seen = {"peak": 0}
+
+    def _trace(event_name: str, info) -> None:
+        if event_name != "connection.connect_tcp.complete":
+            return
+        _bump("new_connections")
+        pool = holder.get("pool")
+        live = len(getattr(pool, "connections", None) or ()) or 1  # いま張った接続も含む
+        with _STATS_LOCK:
+            if live <= seen["peak"]:
+                _POOL_STATS["reconnects"] += 1
+            seen["peak"] = max(seen["peak"], live)
+
+    def _on_request(request: "httpx.Request") -> None:
+        _bump("requests")
+        request.extensions["trace"] = _trace
+
+    return _on_request
+
+def _build_http_client() -> "httpx.Client":
+    import httpx
+    limits = httpx.Limits(
+        max_connections=_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=_POOL_MAX_CONNECTIONS,
+        keepalive_expiry=_POOL_KEEPALIVE_EXPIRY,
+    )
+    holder: Dict[str, Any] = {}
+    client = httpx.Client(
+        http2=_HTTP2_AVAILABLE,
+        limits=limits,
+        timeout=_DEFAULT_HTTP_TIMEOUT,  # 実際のタイムアウトは呼び出しごとに指定する
+        event_hooks={"request": [_make_pool_tracer(holder)]},
+    )
+    holder["pool"] = getattr(client._transport, "_pool", None)  # httpcore.ConnectionPool（接続の本数を見るだけ）
+    return client
+
+def get_openai_client_from_utils(timeout_sec: Optional[float] = None) -> "OpenAI":
+    """
+    プール付き OpenAI クライアントを返す（同じ API キー/ベースURLなら使い回し）。
+
+    timeout_sec は互換のために残しているだけで、クライアントには持たせない。
+    タイムアウトは call_openai_chat_once で呼び出しごとに指定する。
+    """
+    # config が .env を読み込んだ後の値を見るため、呼び出し時に取得する
+    api_key  = os.environ.get("OPENAI_API_KEY", "")
+    base_url = os.environ.get("OPENAI_BASE_URL", "")
+    key = (api_key, base_url)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        _bump("hits")
+        return client
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url or None,
+                timeout=_DEFAULT_HTTP_TIMEOUT,
+                max_retries=0,  # SDK 内の自動リトライは残り予算を見ないので使わない
+                http_client=_build_http_client(),
+            )
+            _CLIENTS[key] = client
+            _bump("clients")
+        else:
+            _bump("hits")
+    return client
+
+def get_openai_pool_stats() -> Dict[str, int]:
+    """プール統計のスナップショット（本番ログで再利用率を確認する用）。"""
+    with _STATS_LOCK:
+        return dict(_POOL_STATS, http2=int(_HTTP2_AVAILABLE))
 
 def call_openai_chat_once(
-    client: OpenAI,
+    client: "OpenAI",
     model: str,
     messages: List[Dict[str, str]],
     *,
     timeout_sec: Optional[float] = None,
     max_tokens: int = _MAX_TOKENS,
 ) -> str:
-    """Chat Completions を1回だけ呼ぶ（失敗時は空文字で返す）。"""
-    t = float(timeout_sec or _DEFAULT_HTTP_TIMEOUT)
+    """Chat Completions を1回だけ呼ぶ（失敗時は空文字で返す）。タイムアウトは残り予算で切り詰める。"""
+    t = budget_timeout(float(timeout_sec or _DEFAULT_HTTP_TIMEOUT))
+    with span("openai.chat", model=model) as rec:
+        rec["bytes_out"] = sum(len(m.get("content") or "") for m in messages)
+        t0 = time.monotonic()
+        try:
+            resp = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                timeout=t
+            )
+            text = (resp.choices[0].message.content or "").strip()
+            _record_usage(rec, getattr(resp, "usage", None))
+            rec["bytes_in"] = len(text)
+            rec["outcome"] = "ok" if text else "empty"
+            if text:
+                # 一括の呼び出しは最初の出力の時刻が分からないので "total" だけ（"first" に混ぜるとヘッジの閾値が伸びる）
+                llm_latency.record(model, "total", time.monotonic() - t0)
+            return text
+        except Exception as e:  # APITimeoutError / RateLimitError / APIError も含む
+            rec["outcome"] = f"error:{type(e).__name__}"
+            return ""  # 上位で即収束し「続けて」を促す
+        finally:
+            LOGGER.debug(f"[openai] pool={get_openai_pool_stats()}")
+
+def _record_usage(rec: Dict[str, object], usage) -> None:
+    if usage is None:
+        return
+    rec["prompt_tokens"] = int(getattr(usage, "prompt_tokens", 0) or 0)
+    rec["completion_tokens"] = int(getattr(usage, "completion_tokens", 0) or 0)
+
+def pump_chat_stream(client: "OpenAI", model: str, messages: List[Dict[str, str]], max_tokens: int, timeout: float,
+                     put: Callable[[str, Any], None], holder: Dict[str, Any]) -> None:
+    """
+    ストリームを受けて put(kind, value) に流す（ワーカースレッドで動かす）。
+    kind: delta / usage / finish / end / error。holder["stream"] にストリームを置く。
+    holder["cancelled"] が立ったら、次のチャンクで（まだ応答待ちなら応答が来た時点で）閉じて抜ける。
+    """
     try:
-        resp = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model=model,
             messages=messages,
             max_tokens=max_tokens,
-            timeout=t
+            stream=True,
+            stream_options={"include_usage": True},  # 最後のチャンクでトークン数を受け取る
+            timeout=timeout
         )
-        text = (resp.choices[0].message.content or "").strip()
-        return text
-    except (APITimeoutError, RateLimitError, APIError, Exception):
-        return ""  # 上位で即収束し「続けて」を促す
+        holder["stream"] = stream
+        for chunk in stream:
+            if holder.get("cancelled"):
+                break
+            if getattr(chunk, "usage", None):
+                put("usage", chunk.usage)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                put("delta", choice.delta.content)
+            if choice.finish_reason:
+                put("finish", choice.finish_reason)
+        if holder.get("cancelled"):
+            close_stream(holder)
+        put("end", None)
+    except Exception as e:
+        put("error", e)
+
+def close_stream(holder: Dict[str, Any]) -> None:
+    """残りの生成を捨てる（接続もプールへ戻さず閉じる）。"""
+    stream = holder.get("stream")
+    if stream is None:
+        return
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+def call_openai_chat_stream(
+    client: "OpenAI",
+    model: str,
+    messages: List[Dict[str, str]],
+    *,
+    timeout_sec: Optional[float] = None,
+    max_tokens: int = _MAX_TOKENS,
+) -> Tuple[str, bool]:
+    """
+    Chat Completions をストリーミングで受け取る。
+    timeout_sec（残り予算で切り詰め）に達したら、そこまでに届いた本文で打ち切る。
+
+    Returns:
+        (text, complete): complete は finish_reason == "stop" まで受け取れたか
+    """
+    t = budget_timeout(float(timeout_sec or _DEFAULT_HTTP_TIMEOUT))
+    stop_at = time.monotonic() + t
+    events: "queue.Queue[Tuple[str, object]]" = queue.Queue()
+    holder: Dict[str, Any] = {}
+
+    parts: List[str] = []
+    complete = False
+    with span("openai.stream", model=model) as rec:
+        rec["bytes_out"] = sum(len(m.get("content") or "") for m in messages)
+        # 受信はワーカースレッドで行い、こちらは stop_at で確実に打ち切れるようにする
+        t0 = time.monotonic()
+        threading.Thread(target=pump_chat_stream, daemon=True,
+                         args=(client, model, messages, max_tokens, t,
+                               lambda kind, val: events.put((kind, val)), holder)).start()
+        while True:
+            left = stop_at - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                kind, val = events.get(timeout=left)
+            except queue.Empty:
+                break
+            if kind == "delta":
+                if not parts:
+                    llm_latency.record(model, "first", time.monotonic() - t0)
+                parts.append(val)
+            elif kind == "finish":
+                complete = (val == "stop")  # "length" は途中切れとして扱う
+                if complete:
+                    llm_latency.record(model, "total", time.monotonic() - t0)
+            elif kind == "usage":
+                _record_usage(rec, val)
+            else:
+                if kind == "error":
+                    rec["outcome"] = f"error:{type(val).__name__}"
+                break
+        if not complete:
+            holder["cancelled"] = True
+            close_stream(holder)
+        rec["bytes_in"] = sum(len(p) for p in parts)
+        rec.setdefault("outcome", "ok" if complete else "partial" if parts else "empty")
+    LOGGER.debug(f"[openai] stream chars={sum(len(p) for p in parts)} complete={complete}")
+    return "".join(parts).strip(), complete